@@ -0,0 +1,376 @@
+"""
+语音识别引擎模块
+Whisper 各档模型和 Vosk 统一为同一接口：load() 加载，transcribe(audio, fs) 返回 (文本, 各阶段耗时)。
+启动时在测速录音上测量各引擎的实时率（识别耗时 / 语音时长），选出满足延迟目标的最准确引擎；
+运行中识别持续超出预算（CPU 负载高或降频）时自动降到更快的一档。
+
+重新测速：python asr_engine.py --probe
+"""
+import os
+import json
+import time
+import wave
+import argparse
+import platform
+import threading
+import numpy as np
+from config import asr_model, asr_candidates, asr_target_rtf, asr_calibration_clip, asr_probe_cache
+from config import asr_downgrade_after, asr_worker_enabled, vosk_model_path
+import tracing
+
+class WhisperEngine:
+    """Whisper 识别引擎，model_name 为 tiny/base/small 等
+
+    asr_worker_enabled 时模型加载在独立的识别进程中（见 asr_worker.py），否则加载在本进程。
+    """
+
+    def __init__(self, model_name, use_worker=asr_worker_enabled):
+        self.model_name = model_name
+        self.name = f"whisper-{model_name}"
+        self.use_worker = use_worker
+        self.worker = None
+        self.loaded = False
+
+    def load(self):
+        if self.use_worker:
+            if self.worker is None:
+                from asr_worker import WhisperWorker
+                self.worker = WhisperWorker(self.model_name)
+            self.worker.start()
+        else:
+            from whisper_input import load_model
+            load_model(self.model_name)
+        self.loaded = True
+
+    def unload(self):
+        if self.worker is not None:
+            print(self.worker.report())
+            self.worker.close()
+            self.worker = None
+        elif self.loaded:
+            from whisper_input import unload_model
+            unload_model(self.model_name)
+        self.loaded = False
+
+    def transcribe(self, audio, fs=16000):
+        if self.use_worker:
+            if self.worker is None:
+                self.load()
+            return self.worker.transcribe(audio, fs)
+        from whisper_input import transcribe_buffer
+        return transcribe_buffer(audio, fs, self.model_name)
+
+class VoskEngine:
+    """Vosk 识别引擎，准确度低于 Whisper，但在树莓派上远快于实时"""
+
+    name = "vosk"
+
+    def __init__(self, model_path=vosk_model_path):
+        self.model_path = model_path
+        self.model = None
+
+    def load(self):
+        if self.model is None:
+            import vosk
+            self.model = vosk.Model(self.model_path)
+
+    def unload(self):
+        self.model = None
+
+    def transcribe(self, audio, fs=16000):
+        import vosk
+        from whisper_input import trim_silence
+
+        timings = {}
+        t0 = time.perf_counter()
+        audio = trim_silence(np.asarray(audio, dtype=np.float32).reshape(-1), fs)
+        timings["trim"] = (time.perf_counter() - t0) * 1000
+        if len(audio) == 0:
+            timings["decode"] = 0.0
+            return "", timings
+
+        t0 = time.perf_counter()
+        with tracing.span("asr.decode", model=self.name, audio_ms=len(audio) * 1000 // fs):
+            self.load()
+            rec = vosk.KaldiRecognizer(self.model, fs)
+            rec.AcceptWaveform((np.clip(audio, -1.0, 1.0) * 32767).astype("<i2").tobytes())
+            text = json.loads(rec.FinalResult()).get("text", "")
+        timings["decode"] = (time.perf_counter() - t0) * 1000
+        # Vosk 中文结果按字词以空格分隔
+        return text.replace(" ", ""), timings
+
+# 引擎名称 -> 创建函数，可用 register_engine() 接入其他引擎
+ENGINES = {
+    "whisper-tiny": lambda: WhisperEngine("tiny"),
+    "whisper-base": lambda: WhisperEngine("base"),
+    "whisper-small": lambda: WhisperEngine("small"),
+    "vosk": VoskEngine,
+}
+
+def register_engine(name, factory):
+    """注册识别引擎
+
+    Args:
+        name: 引擎名称
+        factory: 无参数的创建函数，返回带 name/load/unload/transcribe 的对象
+    """
+    ENGINES[name] = factory
+
+def create_engine(name):
+    """按名称创建引擎（未加载）"""
+    if name not in ENGINES:
+        raise ValueError(f"未知的识别引擎: {name}，可选 {', '.join(ENGINES)}")
+    return ENGINES[name]()
+
+def load_calibration_clip(path=asr_calibration_clip):
+    """读取测速录音（16 位单声道 WAV），不存在时生成 3 秒谐波合成音频
+
+    Returns:
+        (float32 音频, 采样率)
+    """
+    if os.path.exists(path):
+        with wave.open(path, "rb") as f:
+            data = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+            return data.astype(np.float32) / 32768, f.getframerate()
+
+    fs = 16000
+    t = np.arange(3 * fs) / fs
+    # 基频缓慢变化的谐波信号，外加少量噪声，解码负载接近一句短语音
+    f0 = 160 + 40 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / fs
+    audio = sum(0.08 / k * np.sin(k * phase) for k in range(1, 8))
+    audio += np.random.default_rng(0).standard_normal(len(t)) * 0.003
+    return audio.astype(np.float32), fs
+
+def measure_rtf(engine, audio, fs):
+    """测量引擎在一段音频上的实时率，第一次识别用于预热不计入
+
+    Returns:
+        识别耗时 / 音频时长
+    """
+    engine.transcribe(audio, fs)
+    start = time.perf_counter()
+    engine.transcribe(audio, fs)
+    return (time.perf_counter() - start) / (len(audio) / fs)
+
+def system_load():
+    """读取 1 分钟平均负载和 CPU 温度（摄氏度，读不到时为 None）"""
+    load = os.getloadavg()[0] if hasattr(os, "getloadavg") else None
+    temperature = None
+    try:
+        with open("/sys/class/thermal/thermal_zone0/temp") as f:
+            temperature = int(f.read().strip()) / 1000
+    except (OSError, ValueError):
+        pass
+    return load, temperature
+
+def probe(candidates=asr_candidates, target_rtf=asr_target_rtf, clip_path=asr_calibration_clip):
+    """按准确度从高到低测速，选出第一个满足实时率目标的引擎
+
+    找到满足目标的引擎后不再测更快的档位；都不满足时选实测最快的。
+
+    Returns:
+        (选中的引擎名称, {引擎名称: 实时率，加载失败为 None}, 已加载的选中引擎)；
+        都不满足目标时最快的引擎已在测速后卸载，第三项为 None
+    """
+    audio, fs = load_calibration_clip(clip_path)
+    results = {}
+    selected = None
+    loaded = None
+    for name in candidates:
+        engine = create_engine(name)
+        try:
+            engine.load()
+            rtf = measure_rtf(engine, audio, fs)
+        except Exception as e:
+            print(f"识别引擎 {name} 不可用: {e}")
+            results[name] = None
+            engine.unload()
+            continue
+
+        results[name] = rtf
+        print(f"识别引擎 {name}: 实时率 {rtf:.2f}")
+        if rtf <= target_rtf:
+            # 选中的引擎保持加载交给调用方直接使用，避免再加载一份（识别进程、模型内存）
+            selected = name
+            loaded = engine
+            break
+        engine.unload()
+
+    if selected is None:
+        measured = {name: rtf for name, rtf in results.items() if rtf is not None}
+        if not measured:
+            raise RuntimeError("没有可用的语音识别引擎")
+        selected = min(measured, key=measured.get)
+        print(f"没有引擎满足实时率 {target_rtf}，使用最快的 {selected}")
+    return selected, results, loaded
+
+def _probe_key(candidates, target_rtf, clip_path):
+    return {
+        "machine": platform.machine(),
+        "node": platform.node(),
+        "candidates": list(candidates),
+        "target_rtf": target_rtf,
+        "clip": clip_path if os.path.exists(clip_path) else None,
+    }
+
+def select_engine(candidates=asr_candidates, target_rtf=asr_target_rtf, clip_path=asr_calibration_clip,
+                  cache_path=asr_probe_cache, reprobe=False):
+    """选择识别引擎，同一台机器上复用上次的测速结果
+
+    Returns:
+        (选中的引擎名称, 测速时已加载的该引擎)；使用缓存结果或选中的引擎已卸载时第二项为 None，
+        调用方负责使用或卸载它
+    """
+    key = _probe_key(candidates, target_rtf, clip_path)
+    if not reprobe and os.path.exists(cache_path):
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached.get("key") == key:
+                return cached["selected"], None
+        except (OSError, ValueError, KeyError):
+            pass
+
+    selected, results, engine = probe(candidates, target_rtf, clip_path)
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"key": key, "selected": selected, "results": results}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, cache_path)
+    return selected, engine
+
+class AdaptiveASR:
+    """带运行时降级的识别引擎
+
+    每次识别后检查耗时是否超出预算，连续 downgrade_after 次超出时换用候选列表中更快的下一档。
+    Whisper 会把输入补齐到 30 秒再解码，短句的识别耗时并不随时长等比例缩短，
+    所以预算按 max(语音时长, 测速录音时长) 计算。
+    """
+
+    def __init__(self, name, candidates=asr_candidates, target_rtf=asr_target_rtf,
+                 downgrade_after=asr_downgrade_after, reference_seconds=3.0, engine=None):
+        """
+        Args:
+            name: 初始引擎名称
+            candidates: 候选引擎，按准确度从高到低
+            target_rtf: 实时率目标
+            downgrade_after: 连续超出预算多少次后降级
+            reference_seconds: 测速录音时长（秒）
+            engine: 已创建（如测速时已加载）的初始引擎，为空时按 name 创建
+        """
+        self.candidates = list(candidates) if name in candidates else [name]
+        self.position = self.candidates.index(name)
+        self.target_rtf = target_rtf
+        self.downgrade_after = downgrade_after
+        self.reference_seconds = reference_seconds
+        self.lock = threading.Lock()
+        self.engine = engine if engine is not None else create_engine(name)
+        self.over_budget = 0
+        self.downgrades = 0
+
+    @property
+    def name(self):
+        return self.engine.name
+
+    def load(self):
+        self.engine.load()
+
+    def transcribe(self, audio, fs=16000):
+        """识别一段音频，必要时降级
+
+        Returns:
+            (识别文本, 各阶段耗时字典，单位毫秒)
+        """
+        engine = self.engine
+        start = time.perf_counter()
+        text, timings = engine.transcribe(audio, fs)
+        elapsed = time.perf_counter() - start
+
+        seconds = len(np.asarray(audio).reshape(-1)) / fs
+        budget = self.target_rtf * max(seconds, self.reference_seconds)
+        with self.lock:
+            if engine is not self.engine:
+                return text, timings
+            self.over_budget = self.over_budget + 1 if elapsed > budget else 0
+            if self.over_budget >= self.downgrade_after:
+                self._downgrade(elapsed, budget)
+        return text, timings
+
+    def _downgrade(self, elapsed, budget):
+        """换用下一个可以加载的更快引擎"""
+        self.over_budget = 0
+        load, temperature = system_load()
+        while self.position + 1 < len(self.candidates):
+            self.position += 1
+            engine = create_engine(self.candidates[self.position])
+            try:
+                engine.load()
+            except Exception as e:
+                print(f"识别引擎 {engine.name} 不可用: {e}")
+                continue
+            load_text = "未知" if load is None else f"{load:.2f}"
+            temperature_text = "未知" if temperature is None else f"{temperature:.0f}°C"
+            print(f"识别耗时 {elapsed * 1000:.0f}ms 连续超出预算 {budget * 1000:.0f}ms"
+                  f"（负载 {load_text}, CPU 温度 {temperature_text}），{self.engine.name} 降级为 {engine.name}")
+            self.engine.unload()
+            self.engine = engine
+            self.downgrades += 1
+            return
+        print(f"识别耗时连续超出预算，但 {self.engine.name} 已是最快的引擎")
+
+asr = None
+asr_lock = threading.Lock()
+fixed_engines = {}
+
+def get_asr(name=None):
+    """获取识别引擎
+
+    Args:
+        name: 引擎名称（如 "whisper-base"），为空时使用 config.asr_model 指定或自动选择的引擎
+
+    Returns:
+        已加载的引擎
+    """
+    global asr
+    with asr_lock:
+        if name is not None:
+            if name not in fixed_engines:
+                engine = create_engine(name)
+                engine.load()
+                fixed_engines[name] = engine
+            return fixed_engines[name]
+
+        if asr is None:
+            selected, engine = select_engine() if asr_model == "auto" else (asr_model, None)
+            clip, fs = load_calibration_clip()
+            asr = AdaptiveASR(selected, reference_seconds=len(clip) / fs, engine=engine)
+            print(f"语音识别引擎: {asr.name}")
+            asr.load()
+        return asr
+
+def close_engines():
+    """卸载所有已加载的引擎（退出前调用，结束识别进程并释放共享内存）"""
+    global asr
+    with asr_lock:
+        if asr is not None:
+            asr.engine.unload()
+            asr = None
+        for engine in fixed_engines.values():
+            engine.unload()
+        fixed_engines.clear()
+
+def main():
+    """测速入口"""
+    parser = argparse.ArgumentParser(description="语音识别引擎测速")
+    parser.add_argument("--probe", action="store_true", help="忽略缓存重新测速")
+    parser.add_argument("--target", type=float, default=asr_target_rtf, help="实时率目标")
+    parser.add_argument("--clip", default=asr_calibration_clip, help="测速录音（16 位单声道 WAV）")
+    args = parser.parse_args()
+
+    selected, engine = select_engine(target_rtf=args.target, clip_path=args.clip, reprobe=args.probe)
+    if engine is not None:
+        engine.unload()
+    print(f"选中的识别引擎: {selected}")
+
+if __name__ == "__main__":
+    main()
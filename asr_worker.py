@@ -0,0 +1,267 @@
+"""
+Whisper 识别进程
+Whisper 解码时 torch 只部分释放 GIL，放在主进程里会让表情动画掉帧、对话流程卡住。
+这里把模型加载和解码放到独立的子进程：音频写入 multiprocessing.shared_memory 环形缓冲区，
+队列里只传 (任务编号, 起点, 长度, 采样率) 这样的小元组，不序列化数组；识别结果经结果队列返回。
+
+子进程的 torch 线程数和绑定的 CPU 核心可在 config 中设置；子进程崩溃或超时会被自动重启，
+主进程只把这一次识别当作失败处理。
+"""
+import os
+import time
+import queue
+import signal
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from config import asr_worker_threads, asr_worker_cores, asr_worker_ring_seconds, asr_worker_timeout
+from config import asr_worker_load_timeout
+import tracing
+
+class AudioRing:
+    """共享内存中的 float32 环形缓冲区，主进程写入，识别进程按 (起点, 长度) 读取"""
+
+    def __init__(self, shm, capacity):
+        """
+        Args:
+            shm: SharedMemory 实例
+            capacity: 缓冲区容量（采样点）
+        """
+        self.shm = shm
+        self.capacity = capacity
+        self.samples = np.ndarray((capacity,), dtype=np.float32, buffer=shm.buf)
+        self.position = 0
+
+    def write(self, audio):
+        """写入一段音频，超过容量时只保留最后 capacity 个采样点
+
+        Returns:
+            (起点, 长度)
+        """
+        audio = np.asarray(audio, dtype=np.float32).reshape(-1)[-self.capacity:]
+        start, n = self.position, len(audio)
+        first = min(n, self.capacity - start)
+        self.samples[start:start + first] = audio[:first]
+        self.samples[:n - first] = audio[first:]
+        self.position = (start + n) % self.capacity
+        return start, n
+
+    def read(self, start, n):
+        """复制出一段音频"""
+        end = start + n
+        if end <= self.capacity:
+            return self.samples[start:end].copy()
+        return np.concatenate([self.samples[start:], self.samples[:end - self.capacity]])
+
+    def close(self):
+        # 先释放数组视图，否则共享内存无法关闭
+        self.samples = None
+        self.shm.close()
+
+def worker_main(shm_name, capacity, model_name, threads, cores, jobs, results):
+    """识别进程入口：加载一次模型，之后循环处理任务，收到 None 退出"""
+    # Ctrl+C 由主进程处理，子进程由主进程关闭
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if cores and hasattr(os, "sched_setaffinity"):
+        # 只绑定本机存在的核心，配置按 4 核写在核心更少的机器上也能运行
+        cores = set(cores) & os.sched_getaffinity(0)
+        if cores:
+            os.sched_setaffinity(0, cores)
+    # 在导入 torch 之前设置，OpenMP 线程池按此大小创建
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    ring = AudioRing(shared_memory.SharedMemory(name=shm_name), capacity)
+
+    from whisper_input import load_model, transcribe_buffer
+    started = time.perf_counter()
+    try:
+        import torch
+        torch.set_num_threads(threads)
+        load_model(model_name)
+    except Exception as e:
+        results.put((None, "", {}, f"加载模型失败: {e}"))
+        ring.close()
+        return
+    results.put((None, "", {"load": (time.perf_counter() - started) * 1000}, None))
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        job_id, start, n, fs = job
+        try:
+            text, timings = transcribe_buffer(ring.read(start, n), fs, model_name)
+            results.put((job_id, text, timings, None))
+        except Exception as e:
+            results.put((job_id, "", {}, str(e)))
+    ring.close()
+
+class WhisperWorker:
+    """主进程一侧的识别进程管理：提交任务、等待结果、崩溃重启"""
+
+    def __init__(self, model_name, threads=asr_worker_threads, cores=asr_worker_cores,
+                 ring_seconds=asr_worker_ring_seconds, timeout=asr_worker_timeout, fs=16000):
+        """
+        Args:
+            model_name: Whisper 模型名称
+            threads: 子进程 torch 线程数
+            cores: 子进程绑定的 CPU 核心编号列表，为空不绑定
+            ring_seconds: 共享环形缓冲区时长（秒，按 fs 计算容量）
+            timeout: 单次识别的最长等待秒数，超时视为卡死并重启
+            fs: 计算缓冲区容量用的采样率
+        """
+        self.model_name = model_name
+        self.threads = threads
+        self.cores = list(cores) if cores else None
+        self.timeout = timeout
+        self.capacity = int(ring_seconds * fs)
+        # 主进程里有录音、播放、渲染等线程，fork 出来的子进程可能继承到被占用的锁，用 spawn 启动
+        self.context = multiprocessing.get_context("spawn")
+        self.lock = threading.Lock()
+        self.ring = None
+        self.process = None
+        self.jobs = None
+        self.results = None
+        self.next_id = 0
+        self.completed = 0
+        self.restarts = 0
+        self.decode_ms = 0.0
+        self.overhead_ms = 0.0
+
+    def start(self):
+        """创建共享内存，启动识别进程并等待模型加载完成"""
+        with self.lock:
+            self._ensure_started()
+
+    def _ensure_started(self):
+        if self.ring is None:
+            shm = shared_memory.SharedMemory(create=True, size=self.capacity * 4)
+            self.ring = AudioRing(shm, self.capacity)
+        if self.process is None:
+            self._spawn()
+
+    def _spawn(self):
+        """启动识别进程并等待模型加载完成"""
+        # 队列随进程一起重建，崩溃进程留下的半条消息不会影响新进程
+        self.jobs = self.context.Queue()
+        self.results = self.context.Queue()
+        self.process = self.context.Process(
+            target=worker_main, name=f"asr-{self.model_name}", daemon=True,
+            args=(self.ring.shm.name, self.capacity, self.model_name, self.threads, self.cores,
+                  self.jobs, self.results))
+        self.process.start()
+
+        deadline = time.perf_counter() + asr_worker_load_timeout
+        while True:
+            try:
+                _, _, timings, error = self.results.get(timeout=0.5)
+                break
+            except queue.Empty:
+                if not self.process.is_alive():
+                    error = f"识别进程启动失败（退出码 {self.process.exitcode}）"
+                    break
+                if time.perf_counter() > deadline:
+                    self.process.kill()
+                    error = f"识别进程 {asr_worker_load_timeout} 秒内没有加载完模型"
+                    break
+        if error:
+            self.process.join(1)
+            self.process = None
+            raise RuntimeError(error)
+        print(f"识别进程已加载 Whisper {self.model_name} 模型（{timings['load']:.0f}ms，pid {self.process.pid}）")
+
+    def _restart(self, reason):
+        """结束当前进程（如果还在）并重新启动"""
+        print(f"识别进程{reason}，正在重启")
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(1)
+        self.process = None
+        self.restarts += 1
+        self._spawn()
+
+    def _wait(self, job_id, started):
+        """等待指定任务的结果
+
+        Returns:
+            (文本, 耗时字典)；进程退出或超时（已重启）返回 None
+        """
+        while True:
+            try:
+                result_id, text, timings, error = self.results.get(timeout=0.5)
+            except queue.Empty:
+                if not self.process.is_alive():
+                    self._restart(f"异常退出（退出码 {self.process.exitcode}）")
+                    return None
+                if time.perf_counter() - started > self.timeout:
+                    self._restart(f"超过 {self.timeout} 秒没有返回")
+                    return None
+                continue
+            if result_id != job_id:
+                continue
+            if error:
+                raise RuntimeError(error)
+            return text, timings
+
+    def transcribe(self, audio, fs=16000):
+        """在识别进程中识别一段音频；进程崩溃时重启后重试一次
+
+        Returns:
+            (识别文本, 各阶段耗时字典，单位毫秒)
+        """
+        audio = np.asarray(audio, dtype=np.float32).reshape(-1)
+        if len(audio) > self.capacity:
+            print(f"录音超过识别缓冲区容量，只识别最后 {self.capacity / fs:.0f} 秒")
+        with self.lock, tracing.span("asr.decode", model=self.model_name, audio_ms=len(audio) * 1000 // fs,
+                                     worker=True):
+            self._ensure_started()
+            start, n = self.ring.write(audio)
+            for _ in range(2):
+                self.next_id += 1
+                job_id = self.next_id
+                started = time.perf_counter()
+                self.jobs.put((job_id, start, n, fs))
+                result = self._wait(job_id, started)
+                if result is not None:
+                    break
+            else:
+                raise RuntimeError("识别进程连续异常，本次识别失败")
+
+        text, timings = result
+        overhead = (time.perf_counter() - started) * 1000 - sum(timings.values())
+        self.completed += 1
+        self.decode_ms += timings.get("decode", 0.0)
+        self.overhead_ms += overhead
+        timings["ipc"] = overhead
+        return text, timings
+
+    def close(self):
+        """通知识别进程退出并释放共享内存"""
+        with self.lock:
+            if self.process is not None:
+                self.jobs.put(None)
+                self.process.join(2)
+                if self.process.is_alive():
+                    self.process.kill()
+                    self.process.join(1)
+                self.process = None
+            if self.ring is not None:
+                self.ring.close()
+                self.ring.shm.unlink()
+                self.ring = None
+
+    def stats(self):
+        """识别进程统计"""
+        return {
+            "pid": self.process.pid if self.process is not None else None,
+            "completed": self.completed,
+            "restarts": self.restarts,
+            "avg_decode_ms": self.decode_ms / self.completed if self.completed else 0.0,
+            "avg_overhead_ms": self.overhead_ms / self.completed if self.completed else 0.0,
+        }
+
+    def report(self):
+        """格式化统计信息"""
+        s = self.stats()
+        return (f"识别进程 {self.model_name}: 识别 {s['completed']} 次，重启 {s['restarts']} 次，"
+                f"平均解码 {s['avg_decode_ms']:.0f}ms，进程间开销 {s['avg_overhead_ms']:.1f}ms")
@@ -0,0 +1,162 @@
+"""
+麦克风采集服务
+整个进程只打开一次录音流，音频持续写入预分配的 NumPy 环形缓冲区。
+唤醒检测、语音识别、VAD 各自创建读取器从同一缓冲区读取，不再反复打开设备；
+读取器可以带预录（pre-roll），从若干秒之前开始读，唤醒回应播放期间说的话也不会丢。
+"""
+import time
+import threading
+import numpy as np
+from config import capture_block_ms, capture_buffer_seconds
+
+class AudioCapture:
+    """常驻录音流 + 环形缓冲区
+
+    缓冲区按绝对采样点编号寻址：written 为累计写入的采样点数，
+    编号 i 的采样点位于 buffer[i % capacity]，只保留最近 capacity 个。
+    """
+
+    def __init__(self, fs=16000, block_ms=capture_block_ms, buffer_seconds=capture_buffer_seconds):
+        """
+        Args:
+            fs: 采样率
+            block_ms: 录音回调块时长（毫秒）
+            buffer_seconds: 环形缓冲区时长（秒）
+        """
+        self.fs = fs
+        self.blocksize = int(fs * block_ms / 1000)
+        self.capacity = int(fs * buffer_seconds)
+        self.buffer = np.zeros(self.capacity, dtype=np.float32)
+        self.written = 0
+        self.written_at = None  # 最近一次写入的 perf_counter 时间
+        self.cond = threading.Condition()
+        self.stream = None
+        self.overflows = 0
+
+    def start(self):
+        """打开录音流，整个进程只需调用一次"""
+        if self.stream is not None:
+            return
+        import sounddevice as sd
+
+        self.stream = sd.InputStream(samplerate=self.fs, blocksize=self.blocksize, dtype="float32",
+                                     channels=1, callback=self._callback)
+        self.stream.start()
+
+    def close(self):
+        """关闭录音流"""
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+    def _callback(self, indata, frames, time_info, status):
+        if status.input_overflow:
+            self.overflows += 1
+        self.write(indata[:, 0])
+
+    def write(self, samples):
+        """写入一段音频（录音回调调用，也可用于回放录音文件）
+
+        Args:
+            samples: 一维 float32 音频
+        """
+        n = len(samples)
+        if n >= self.capacity:
+            samples = samples[-self.capacity:]
+        with self.cond:
+            skipped = n - len(samples)
+            pos = (self.written + skipped) % self.capacity
+            first = min(len(samples), self.capacity - pos)
+            self.buffer[pos:pos + first] = samples[:first]
+            self.buffer[:len(samples) - first] = samples[first:]
+            self.written += n
+            self.written_at = time.perf_counter()
+            self.cond.notify_all()
+
+    def _copy(self, start, end):
+        """复制 [start, end) 区间，调用方需持有锁且保证区间仍在缓冲区内"""
+        pos = start % self.capacity
+        n = end - start
+        if pos + n <= self.capacity:
+            return self.buffer[pos:pos + n].copy()
+        first = self.capacity - pos
+        return np.concatenate([self.buffer[pos:], self.buffer[:n - first]])
+
+    def time_of(self, sample):
+        """把绝对采样点编号换算为录下它的 perf_counter 时间（按最近一次写入的时间推算）"""
+        with self.cond:
+            if self.written_at is None:
+                return time.perf_counter()
+            return self.written_at - (self.written - sample) / self.fs
+
+    def reader(self, preroll=0.0, start=None):
+        """创建读取器
+
+        Args:
+            preroll: 从多少秒之前开始读（不超过缓冲区中已有的音频）
+            start: 从指定的绝对采样点编号开始读，优先于 preroll（如插话开始的位置）
+
+        Returns:
+            CaptureReader 实例
+        """
+        with self.cond:
+            if start is None:
+                start = self.written - int(preroll * self.fs)
+            start = min(self.written, max(0, start, self.written - self.capacity))
+            return CaptureReader(self, start, self.written - start)
+
+class CaptureReader:
+    """环形缓冲区的独立读取位置
+
+    读取落后超过缓冲区长度时跳到最旧的可用数据，并累计丢失的采样点数。
+    """
+
+    def __init__(self, capture, position, preroll_samples=0):
+        """
+        Args:
+            capture: AudioCapture 实例
+            position: 起始采样点编号
+            preroll_samples: 创建时已在缓冲区中的（预录）采样点数
+        """
+        self.capture = capture
+        self.position = position
+        self.preroll_samples = preroll_samples
+        self.dropped = 0
+
+    def read(self, timeout=None, max_samples=None):
+        """读取新的音频，没有新数据时等待
+
+        Args:
+            timeout: 最长等待秒数，None 表示一直等
+            max_samples: 最多返回的采样点数
+
+        Returns:
+            一维 float32 音频，超时返回 None
+        """
+        capture = self.capture
+        with capture.cond:
+            if not capture.cond.wait_for(lambda: capture.written > self.position, timeout):
+                return None
+            oldest = capture.written - capture.capacity
+            if self.position < oldest:
+                self.dropped += oldest - self.position
+                self.position = oldest
+            end = capture.written
+            if max_samples is not None:
+                end = min(end, self.position + max_samples)
+            data = capture._copy(self.position, end)
+            self.position = end
+        return data
+
+capture = None
+capture_lock = threading.Lock()
+
+def get_capture():
+    """获取常驻录音服务，首次调用时打开录音流"""
+    global capture
+    with capture_lock:
+        if capture is None:
+            capture = AudioCapture()
+            capture.start()
+    return capture
@@ -0,0 +1,208 @@
+"""
+音频播放引擎
+进程内常驻一个 sounddevice 输出流，通过队列接收解码后的 PCM 数据块，
+连续的数据块无缝衔接播放，停止/清空在一个缓冲区内生效。
+"""
+import time
+import threading
+from collections import deque
+import numpy as np
+from config import playback_samplerate, playback_blocksize
+
+def decode_mp3(data, sample_rate=playback_samplerate):
+    """在进程内把 MP3 解码为单声道 int16 PCM
+
+    Args:
+        data: MP3 字节数据
+        sample_rate: 输出采样率
+
+    Returns:
+        一维 int16 数组
+    """
+    import miniaudio
+
+    decoded = miniaudio.decode(data, output_format=miniaudio.SampleFormat.SIGNED16,
+                               nchannels=1, sample_rate=sample_rate)
+    return np.frombuffer(decoded.samples, dtype=np.int16)
+
+class AudioPlayer:
+    """常驻播放器
+
+    play() 只是把数据块放入队列，由音频回调线程取出播放；
+    stop() 清空队列，下一个回调周期即输出静音。
+    """
+
+    def __init__(self, samplerate=playback_samplerate, blocksize=playback_blocksize):
+        """
+        Args:
+            samplerate: 输出采样率
+            blocksize: 每次回调输出的采样点数
+        """
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.stream = None
+        self.lock = threading.Lock()
+        self.dequeued = threading.Condition(self.lock)  # 队列里的数据块被取走（开始播放或被清空）时通知
+        self.chunks = deque()
+        self.current = None
+        self.position = 0
+        self.streaming = False
+        self.starved = False
+        self.idle = threading.Event()
+        self.idle.set()
+        self.started_at = None
+        self.underruns = 0
+        self.samples_played = 0
+        self.volume = 1.0  # 入队时按该比例缩放，调整后对之后加入的数据生效
+        self.levels = deque(maxlen=96)  # 最近各回调块的 (时间, 输出 RMS)，插话检测和预录去回声用来区分回声
+        self.stop_requested = False
+        self.silenced = threading.Event()  # stop() 之后第一个静音回调块输出时置位
+        self.silenced_at = None
+        self.output_until = None  # 已送出的声音预计播完的 perf_counter 时间
+
+    def start(self):
+        """打开输出流，整个进程只需调用一次"""
+        if self.stream is not None:
+            return
+        import sounddevice as sd
+
+        self.stream = sd.OutputStream(samplerate=self.samplerate, blocksize=self.blocksize,
+                                      dtype="int16", channels=1, callback=self._callback)
+        self.stream.start()
+
+    def close(self):
+        """关闭输出流"""
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+    def _callback(self, outdata, frames, time_info, status):
+        """音频回调：从队列依次取数据填满输出缓冲区"""
+        if status.output_underflow:
+            self.underruns += 1
+
+        out = outdata[:, 0]
+        filled = 0
+        with self.lock:
+            while filled < frames:
+                if self.current is None:
+                    if not self.chunks:
+                        break
+                    self.current = self.chunks.popleft()
+                    self.position = 0
+                    self.dequeued.notify_all()
+                    if self.started_at is None:
+                        self.started_at = time.perf_counter()
+
+                n = min(frames - filled, len(self.current) - self.position)
+                out[filled:filled + n] = self.current[self.position:self.position + n]
+                filled += n
+                self.position += n
+                if self.position >= len(self.current):
+                    self.current = None
+
+            if filled < frames:
+                out[filled:] = 0
+                if self.streaming and not self.starved:
+                    # 流式播放途中数据没跟上，出现可听见的间断
+                    self.underruns += 1
+                    self.starved = True
+                elif not self.streaming:
+                    self.idle.set()
+            else:
+                self.starved = False
+            self.samples_played += filled
+            if self.stop_requested:
+                self.stop_requested = False
+                self.silenced_at = time.perf_counter()
+                self.silenced.set()
+
+        if filled:
+            self.output_until = time.perf_counter() + filled / self.samplerate
+        played = out[:filled].astype(np.float32)
+        level = float(np.sqrt(np.mean(played * played))) / 32768 if filled else 0.0
+        self.levels.append((time.perf_counter(), level))
+
+    def play(self, pcm):
+        """把一段 PCM 数据加入播放队列
+
+        Args:
+            pcm: 一维 int16 数组
+        """
+        if len(pcm) == 0:
+            return
+        pcm = np.asarray(pcm, dtype=np.int16)
+        if self.volume != 1.0:
+            pcm = (pcm * self.volume).astype(np.int16)
+        with self.lock:
+            self.chunks.append(pcm)
+            self.starved = False
+            self.idle.clear()
+
+    def begin_stream(self):
+        """开始流式播放：队列暂时为空也不视为播放结束"""
+        with self.lock:
+            self.streaming = True
+            self.starved = True
+            self.started_at = None
+            self.idle.clear()
+
+    def end_stream(self):
+        """结束流式播放：队列播完即为空闲"""
+        with self.lock:
+            self.streaming = False
+            if self.current is None and not self.chunks:
+                self.idle.set()
+
+    def stop(self):
+        """立即停止播放并清空队列"""
+        with self.lock:
+            self.chunks.clear()
+            self.current = None
+            self.streaming = False
+            self.silenced.clear()
+            self.stop_requested = True
+            self.idle.set()
+            self.dequeued.notify_all()
+
+    flush = stop
+
+    def wait(self, timeout=None):
+        """等待队列播放完毕
+
+        Returns:
+            是否在超时前播放完毕
+        """
+        return self.idle.wait(timeout)
+
+    def wait_queued(self, limit, timeout=None):
+        """等到排队未播的数据块少于 limit 个（正在播放的不算）
+
+        Returns:
+            是否在超时前满足
+        """
+        with self.lock:
+            return self.dequeued.wait_for(lambda: len(self.chunks) < limit, timeout)
+
+    def recent_level(self, window):
+        """最近 window 秒内输出的最大 RMS（0~1）"""
+        return self.level_at(time.perf_counter(), window)
+
+    def level_at(self, at, window):
+        """perf_counter 时间 at 之前 window 秒内输出的最大 RMS（0~1），用于估计那一刻录到的回声"""
+        since = at - window
+        return max((level for t, level in list(self.levels) if since <= t <= at), default=0.0)
+
+    @property
+    def busy(self):
+        """是否正在播放"""
+        return not self.idle.is_set()
+
+    def stats(self):
+        """播放统计"""
+        return {
+            "underruns": self.underruns,
+            "queued_chunks": len(self.chunks),
+            "seconds_played": self.samples_played / self.samplerate,
+        }
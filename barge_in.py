@@ -0,0 +1,257 @@
+"""
+插话检测模块
+小Luna说话期间录音不停，后台线程持续读取常驻录音；检测到主人开口时立即停止播放、
+丢弃还没播的句子，并把插话开始的位置交给语音识别，从这一刻起的录音直接用于识别。
+
+扬声器的声音也会被麦克风录到，所以判定门限随播放音量抬高：
+帧能量需要同时超过噪声底和「最近输出音量 × 回声耦合系数 × 余量」才算主人在说话。
+耦合系数在播放期间没人说话时自动学习。
+开始识别时回溯的预录用同一个回声门限（EchoMask）抹掉小Luna自己的声音，主人在她说话时开口的部分保留。
+"""
+import time
+import threading
+from collections import deque
+import numpy as np
+from config import bargein_start_ms, bargein_echo_coupling, bargein_margin, bargein_min_energy
+from config import bargein_echo_window_ms, bargein_mask_window_ms, vad_frame_ms
+from vad import frame_features
+import tracing
+
+# 最近学到的回声耦合系数，插话检测和预录去回声共用
+echo_coupling = bargein_echo_coupling
+
+def echo_threshold(echo, coupling, margin=bargein_margin, min_energy=bargein_min_energy):
+    """输出音量为 echo 时麦克风上回声可能达到的帧能量上限"""
+    return max(min_energy, echo * coupling * margin)
+
+class BargeInEvent:
+    """一次插话
+
+    Attributes:
+        sample: 插话开始的绝对采样点编号（录音缓冲区编号）
+        onset: 插话开始的 perf_counter 时间（按采样点换算）
+        detected: 判定为插话的时间
+        silenced: 播放实际静音的时间，未测到时为 None
+        noise_floor: 插话前的环境噪声底，供识别端的 VAD 直接使用
+    """
+
+    def __init__(self, sample, onset, detected, noise_floor):
+        self.sample = sample
+        self.onset = onset
+        self.detected = detected
+        self.silenced = None
+        self.noise_floor = noise_floor
+
+    @property
+    def cutoff_ms(self):
+        """从开口到播放静音的毫秒数"""
+        end = self.silenced if self.silenced is not None else self.detected
+        return (end - self.onset) * 1000
+
+class BargeInMonitor:
+    """后台插话检测
+
+    arm() 到 disarm() 之间（小Luna说话时）检测到插话就调用 on_barge_in 并停止播放；
+    其余时间只更新噪声底。
+    """
+
+    def __init__(self, capture, player, on_barge_in=None, start_ms=bargein_start_ms,
+                 coupling=None, margin=bargein_margin, min_energy=bargein_min_energy,
+                 echo_window_ms=bargein_echo_window_ms, frame_ms=vad_frame_ms):
+        """
+        Args:
+            capture: AudioCapture 实例
+            player: AudioPlayer 实例
+            on_barge_in: 插话回调，接收 BargeInEvent（在检测线程中调用，应尽快返回）
+            start_ms: 连续有声多久判定为插话
+            coupling: 回声耦合系数初值（麦克风录到的回声能量 / 输出能量），为空时沿用已学到的值
+            margin: 超过回声估计的倍数
+            min_energy: 能量绝对下限
+            echo_window_ms: 取最近多长时间内的最大输出音量估计回声（覆盖声卡和房间的延迟）
+            frame_ms: 帧长
+        """
+        self.capture = capture
+        self.player = player
+        self.on_barge_in = on_barge_in
+        self.frame_len = int(capture.fs * frame_ms / 1000)
+        self.start_frames = max(1, int(round(start_ms / frame_ms)))
+        self.coupling = echo_coupling if coupling is None else coupling
+        self.margin = margin
+        self.min_energy = min_energy
+        self.echo_window = echo_window_ms / 1000
+        self.noise_floor = None
+        self.armed = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.last_event = None
+        self.cutoffs = deque(maxlen=256)
+        self.triggers = 0
+
+    def start(self):
+        """启动检测线程"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="barge-in", daemon=True)
+            self.thread.start()
+
+    def close(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(2)
+            self.thread = None
+
+    def arm(self):
+        """开始检测插话（开始说话前调用）"""
+        self.last_event = None
+        self.armed.set()
+
+    def disarm(self):
+        """停止检测插话
+
+        Returns:
+            本次说话期间的插话事件，没有插话时为 None
+        """
+        self.armed.clear()
+        return self.last_event
+
+    def _run(self):
+        reader = self.capture.reader()
+        pending = np.zeros(0, dtype=np.float32)
+        voiced_run = 0
+        first_voiced = None
+        while not self.stop_event.is_set():
+            block = reader.read(timeout=0.5)
+            if block is None:
+                continue
+            samples = np.concatenate([pending, block]) if len(pending) else block
+            n_frames = len(samples) // self.frame_len
+            usable = n_frames * self.frame_len
+            pending = samples[usable:]
+            if n_frames == 0:
+                continue
+
+            now = time.perf_counter()
+            end_sample = reader.position - len(pending)
+            energy, _ = frame_features(samples[:usable], self.frame_len)
+            if self.noise_floor is None:
+                self.noise_floor = float(np.min(energy))
+
+            if not self.armed.is_set():
+                voiced_run = 0
+                for e in energy:
+                    self.noise_floor += 0.05 * (e - self.noise_floor)
+                continue
+
+            echo = self.player.recent_level(self.echo_window)
+            threshold = max(self.noise_floor * 3, echo_threshold(echo, self.coupling, self.margin, self.min_energy))
+            for i, e in enumerate(energy):
+                if e > threshold:
+                    if voiced_run == 0:
+                        first_voiced = end_sample - (n_frames - i) * self.frame_len
+                    voiced_run += 1
+                    if voiced_run >= self.start_frames and self.last_event is None:
+                        self._trigger(first_voiced, now - (end_sample - first_voiced) / self.capture.fs)
+                        break
+                else:
+                    voiced_run = 0
+                    if echo > self.min_energy:
+                        # 没人说话时录到的就是回声，慢慢跟随实际耦合系数（只在其低于门限时学习）
+                        self.coupling += 0.02 * (e / echo - self.coupling)
+                        self._share_coupling()
+
+    def _share_coupling(self):
+        """把学到的耦合系数交给预录去回声使用"""
+        global echo_coupling
+        echo_coupling = self.coupling
+
+    def _trigger(self, sample, onset):
+        """判定为插话：先停播放，再通知调用方"""
+        detected = time.perf_counter()
+        self.player.stop()
+        event = BargeInEvent(sample, onset, detected, self.noise_floor)
+        self.last_event = event
+        self.triggers += 1
+        if self.on_barge_in is not None:
+            self.on_barge_in(event)
+        # 停止在下一个播放回调块生效，等它真正静音后再记延迟
+        if self.player.silenced.wait(0.5):
+            event.silenced = self.player.silenced_at
+        self.cutoffs.append(event.cutoff_ms)
+        tracing.record("barge_in", onset, event.silenced or detected)
+        print(f"\n检测到插话，{event.cutoff_ms:.0f}ms 内停止播放")
+
+    def stats(self):
+        """插话统计"""
+        cutoffs = sorted(self.cutoffs)
+        pick = lambda p: cutoffs[min(len(cutoffs) - 1, int(len(cutoffs) * p))] if cutoffs else 0.0
+        return {
+            "triggers": self.triggers,
+            "cutoff_p50_ms": pick(0.5),
+            "cutoff_p95_ms": pick(0.95),
+            "cutoff_max_ms": cutoffs[-1] if cutoffs else 0.0,
+            "echo_coupling": self.coupling,
+        }
+
+    def report(self):
+        """格式化统计信息"""
+        s = self.stats()
+        if not s["triggers"]:
+            return "插话: 0 次"
+        return (f"插话: {s['triggers']} 次，停止播放延迟 p50 {s['cutoff_p50_ms']:.0f}ms, "
+                f"p95 {s['cutoff_p95_ms']:.0f}ms (最大 {s['cutoff_max_ms']:.0f}ms)")
+
+class EchoMask:
+    """把录音中小Luna自己的声音置零
+
+    开始识别时回溯的预录可能盖住唤醒回应等她自己的播放。逐帧按录下那一刻之前的输出音量估计回声，
+    能量不超过回声门限的帧置零；主人同时开口的帧高于门限，原样保留。播放结束后的录音不做处理。
+    """
+
+    def __init__(self, capture, player, margin=bargein_margin, min_energy=bargein_min_energy,
+                 echo_window_ms=bargein_mask_window_ms, frame_ms=vad_frame_ms):
+        """
+        Args:
+            capture: AudioCapture 实例
+            player: AudioPlayer 实例，为 None（从未播放）时不做处理
+            margin: 超过回声估计的倍数
+            min_energy: 能量绝对下限
+            echo_window_ms: 取录音时刻之前多长时间内的最大输出音量估计回声
+            frame_ms: 帧长
+        """
+        self.capture = capture
+        self.player = player
+        self.margin = margin
+        self.min_energy = min_energy
+        self.echo_window = echo_window_ms / 1000
+        self.frame_len = int(capture.fs * frame_ms / 1000)
+        self.masked = 0  # 累计置零的帧数
+
+    def apply(self, block, first_sample):
+        """原地处理一块录音
+
+        Args:
+            block: 一维 float32 录音（CaptureReader.read 返回的副本）
+            first_sample: block[0] 的绝对采样点编号
+
+        Returns:
+            本块置零的帧数
+        """
+        player = self.player
+        if player is None or player.output_until is None:
+            return 0
+        # 整块都录在播放结束（加上声卡和房间的延迟）之后，没有回声
+        if self.capture.time_of(first_sample) > player.output_until + self.echo_window:
+            return 0
+
+        masked = 0
+        for start in range(0, len(block), self.frame_len):
+            frame = block[start:start + self.frame_len]
+            at = self.capture.time_of(first_sample + start + len(frame))
+            echo = player.level_at(at, self.echo_window)
+            if echo <= self.min_energy:
+                continue
+            threshold = echo_threshold(echo, echo_coupling, self.margin, self.min_energy)
+            if np.sqrt(np.mean(frame * frame)) <= threshold:
+                frame[:] = 0
+                masked += 1
+        self.masked += masked
+        return masked
@@ -0,0 +1,87 @@
+"""
+情绪检测回归与性能测试
+在标注语料 emotion_corpus.jsonl 上对比旧版逐关键词扫描和当前自动机实现的准确率与速度，
+并检查批量检测（一次扫描拼接文本）与逐条检测结果一致，当前实现准确率更低或明显更慢（超过容差）时以非零状态退出。
+用法：python benchmarks/bench_emotion.py
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from emotion_detect import EMOTION_KEYWORDS, detect_emotion, detect_emotions
+import tracing
+
+def legacy_detect_emotion(text):
+    """旧版实现：每种情绪的每个关键词各做一次子串查找"""
+    text = text.lower()
+    best, best_score = "neutral", 0
+    for emotion, keywords in EMOTION_KEYWORDS.items():
+        score = sum(1 for keyword in keywords if keyword in text)
+        if score > best_score:
+            best, best_score = emotion, score
+    return best
+
+def load_corpus(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def accuracy(detect, corpus):
+    """返回 (准确率, 判错的样本列表)"""
+    wrong = [(case["text"], case["emotion"], detect(case["text"]))
+             for case in corpus if detect(case["text"]) != case["emotion"]]
+    return 1 - len(wrong) / len(corpus), wrong
+
+def per_call_us(detect, texts, repeat, rounds):
+    """单次调用耗时，取多轮中最快的一轮，减少机器负载带来的抖动"""
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for text in texts:
+                detect(text)
+        best = min(best, time.perf_counter() - start)
+    return best / (repeat * len(texts)) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="情绪检测回归与性能测试")
+    parser.add_argument("--corpus", default=os.path.join(BENCH_DIR, "emotion_corpus.jsonl"))
+    parser.add_argument("--repeat", type=int, default=200, help="每轮计时重复次数")
+    parser.add_argument("--rounds", type=int, default=7, help="计时轮数，取最快一轮")
+    parser.add_argument("--speed-tolerance", type=float, default=1.2,
+                        help="当前实现耗时超过旧版的多少倍视为变慢")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    texts = [case["text"] for case in corpus]
+    # 加上一段较长的回复文本，接近 GPT 回复的真实长度
+    texts.append("主人今天辛苦啦，听到你说工作上有些烦心的事情，我也有点担心你呢。要不要先休息一下，喝杯热水？我一直都在这里陪着你哦~")
+
+    legacy_acc, _ = accuracy(legacy_detect_emotion, corpus)
+    new_acc, wrong = accuracy(detect_emotion, corpus)
+    print(f"准确率: 旧版 {legacy_acc:.1%}, 当前 {new_acc:.1%} ({len(corpus)} 条)")
+    for text, expected, got in wrong:
+        print(f"  判错: {text!r} 期望 {expected} 实际 {got}")
+
+    traced_us = per_call_us(detect_emotion, texts, args.repeat, args.rounds)
+    # 旧版没有追踪，比较匹配本身的耗时时关掉追踪，追踪开销单独列出
+    tracing.enabled = False
+    legacy_us = per_call_us(legacy_detect_emotion, texts, args.repeat, args.rounds)
+    new_us = per_call_us(detect_emotion, texts, args.repeat, args.rounds)
+    batch_us = per_call_us(detect_emotions, [texts], args.repeat, args.rounds) / len(texts)
+    print(f"单次耗时: 旧版 {legacy_us:.2f}us, 当前 {new_us:.2f}us（含追踪 {traced_us:.2f}us）, "
+          f"批量 {batch_us:.2f}us/条, 加速 {legacy_us / new_us:.2f}x，批量相对逐条 {new_us / batch_us:.2f}x")
+    if detect_emotions(texts) != [detect_emotion(text) for text in texts]:
+        print("回归：批量检测与逐条检测结果不一致")
+        sys.exit(1)
+
+    if new_acc < legacy_acc or new_us > legacy_us * args.speed_tolerance:
+        print(f"回归：当前实现准确率更低或耗时超过旧版的 {args.speed_tolerance:.1f} 倍")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
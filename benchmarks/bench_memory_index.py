@@ -0,0 +1,63 @@
+"""
+长期记忆检索性能测试
+合成指定数量的历史对话，测量建索引耗时和单次检索延迟（p50/p95）
+用法：python benchmarks/bench_memory_index.py --turns 100000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memory_index import MemoryIndex
+from config import memory_token_budget, memory_top_k
+
+SUBJECTS = ["今天", "昨天", "周末", "晚上", "早上", "上班的时候", "放学以后", "下雨天"]
+ACTIVITIES = ["看电影", "打篮球", "学画画", "弹吉他", "做蛋糕", "去公园散步", "写代码", "读小说",
+              "练瑜伽", "玩游戏", "听音乐", "喂小猫", "去海边", "逛超市", "学英语", "跑步"]
+FEELINGS = ["很开心", "有点累", "特别难过", "好无聊", "超级兴奋", "有些紧张", "很满足", "心情一般"]
+REPLIES = ["听起来真不错呀", "要好好休息哦", "我一直陪着你", "下次也带上我吧", "你真的很棒", "抱抱你"]
+
+def synth_turn(rng):
+    """生成一轮对话"""
+    user = f"{rng.choice(SUBJECTS)}我去{rng.choice(ACTIVITIES)}了，{rng.choice(FEELINGS)}"
+    reply = f"{rng.choice(REPLIES)}，{rng.choice(ACTIVITIES)}也很有意思呢"
+    return user, reply
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def main():
+    parser = argparse.ArgumentParser(description="长期记忆检索性能测试")
+    parser.add_argument("--turns", type=int, default=100000, help="历史对话条数")
+    parser.add_argument("--queries", type=int, default=200, help="查询次数")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    index = MemoryIndex()
+    start = time.perf_counter()
+    for _ in range(args.turns):
+        user, reply = synth_turn(rng)
+        index.add(f"主人说「{user}」，你回答「{reply}」", user + " " + reply)
+    build = time.perf_counter() - start
+    print(f"建索引: {args.turns} 条, {build:.2f}s, 每条 {build / args.turns * 1e6:.1f}us")
+
+    latencies = []
+    for _ in range(args.queries):
+        query, _ = synth_turn(rng)
+        start = time.perf_counter()
+        index.select(query, memory_token_budget, memory_top_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+    print(f"检索: p50 {percentile(latencies, 0.5):.1f}ms, p95 {percentile(latencies, 0.95):.1f}ms, "
+          f"最大 {max(latencies):.1f}ms")
+
+    start = time.perf_counter()
+    user, reply = synth_turn(rng)
+    index.add(f"主人说「{user}」，你回答「{reply}」", user + " " + reply)
+    print(f"增量添加一条: {(time.perf_counter() - start) * 1e6:.0f}us")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+VAD 性能测试
+在合成音频（白噪声 + 间歇的谐波“语音”）上测量每秒可处理的帧数，
+可直接在树莓派上运行：python benchmarks/bench_vad.py
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vad import VoiceActivityDetector
+
+def synth_audio(seconds, fs=16000, seed=0):
+    """生成测试音频：底噪上每 4 秒叠加 1.5 秒谐波信号"""
+    rng = np.random.default_rng(seed)
+    audio = (rng.standard_normal(int(seconds * fs)) * 0.003).astype(np.float32)
+    t = np.arange(int(1.5 * fs)) / fs
+    burst = sum(0.05 / k * np.sin(2 * np.pi * 180 * k * t) for k in range(1, 6)).astype(np.float32)
+    for start in range(fs, len(audio) - len(burst), 4 * fs):
+        audio[start:start + len(burst)] += burst
+    return audio
+
+def bench(audio, fs, frame_ms, block_ms):
+    """按录音回调的分块方式送入 VAD，返回 (帧/秒, 实时倍数, 事件数)"""
+    vad = VoiceActivityDetector(fs, frame_ms=frame_ms)
+    block = int(fs * block_ms / 1000)
+    events = 0
+    start = time.perf_counter()
+    for i in range(0, len(audio), block):
+        events += len(vad.process(audio[i:i + block]))
+    elapsed = time.perf_counter() - start
+    frames = len(audio) // vad.frame_len
+    return frames / elapsed, len(audio) / fs / elapsed, events
+
+def main():
+    parser = argparse.ArgumentParser(description="VAD 性能测试")
+    parser.add_argument("--seconds", type=float, default=120, help="测试音频时长（秒）")
+    parser.add_argument("--block-ms", type=int, default=50, help="每次送入的音频块长度（毫秒）")
+    args = parser.parse_args()
+
+    fs = 16000
+    audio = synth_audio(args.seconds, fs)
+    for frame_ms in (10, 20, 30):
+        fps, realtime, events = bench(audio, fs, frame_ms, args.block_ms)
+        print(f"帧长 {frame_ms:2d}ms: {fps:10.0f} 帧/秒, {realtime:7.1f}x 实时, 事件 {events} 个")
+
+if __name__ == "__main__":
+    main()
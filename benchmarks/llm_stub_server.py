@@ -0,0 +1,135 @@
+"""
+模拟 OpenAI 兼容的大模型服务
+按设定的首字延迟、抖动和出错率回复固定内容，支持流式（SSE）和非流式，
+用于在本机测试大模型后端路由的选择和故障切换，不消耗 API 额度。
+
+用法：
+    python benchmarks/llm_stub_server.py --port 8081 --latency 0.3 --jitter 0.1
+    LLM_LOCAL_URL=http://127.0.0.1:8081/v1 python main.py --test
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = "好呀，我在听呢。今天过得怎么样？"
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": self.server.model, "object": "model"}]})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        server.requests += 1
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+        if random.random() < server.error_rate:
+            server.errors += 1
+            self._send_json(503, {"error": {"message": "stub overloaded", "type": "server_error"}})
+            return
+
+        time.sleep(max(0.0, server.latency + random.uniform(-server.jitter, server.jitter)))
+        model = request.get("model", server.model)
+        created = int(time.time())
+        if not request.get("stream"):
+            self._send_json(200, {
+                "id": "chatcmpl-stub", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": server.reply},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(server.reply), "total_tokens": len(server.reply)},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        tokens = [server.reply[i:i + 2] for i in range(0, len(server.reply), 2)]
+        try:
+            for i, token in enumerate(tokens):
+                if i:
+                    time.sleep(server.token_gap)
+                chunk = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": created, "model": model,
+                         "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            done = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            self.wfile.write(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+
+def start_stub(port=0, latency=0.2, jitter=0.0, token_gap=0.02, error_rate=0.0, reply=DEFAULT_REPLY,
+               model="stub"):
+    """在后台线程中启动模拟服务
+
+    Args:
+        port: 监听端口，0 为随机空闲端口
+        latency: 首字延迟（秒）
+        jitter: 延迟随机浮动范围（秒）
+        token_gap: 流式输出每个 token 的间隔（秒）
+        error_rate: 返回 503 的概率
+        reply: 回复内容
+        model: /v1/models 中报告的模型名
+
+    Returns:
+        服务对象，base_url 属性为 API 地址；可在运行中修改 latency/error_rate 等属性注入故障
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.jitter = jitter
+    server.token_gap = token_gap
+    server.error_rate = error_rate
+    server.reply = reply
+    server.model = model
+    server.requests = 0
+    server.errors = 0
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    threading.Thread(target=server.serve_forever, name="llm-stub", daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟 OpenAI 兼容的大模型服务")
+    parser.add_argument("--port", type=int, default=8081, help="监听端口")
+    parser.add_argument("--latency", type=float, default=0.2, help="首字延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延迟随机浮动范围（秒）")
+    parser.add_argument("--token-gap", type=float, default=0.02, help="流式 token 间隔（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 503 的概率")
+    parser.add_argument("--reply", default=DEFAULT_REPLY, help="回复内容")
+    args = parser.parse_args()
+
+    server = start_stub(args.port, args.latency, args.jitter, args.token_gap, args.error_rate, args.reply)
+    print(f"模拟大模型服务已启动: {server.base_url}，按 Ctrl+C 退出")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
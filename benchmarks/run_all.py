@@ -0,0 +1,600 @@
+"""
+分阶段性能测试套件
+离线逐项测量各热点路径：情绪检测、偏好提取、相关记忆检索（不同记忆规模）、唤醒/休眠关键词判断、本地意图匹配、
+记忆日志写入与加载、VAD 处理耗时与 Whisper 识别实时率（使用 fixtures/ 中的 WAV；识别分进程内与独立识别进程，后者另计进程间开销）、语音合成与对话流水线的流式播放（使用本地模拟的 GPT 流、edge-tts 和声卡）、
+表情帧增量刷新（虚拟帧缓冲，统计每帧发送的字节数）、插话停止播放延迟（模拟麦克风回声）。
+结果写成 JSON，并与保存的基线比较，任何指标变慢超过容差即以非零状态退出。
+缺少依赖（如 whisper、sounddevice）的测试项记为跳过，不影响其余测试。
+
+用法：
+    python benchmarks/run_all.py                       # 运行并与 benchmarks/baseline.json 比较
+    python benchmarks/run_all.py --update-baseline     # 在当前机器上生成或更新基线（没有基线时直接运行会失败）
+    python benchmarks/run_all.py --only memory --output result.json
+"""
+import os
+import sys
+import json
+import glob
+import time
+import wave
+import random
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import threading
+from types import SimpleNamespace
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from bench_memory_index import synth_turn
+from bench_vad import synth_audio
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+FIXTURE_DIR = os.path.join(BENCH_DIR, "fixtures")
+
+CASES = []
+
+class Skip(Exception):
+    """测试项所需的依赖或硬件不可用"""
+
+def case(name):
+    """注册测试项，被装饰的函数接收命令行参数，返回 {指标名: 数值}（数值越小越好）"""
+    def register(func):
+        CASES.append((name, func))
+        return func
+    return register
+
+def per_call_us(func, inputs, min_seconds=0.2, rounds=5):
+    """测量单次调用耗时，取多轮的中位数
+
+    Args:
+        func: 被测函数，接收一个输入
+        inputs: 输入列表，每轮依次调用一遍
+        min_seconds: 每轮至少运行的时长
+        rounds: 轮数
+
+    Returns:
+        单次调用耗时（微秒）
+    """
+    repeat = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for item in inputs:
+                func(item)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds / rounds:
+            break
+        repeat *= 2
+
+    samples = [elapsed / (repeat * len(inputs))]
+    for _ in range(rounds - 1):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for item in inputs:
+                func(item)
+        samples.append((time.perf_counter() - start) / (repeat * len(inputs)))
+    return float(np.median(samples)) * 1e6
+
+def load_emotion_texts():
+    with open(os.path.join(BENCH_DIR, "emotion_corpus.jsonl"), "r", encoding="utf-8") as f:
+        return [json.loads(line)["text"] for line in f if line.strip()]
+
+def import_chat_gpt():
+    """导入 chat_gpt，不需要真实的 API Key"""
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    try:
+        import chat_gpt
+    except ImportError as e:
+        raise Skip(str(e))
+    return chat_gpt
+
+@case("emotion.detect")
+def bench_emotion(args):
+    from emotion_detect import detect_emotion
+
+    return {"per_call_us": per_call_us(detect_emotion, load_emotion_texts())}
+
+@case("preferences.extract")
+def bench_preferences(args):
+    chat_gpt = import_chat_gpt()
+    texts = load_emotion_texts() + ["我喜欢猫，我讨厌下雨天", "我想学吉他，我对天文感兴趣", "我超爱吃火锅"]
+    return {"per_call_us": per_call_us(lambda text: chat_gpt.ChatGPT._extract_preferences(None, text), texts)}
+
+@case("memory.inject_context")
+def bench_memory_context(args):
+    chat_gpt = import_chat_gpt()
+    from memory_index import MemoryIndex
+
+    rng = random.Random(0)
+    queries = [synth_turn(rng)[0] for _ in range(50)]
+    # 不创建 OpenAI 客户端和记忆存储，只挂上索引
+    gpt = object.__new__(chat_gpt.ChatGPT)
+    gpt.index = MemoryIndex()
+    metrics = {}
+    for size in sorted(args.memory_sizes):
+        while len(gpt.index) < size:
+            user, reply = synth_turn(rng)
+            chat_gpt.ChatGPT._index_conversation(gpt.index, {"user_input": user, "reply": reply})
+        metrics[f"per_call_us@{size}"] = per_call_us(gpt._inject_memory_context, queries)
+    return metrics
+
+@case("keywords.wake")
+def bench_wake_keyword(args):
+    try:
+        from whisper_input import is_wake_word
+    except ImportError as e:
+        raise Skip(str(e))
+    texts = ["小Luna你在吗", "今天天气怎么样", "Hi, Luna", "帮我讲个故事吧，要长一点的那种"]
+    return {"per_call_us": per_call_us(is_wake_word, texts)}
+
+@case("keywords.sleep")
+def bench_sleep_keyword(args):
+    try:
+        from pipeline import is_sleep_keyword
+    except ImportError as e:
+        raise Skip(str(e))
+    texts = ["晚安Luna", "今天天气怎么样", "goodnight Luna", "帮我讲个故事吧，要长一点的那种"]
+    return {"per_call_us": per_call_us(is_sleep_keyword, texts)}
+
+@case("intent.match")
+def bench_intent(args):
+    from intent_router import IntentRouter
+    router = IntentRouter()
+    texts = ["小Luna现在几点了", "再说一遍", "帮我讲个故事吧，要长一点的那种", "今天有点累，想和你聊聊天"]
+    return {"per_call_us": per_call_us(router.match, texts)}
+
+@case("memory.store")
+def bench_memory_store(args):
+    from memory_store import MemoryStore
+
+    rng = random.Random(0)
+    directory = tempfile.mkdtemp(prefix="luna-bench-")
+    try:
+        store = MemoryStore(directory, compact_every=10 ** 9)
+        turns = [synth_turn(rng) for _ in range(args.store_turns)]
+        start = time.perf_counter()
+        for user, reply in turns:
+            store.append_message({"role": "user", "content": user})
+            store.append_message({"role": "assistant", "content": reply})
+            store.add_conversation({"user_input": user, "reply": reply, "emotion": "neutral"})
+            store.sync()
+        save = (time.perf_counter() - start) / len(turns)
+
+        # 压缩和加载受磁盘抖动影响较大，各取多次的中位数
+        compact_times = []
+        for _ in range(3):
+            start = time.perf_counter()
+            store.compact()
+            compact_times.append(time.perf_counter() - start)
+        compact = float(np.median(compact_times))
+        store.close()
+
+        load_times = []
+        for _ in range(5):
+            start = time.perf_counter()
+            MemoryStore(directory).close()
+            load_times.append(time.perf_counter() - start)
+        load = float(np.median(load_times))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return {
+        "save_per_turn_ms": save * 1000,
+        f"compact_ms@{args.store_turns}": compact * 1000,
+        f"load_ms@{args.store_turns}": load * 1000,
+    }
+
+def load_fixtures():
+    """读取 fixtures/*.wav（16 位单声道，由 make_fixtures.py 生成或放入真实录音），没有时生成一段合成音频"""
+    clips = []
+    for path in sorted(glob.glob(os.path.join(FIXTURE_DIR, "*.wav"))):
+        with wave.open(path, "rb") as f:
+            data = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+            clips.append((os.path.basename(path), data.astype(np.float32) / 32768, f.getframerate()))
+    if not clips:
+        clips.append(("synthetic", synth_audio(4.0), 16000))
+    return clips
+
+@case("vad.process")
+def bench_vad(args):
+    from vad import VoiceActivityDetector
+
+    metrics = {}
+    for name, audio, fs in load_fixtures():
+        block = int(fs * 0.05)  # 与常驻录音的回调块一致
+
+        def run_clip(_):
+            vad = VoiceActivityDetector(fs)
+            for i in range(0, len(audio), block):
+                vad.process(audio[i:i + block])
+
+        # 每秒音频的处理耗时
+        metrics[f"us_per_s@{name}"] = per_call_us(run_clip, [None]) / (len(audio) / fs)
+    return metrics
+
+@case("whisper.rtf")
+def bench_whisper(args):
+    try:
+        import whisper  # noqa: F401
+        from whisper_input import transcribe_buffer, load_model
+    except ImportError as e:
+        raise Skip(str(e))
+
+    load_model(args.whisper_model)
+    clips = load_fixtures()
+    # 第一次识别包含模型预热，不计入
+    transcribe_buffer(clips[0][1], clips[0][2], args.whisper_model)
+    metrics = {}
+    for name, audio, fs in clips:
+        start = time.perf_counter()
+        transcribe_buffer(audio, fs, args.whisper_model)
+        metrics[f"rtf@{name}"] = (time.perf_counter() - start) / (len(audio) / fs)
+    return metrics
+
+@case("whisper.worker")
+def bench_whisper_worker(args):
+    try:
+        import whisper  # noqa: F401
+        from asr_worker import WhisperWorker
+    except ImportError as e:
+        raise Skip(str(e))
+
+    worker = WhisperWorker(args.whisper_model)
+    try:
+        worker.start()
+        clips = load_fixtures()
+        worker.transcribe(clips[0][1], clips[0][2])
+        metrics = {}
+        overhead = []
+        for name, audio, fs in clips:
+            start = time.perf_counter()
+            _, timings = worker.transcribe(audio, fs)
+            metrics[f"rtf@{name}"] = (time.perf_counter() - start) / (len(audio) / fs)
+            overhead.append(timings["ipc"])
+        metrics["ipc_ms"] = max(overhead)
+    finally:
+        worker.close()
+    return metrics
+
+class FakeCommunicate:
+    """本地模拟的 edge_tts.Communicate：按固定延迟分块返回假音频"""
+
+    first_chunk_delay = 0.05
+    chunk_delay = 0.005
+    bytes_per_char = 600
+
+    def __init__(self, text, voice, rate="+0%", **kwargs):
+        self.size = max(1, len(text)) * self.bytes_per_char
+
+    async def stream(self):
+        await asyncio.sleep(self.first_chunk_delay)
+        for offset in range(0, self.size, 4096):
+            yield {"type": "audio", "data": b"\0" * min(4096, self.size - offset)}
+            await asyncio.sleep(self.chunk_delay)
+
+class FakeOutputDevice:
+    """模拟声卡：按实时节奏调用播放器回调"""
+
+    def __init__(self, out):
+        self.out = out
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        buffer = np.zeros((self.out.blocksize, 1), dtype=np.int16)
+        status = SimpleNamespace(output_underflow=False)
+        period = self.out.blocksize / self.out.samplerate
+        next_time = time.perf_counter()
+        while self.running:
+            self.out._callback(buffer, self.out.blocksize, None, status)
+            next_time += period
+            time.sleep(max(0.0, next_time - time.perf_counter()))
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+
+class FakeMicrophone:
+    """模拟麦克风：按实时节奏写入录音缓冲区，内容为扬声器回声加上可开关的人声"""
+
+    def __init__(self, capture, out, echo_gain=0.6, voice_amplitude=0.3, block_seconds=0.05):
+        self.capture = capture
+        self.out = out
+        self.echo_gain = echo_gain
+        self.voice_amplitude = voice_amplitude
+        self.block = int(capture.fs * block_seconds)
+        self.speaking = False
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        rng = np.random.default_rng(0)
+        t = np.arange(self.block) / self.capture.fs
+        period = self.block / self.capture.fs
+        next_time = time.perf_counter()
+        while self.running:
+            echo = self.out.recent_level(0.1) * self.echo_gain * np.sqrt(2)
+            samples = rng.standard_normal(self.block).astype(np.float32) * 0.002
+            samples += (np.sin(2 * np.pi * 300 * t) * echo).astype(np.float32)
+            if self.speaking:
+                samples += (np.sin(2 * np.pi * 180 * t) * self.voice_amplitude).astype(np.float32)
+            self.capture.write(samples)
+            next_time += period
+            time.sleep(max(0.0, next_time - time.perf_counter()))
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+
+def import_voice_output():
+    """用模拟的 edge-tts 导入 voice_output，播放器接到模拟声卡上"""
+    sys.modules["edge_tts"] = SimpleNamespace(Communicate=FakeCommunicate)
+    import voice_output
+    from tts_cache import TTSCache
+    from audio_player import AudioPlayer
+
+    if platform.system() != "Linux" or voice_output.TEST_MODE:
+        raise Skip("流式播放路径只在 Linux 上使用")
+    voice_output.Communicate = FakeCommunicate
+    # 假音频不是 MP3，按 16 倍压缩比换算成等长的静音
+    voice_output.decode_mp3 = lambda data: np.zeros(len(data) * 16 // 2, dtype=np.int16)
+    voice_output.tts_cache = TTSCache(tempfile.mkdtemp(prefix="luna-bench-tts-"))
+    voice_output.player = AudioPlayer()
+    return voice_output
+
+@case("tts.synthesize")
+def bench_tts(args):
+    voice_output = import_voice_output()
+    cache_dir = voice_output.tts_cache.cache_dir
+    try:
+        texts = [f"这是第{i}句测试语音。" for i in range(20)]
+        start = time.perf_counter()
+        for text in texts:
+            voice_output.synthesize(text)
+        miss = (time.perf_counter() - start) / len(texts)
+        overhead = miss - FakeCommunicate.first_chunk_delay
+        hit = per_call_us(voice_output.synthesize, texts) / 1000
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return {"miss_overhead_ms": max(0.0, overhead * 1000), "hit_ms": hit}
+
+@case("tts.speak_stream")
+def bench_speak_stream(args):
+    voice_output = import_voice_output()
+    device = FakeOutputDevice(voice_output.player)
+    cache_dir = voice_output.tts_cache.cache_dir
+    reply = "主人今天辛苦啦！要不要先休息一下，喝杯热水？我会一直陪着你的。"
+
+    def tokens():
+        # 模拟 GPT 每 30ms 输出两个字
+        for i in range(0, len(reply), 2):
+            time.sleep(0.03)
+            yield reply[i:i + 2]
+
+    try:
+        out = voice_output.player
+        underruns = out.underruns
+        start = time.perf_counter()
+        voice_output.speak_stream(tokens())
+        first_audio = out.started_at - start
+    finally:
+        device.close()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return {"first_audio_ms": first_audio * 1000, "underruns": out.underruns - underruns}
+
+class FakeChat:
+    """模拟 ChatGPT.astream：每 30ms 输出两个字"""
+
+    def __init__(self, reply):
+        self.reply = reply
+
+    async def astream(self, user_input, emotion="neutral", on_slow=None):
+        for i in range(0, len(self.reply), 2):
+            await asyncio.sleep(0.03)
+            yield self.reply[i:i + 2]
+
+@case("pipeline.speak")
+def bench_pipeline_speak(args):
+    voice_output = import_voice_output()
+    import audio_player
+    # 运行时 main.py 启动时已导入这些模块，openai 的导入时间不算进首音延迟
+    import chat_gpt  # noqa: F401
+    import emotion_detect  # noqa: F401
+    from pipeline import VoicePipeline, LISTENING
+
+    device = FakeOutputDevice(voice_output.player)
+    cache_dir = voice_output.tts_cache.cache_dir
+    reply = "主人今天辛苦啦！要不要先休息一下，喝杯热水？我会一直陪着你的。"
+    decode_mp3 = audio_player.decode_mp3
+    audio_player.decode_mp3 = voice_output.decode_mp3
+
+    async def speak():
+        # 从识别出文本开始，经过 GPT、合成、播放各阶段，直到播完回到听的状态
+        router = SimpleNamespace(handle=lambda text: None, remember=lambda text: None)
+        lcd = SimpleNamespace(display_emotion=lambda emotion: None)
+        pipe = VoicePipeline(FakeChat(reply), lcd, router)
+        pipe.loop = asyncio.get_running_loop()
+        pipe.state.fire("wake")
+        pipe.state.fire("speech")
+        tasks = [asyncio.create_task(stage()) for stage in (pipe._think, pipe._synthesize, pipe._playback,
+                                                             pipe._display)]
+        try:
+            await pipe._put("transcripts", "今天工作好累")
+            await pipe.state.wait_for(LISTENING)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return pipe.reply_started
+
+    try:
+        out = voice_output.player
+        underruns = out.underruns
+        started = asyncio.run(speak())
+        first_audio = out.started_at - started
+    finally:
+        audio_player.decode_mp3 = decode_mp3
+        device.close()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return {"first_audio_ms": first_audio * 1000, "underruns": out.underruns - underruns}
+
+@case("bargein.cutoff")
+def bench_barge_in(args):
+    from audio_capture import AudioCapture
+    from audio_player import AudioPlayer
+    from barge_in import BargeInMonitor
+
+    capture = AudioCapture()
+    out = AudioPlayer()
+    device = FakeOutputDevice(out)
+    mic = FakeMicrophone(capture, out)
+    monitor = BargeInMonitor(capture, out)
+    monitor.start()
+    false_triggers = 0
+    try:
+        time.sleep(0.3)
+        tone = (np.sin(2 * np.pi * 220 * np.arange(out.samplerate * 4) / out.samplerate) * 8000).astype(np.int16)
+        for _ in range(3):
+            monitor.arm()
+            out.play(tone)
+            # 先只有回声，不应触发
+            time.sleep(1.0)
+            if monitor.last_event is not None:
+                false_triggers += 1
+            mic.speaking = True
+            out.wait(2)
+            time.sleep(0.3)
+            mic.speaking = False
+            monitor.disarm()
+            out.stop()
+            time.sleep(0.3)
+    finally:
+        monitor.close()
+        mic.close()
+        device.close()
+    stats = monitor.stats()
+    if not stats["triggers"]:
+        raise RuntimeError("模拟插话没有被检测到")
+    return {"cutoff_p95_ms": stats["cutoff_p95_ms"], "false_triggers": false_triggers}
+
+@case("display.blit")
+def bench_display(args):
+    from frame_cache import FramePresenter, VirtualFramebuffer, dirty_rects, to_rgb565
+    from config import lcd_width, lcd_height
+
+    # 合成一组表情帧：相同的脸，眼睛和嘴的位置逐帧变化
+    frames = []
+    for i in range(3):
+        rgb = np.full((lcd_height, lcd_width, 3), (255, 200, 0), dtype=np.uint8)
+        rgb[80 + i * 4:110 + i * 4, 90:130] = (40, 40, 40)
+        rgb[80 + i * 4:110 + i * 4, 190:230] = (40, 40, 40)
+        rgb[160:175, 120 - i * 5:200 + i * 5] = (200, 40, 40)
+        frames.append(to_rgb565(rgb))
+
+    backend = VirtualFramebuffer(lcd_width, lcd_height)
+    presenter = FramePresenter(backend)
+    presenter.show(frames[0])
+    for i in range(30):
+        presenter.show(frames[(i + 1) % len(frames)])
+    delta_bytes = sum(backend.frame_bytes[1:]) / (len(backend.frame_bytes) - 1)
+    pairs = [(frames[i], frames[(i + 1) % len(frames)]) for i in range(len(frames))]
+    return {
+        "bytes_per_frame": delta_bytes,
+        "full_frame_ratio": delta_bytes / (lcd_width * lcd_height * 2),
+        "diff_us": per_call_us(lambda pair: dirty_rects(*pair), pairs),
+    }
+
+def run(args):
+    """运行选中的测试项
+
+    Returns:
+        结果字典
+    """
+    results = {}
+    for name, func in CASES:
+        if args.only and not any(pattern in name for pattern in args.only):
+            continue
+        start = time.perf_counter()
+        try:
+            metrics = func(args)
+            results[name] = {"metrics": metrics}
+            summary = ", ".join(f"{key}={value:.3g}" for key, value in metrics.items())
+            print(f"{name:24s} {summary}  ({time.perf_counter() - start:.1f}s)")
+        except Skip as e:
+            results[name] = {"skipped": str(e)}
+            print(f"{name:24s} 跳过: {e}")
+    return results
+
+def compare(results, baseline, tolerance):
+    """与基线比较
+
+    Returns:
+        变慢超过容差的 (测试项, 指标, 基线值, 当前值) 列表
+    """
+    regressions = []
+    for name, entry in results.items():
+        base = baseline.get("results", {}).get(name, {}).get("metrics")
+        if not base or "metrics" not in entry:
+            continue
+        for key, value in entry["metrics"].items():
+            if key not in base:
+                continue
+            # 计数类指标（如播放中断次数）基线为 0 时允许 1 次抖动
+            limit = base[key] * (1 + tolerance) if base[key] > 0 else 1
+            if value > limit:
+                regressions.append((name, key, base[key], value))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="分阶段性能测试套件")
+    parser.add_argument("--only", nargs="*", help="只运行名称包含这些字符串的测试项")
+    parser.add_argument("--output", help="结果 JSON 输出路径")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基线 JSON 路径")
+    parser.add_argument("--save-baseline", "--update-baseline", dest="save_baseline", action="store_true",
+                        help="把本次结果保存为基线（没有基线时必须指定）")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="允许变慢的比例")
+    parser.add_argument("--memory-sizes", type=int, nargs="*", default=[100, 1000, 10000, 100000],
+                        help="相关记忆检索测试的记忆条数")
+    parser.add_argument("--store-turns", type=int, default=2000, help="记忆存储测试的对话轮数")
+    parser.add_argument("--whisper-model", default="tiny", help="Whisper 模型名称")
+    args = parser.parse_args()
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+        "results": run(args),
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"基线已保存到 {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        # 没有基线就无法判断退化，不能当作通过
+        print(f"没有找到基线 {args.baseline}，可用 --update-baseline 生成")
+        sys.exit(2)
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(report["results"], baseline, args.tolerance)
+    for name, key, base, value in regressions:
+        print(f"变慢: {name} {key} 基线 {base:.3g} -> 当前 {value:.3g}")
+    if regressions:
+        sys.exit(1)
+    print(f"与基线（{baseline.get('timestamp', '?')}）相比没有超过 {args.tolerance:.0%} 的退化")
+
+if __name__ == "__main__":
+    main()
@@ -1,73 +1,135 @@
-import json
-import os
 import time
 import re
+import queue
+import random
+import asyncio
+import threading
+from concurrent.futures import CancelledError
 from datetime import datetime
+import openai
 from openai import OpenAI
-from config import openai_api_key, gpt_model, personality_prompt
+from config import openai_api_key, gpt_model, personality_prompt, error_reply, summary_prompt, memory_dir
+from config import memory_token_budget, memory_top_k
+from config import llm_deadline_seconds, llm_attempt_timeout, llm_max_retries, llm_backoff_base, llm_backoff_max
+from config import filler_after_seconds, llm_chunk_timeout
+from context_builder import ContextBuilder
+from memory_store import MemoryStore
+from memory_index import MemoryIndex
+from enrichment import EnrichmentWorker
+from llm_backends import BackendRouter
+import tracing
+
+PREFERENCE_PATTERNS = {
+    "likes": [
+        re.compile(r"我喜欢([\u4e00-\u9fa5a-zA-Z0-9]+)"),
+        re.compile(r"我爱([\u4e00-\u9fa5a-zA-Z0-9]+)"),
+        re.compile(r"我超爱([\u4e00-\u9fa5a-zA-Z0-9]+)")
+    ],
+    "dislikes": [
+        re.compile(r"我不喜欢([\u4e00-\u9fa5a-zA-Z0-9]+)"),
+        re.compile(r"我讨厌([\u4e00-\u9fa5a-zA-Z0-9]+)"),
+        re.compile(r"我不爱([\u4e00-\u9fa5a-zA-Z0-9]+)")
+    ],
+    "interests": [
+        re.compile(r"我想([\u4e00-\u9fa5a-zA-Z0-9]+)"),
+        re.compile(r"我要学([\u4e00-\u9fa5a-zA-Z0-9]+)"),
+        re.compile(r"我对([\u4e00-\u9fa5a-zA-Z0-9]+)感兴趣")
+    ]
+}
+
+# 可以重试的错误：超时、连接失败、限流、服务端 5xx
+TRANSIENT_ERRORS = (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError,
+                    openai.InternalServerError)
+
+llm_loop = None
+llm_loop_lock = threading.Lock()
+
+def get_llm_loop():
+    """获取常驻事件循环，所有 GPT 对话请求都在这个循环里执行"""
+    global llm_loop
+    with llm_loop_lock:
+        if llm_loop is None:
+            llm_loop = asyncio.new_event_loop()
+            threading.Thread(target=llm_loop.run_forever, name="llm-loop", daemon=True).start()
+    return llm_loop
+
+def backoff_delay(attempt, base=llm_backoff_base, cap=llm_backoff_max):
+    """第 attempt 次重试前的等待秒数：指数退避，上下浮动 50% 避免同时重试"""
+    return min(cap, base * 2 ** attempt) * random.uniform(0.5, 1.5)
 
 class ChatGPT:
     """OpenAI GPT API 交互类"""
     
-    def __init__(self, memory_file="memory.json", long_memory_file="memory_long.json"):
+    def __init__(self, memory_file="memory.json", long_memory_file="memory_long.json", memory_dir=memory_dir):
         """初始化 ChatGPT
         
         Args:
-            memory_file: 记忆文件路径
-            long_memory_file: 长期记忆文件路径
+            memory_file: 旧版记忆文件路径，首次启动时导入
+            long_memory_file: 旧版长期记忆文件路径，首次启动时导入
+            memory_dir: 记忆存储目录
         """
-        self.memory_file = memory_file
-        self.long_memory_file = long_memory_file
         self.client = OpenAI(api_key=openai_api_key)
-        self.messages = self._load_memory()
-        self.long_memory = self._load_long_memory()
+        # 对话请求按延迟和健康状况在各后端之间路由，摘要仍用默认模型
+        self.backends = BackendRouter()
+        self.inflight = None
+        self.store = MemoryStore(memory_dir)
+        if self.store.empty and self.store.migrate_from_json(memory_file, long_memory_file):
+            print(f"已从 {memory_file} / {long_memory_file} 导入记忆")
+        self.messages = self.store.messages
+        self.index = self._build_index()
+        self.context = ContextBuilder()
+        self.worker = EnrichmentWorker()
         
-    def _load_memory(self):
-        """加载历史对话作为记忆
+    def _build_index(self):
+        """从已保存的长期记忆建立检索索引
         
         Returns:
-            对话历史消息列表
-        """
-        if os.path.exists(self.memory_file):
-            with open(self.memory_file, "r", encoding="utf-8") as f:
-                return json.load(f)
-        else:
-            return [
-                {
-                    "role": "system",
-                    "content": personality_prompt
-                }
-            ]
-            
-    def _load_long_memory(self):
-        """加载长期记忆
+            MemoryIndex 实例
+        """
+        index = MemoryIndex()
+        for conversation in self.store.conversations:
+            self._index_conversation(index, conversation)
+        for category, items in self.store.preferences.items():
+            for item in items:
+                self._index_preference(index, category, item)
+        return index
         
-        Returns:
-            长期记忆数据
-        """
-        if os.path.exists(self.long_memory_file):
-            with open(self.long_memory_file, "r", encoding="utf-8") as f:
-                return json.load(f)
-        else:
-            return {
-                "conversations": [],
-                "preferences": {
-                    "likes": [],
-                    "dislikes": [],
-                    "interests": []
-                }
-            }
-            
-    def _save_memory(self):
-        """保存对话历史到文件"""
-        with open(self.memory_file, "w", encoding="utf-8") as f:
-            json.dump(self.messages, f, ensure_ascii=False, indent=2)
-            
-    def _save_long_memory(self):
-        """保存长期记忆到文件"""
-        with open(self.long_memory_file, "w", encoding="utf-8") as f:
-            json.dump(self.long_memory, f, ensure_ascii=False, indent=2)
+    @staticmethod
+    def _index_conversation(index, conversation):
+        """把一条对话加入索引"""
+        reply = conversation["reply"]
+        if len(reply) > 60:
+            reply = reply[:60] + "…"
+        date = conversation.get("timestamp", "")[:10]
+        index.add(
+            f"{date} 主人说「{conversation['user_input']}」，你回答「{reply}」",
+            conversation["user_input"] + " " + conversation["reply"]
+        )
+        
+    @staticmethod
+    def _index_preference(index, category, item):
+        """把一条偏好加入索引"""
+        labels = {"likes": "主人喜欢", "dislikes": "主人不喜欢", "interests": "主人感兴趣的事"}
+        index.add(f"{labels.get(category, category)}：{item}")
+        
+    def flush(self, timeout=None):
+        """等待后台整理任务执行完（休眠前调用）
+        
+        Args:
+            timeout: 最长等待秒数
             
+        Returns:
+            是否在超时前执行完
+        """
+        done = self.worker.flush(timeout)
+        print(self.worker.report())
+        return done
+        
+    def close(self):
+        """执行完后台整理任务，把记忆日志刷盘并关闭"""
+        self.worker.close()
+        self.store.close()
+        
     def _extract_preferences(self, text):
         """从文本中提取用户偏好
         
@@ -77,41 +139,14 @@ class ChatGPT:
         Returns:
             提取的偏好字典
         """
-        preferences = {
-            "likes": [],
-            "dislikes": [],
-            "interests": []
-        }
-        
-        like_patterns = [
-            r"我喜欢([\u4e00-\u9fa5a-zA-Z0-9]+)",
-            r"我爱([\u4e00-\u9fa5a-zA-Z0-9]+)",
-            r"我超爱([\u4e00-\u9fa5a-zA-Z0-9]+)"
-        ]
-        
-        dislike_patterns = [
-            r"我不喜欢([\u4e00-\u9fa5a-zA-Z0-9]+)",
-            r"我讨厌([\u4e00-\u9fa5a-zA-Z0-9]+)",
-            r"我不爱([\u4e00-\u9fa5a-zA-Z0-9]+)"
-        ]
+        preferences = {category: [] for category in PREFERENCE_PATTERNS}
+        # 所有句式都以“我”开头，不含“我”的输入不必逐条匹配
+        if "我" not in text:
+            return preferences
         
-        interest_patterns = [
-            r"我想([\u4e00-\u9fa5a-zA-Z0-9]+)",
-            r"我要学([\u4e00-\u9fa5a-zA-Z0-9]+)",
-            r"我对([\u4e00-\u9fa5a-zA-Z0-9]+)感兴趣"
-        ]
-        
-        for pattern in like_patterns:
-            matches = re.findall(pattern, text)
-            preferences["likes"].extend(matches)
-            
-        for pattern in dislike_patterns:
-            matches = re.findall(pattern, text)
-            preferences["dislikes"].extend(matches)
-            
-        for pattern in interest_patterns:
-            matches = re.findall(pattern, text)
-            preferences["interests"].extend(matches)
+        for category, patterns in PREFERENCE_PATTERNS.items():
+            for pattern in patterns:
+                preferences[category].extend(pattern.findall(text))
             
         return preferences
         
@@ -132,78 +167,370 @@ class ChatGPT:
             "timestamp": timestamp
         }
         
-        self.long_memory["conversations"].append(conversation)
+        self.store.add_conversation(conversation)
+        self._index_conversation(self.index, conversation)
         
         preferences = self._extract_preferences(user_input)
         
         for category, items in preferences.items():
             for item in items:
-                if item not in self.long_memory["preferences"][category]:
-                    self.long_memory["preferences"][category].append(item)
+                if self.store.add_preference(category, item):
+                    self._index_preference(self.index, category, item)
         
-        self._save_long_memory()
+    def _inject_memory_context(self, query):
+        """检索与本轮输入相关的记忆
         
-    def _inject_memory_context(self):
-        """注入记忆上下文到提示词中
+        Args:
+            query: 本轮用户输入
+            
+        Returns:
+            记忆上下文文本，没有相关记忆时为空字符串
+        """
+        memories = self.index.select(query, memory_token_budget, memory_top_k)
+        if not memories:
+            return ""
+            
+        return "与当前话题相关的记忆：\n" + "\n".join(f"- {memory}" for memory in memories)
+        
+    def _build_messages(self, message):
+        """按 token 预算组装本次请求的消息列表
         
+        Args:
+            message: 本轮用户消息（尚未记入对话历史）
+            
         Returns:
-            包含记忆上下文的提示词
+            发送给 API 的消息列表
         """
-        if not self.long_memory["preferences"]["likes"] and not self.long_memory["preferences"]["interests"]:
-            return personality_prompt
+        summary = self.store.summary
+        return self.context.build(
+            personality_prompt,
+            summary["text"],
+            self.messages[summary["upto"]:] + [message],
+            self._inject_memory_context(message["content"])
+        )
+        
+    def _maybe_summarize(self):
+        """未压缩的对话超出预算时，把较早的部分压缩进摘要（在后台整理线程中执行）"""
+        start = self.store.summary["upto"]
+        end = self.context.fold_point(self.messages, start)
+        if end is None:
+            return
             
-        memory_context = personality_prompt + "\n\n用户偏好信息："
+        self._summarize(start, end)
         
-        if self.long_memory["preferences"]["likes"]:
-            memory_context += f"\n- 用户喜欢: {', '.join(self.long_memory['preferences']['likes'])}"
+    def _summarize(self, start, end):
+        """把 messages[start:end] 与已有摘要合并为新的摘要
+        
+        Args:
+            start: 起始下标
+            end: 结束下标（不含）
+        """
+        try:
+            lines = []
+            previous = self.store.summary["text"]
+            if previous:
+                lines.append(f"已有摘要：{previous}")
+            for message in self.messages[start:end]:
+                if message["role"] == "user":
+                    lines.append(f"主人：{message['content']}")
+                elif message["role"] == "assistant":
+                    lines.append(f"小Luna：{message['content']}")
+                    
+            response = self.client.chat.completions.create(
+                model=gpt_model,
+                messages=[
+                    {"role": "system", "content": summary_prompt},
+                    {"role": "user", "content": "\n".join(lines)}
+                ],
+                temperature=0.3
+            )
+            
+            self.store.set_summary(response.choices[0].message.content.strip(), end)
+            self.store.sync()
+            print(f"对话摘要已更新，压缩到第 {end} 条消息")
             
-        if self.long_memory["preferences"]["interests"]:
-            memory_context += f"\n- 用户感兴趣: {', '.join(self.long_memory['preferences']['interests'])}"
+        except Exception as e:
+            print(f"生成对话摘要出错: {str(e)}")
             
-        return memory_context
+    def _begin_turn(self, user_input):
+        """生成本轮的用户消息
         
-    def chat(self, user_input, emotion="neutral"):
-        """与 GPT 交流
+        用户消息等到有回复时才和回复一起记入对话历史，请求失败或还没回复就被插话取消时
+        不会留下一条没有回复的用户消息。
         
         Args:
             user_input: 用户输入文本
-            emotion: 检测到的情绪
             
         Returns:
-            GPT 回复文本
+            用户消息
         """
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        if self.messages[0]["role"] == "system":
-            self.messages[0]["content"] = self._inject_memory_context()
-        
-        self.messages.append({
+        return {
             "role": "user", 
             "content": user_input,
-            "timestamp": timestamp
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+        
+    def _finish_turn(self, message, reply, emotion):
+        """记录本轮用户消息和回复，其余整理工作交给后台线程
+        
+        消息先追加到内存中的对话历史，保证下一轮能看到；
+        长期记忆、偏好提取、落盘和摘要都放入后台队列，不推迟回复。
+        
+        Args:
+            message: _begin_turn 生成的用户消息
+            reply: GPT 回复文本（被打断时为已经生成的部分）
+            emotion: 检测到的情绪
+        """
+        user_input = message["content"]
+        self.store.append_message(message)
+        self.store.append_message({
+            "role": "assistant", 
+            "content": reply,
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         })
         
+        # 在 GPT 事件循环里调用，后台队列满时不能在这里等，交给转交线程
+        self.worker.submit(self._update_long_memory, user_input, reply, emotion, block=False)
+        # 落盘和摘要只关心最新状态，排队期间的重复提交会被合并
+        self.worker.submit(self.store.sync, key="sync", block=False)
+        self.worker.submit(self._maybe_summarize, key="summarize", block=False)
+        
+    async def _attempt(self, backend, stream, timeout, kwargs):
+        """向一个后端发起请求；流式请求等到第一个非空 token 才算成功
+
+        Returns:
+            非流式为 API 响应；流式为 (异步流, 分块迭代器, 第一个 token)
+        """
+        response = await backend.get_client().chat.completions.create(
+            model=backend.model, stream=stream, timeout=timeout, **kwargs)
+        if not stream:
+            return response
+
+        chunks = response.__aiter__()
         try:
-            response = self.client.chat.completions.create(
-                model=gpt_model,
-                messages=self.messages,
-                temperature=0.7
-            )
+            async for chunk in chunks:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    return response, chunks, chunk.choices[0].delta.content
+        except BaseException:
+            await response.close()
+            raise
+        return response, chunks, None
+
+    async def _create(self, deadline, stream=False, **kwargs):
+        """按后端路由顺序发起请求，出错或超时切换到下一个后端
+
+        一轮所有后端都失败且有可重试的错误（超时、连接失败、限流、5xx）时，按指数退避后再来一轮，
+        不超过本轮截止时间。每个后端的单次尝试不超过 llm_attempt_timeout，慢的后端不会耗光整轮时间。
+
+        Args:
+            deadline: perf_counter 截止时间
+            stream: 是否流式
+            **kwargs: chat.completions.create 的其他参数
+
+        Returns:
+            (后端, _attempt 的返回值)
+        """
+        attempt = 0
+        while True:
+            retryable = False
+            last_error = None
+            for backend in self.backends.candidates():
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                timeout = min(remaining, llm_attempt_timeout)
+                started = time.perf_counter()
+                try:
+                    result = await asyncio.wait_for(self._attempt(backend, stream, timeout, kwargs), timeout)
+                except (openai.APIError, asyncio.TimeoutError) as e:
+                    backend.record_failure()
+                    retryable = retryable or isinstance(e, TRANSIENT_ERRORS + (asyncio.TimeoutError,))
+                    last_error = e
+                    print(f"大模型后端 {backend.name} 请求失败（{type(e).__name__}）")
+                    continue
+                backend.record_success((time.perf_counter() - started) * 1000)
+                return backend, result
+
+            delay = backoff_delay(attempt)
+            if not retryable or attempt >= llm_max_retries or time.perf_counter() + delay >= deadline:
+                raise last_error
+            attempt += 1
+            print(f"所有大模型后端都请求失败，{delay:.1f} 秒后第 {attempt} 次重试")
+            await asyncio.sleep(delay)
+
+    def _watch_first_token(self, on_slow):
+        """首字迟迟未到时在线程池中调用 on_slow（播放垫话、显示思考表情）
+
+        Returns:
+            定时器句柄，首字到达后取消；未设置 on_slow 时为 None
+        """
+        if on_slow is None:
+            return None
+        loop = asyncio.get_running_loop()
+        return loop.call_later(filler_after_seconds, loop.run_in_executor, None, on_slow)
+
+    async def achat(self, user_input, emotion="neutral", on_slow=None):
+        """与 GPT 交流（协程）
+        
+        Args:
+            user_input: 用户输入文本
+            emotion: 检测到的情绪
+            on_slow: 超过 filler_after_seconds 仍未收到回复时调用一次
+            
+        Returns:
+            GPT 回复文本，出错或超时返回 error_reply
+        """
+        message = self._begin_turn(user_input)
+        deadline = time.perf_counter() + llm_deadline_seconds
+        watcher = self._watch_first_token(on_slow)
+        
+        try:
+            with tracing.span("llm") as span:
+                backend, response = await self._create(
+                    deadline,
+                    messages=self._build_messages(message),
+                    temperature=0.7
+                )
+                span.set(model=backend.name)
             
             reply = response.choices[0].message.content
             
-            self.messages.append({
-                "role": "assistant", 
-                "content": reply,
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            })
+            self._finish_turn(message, reply, emotion)
             
-            self._save_memory()
+            return reply
             
-            self._update_long_memory(user_input, reply, emotion)
+        except asyncio.TimeoutError:
+            print(f"GPT 在 {llm_deadline_seconds} 秒内没有回复")
+            return error_reply
+        except Exception as e:
+            print(f"GPT 调用出错: {str(e)}")
+            return error_reply
+        finally:
+            if watcher is not None:
+                watcher.cancel()
             
-            return reply
+    async def astream(self, user_input, emotion="neutral", on_slow=None):
+        """与 GPT 流式交流（异步生成器），边生成边返回
+        
+        收到首字之前的失败会切换后端或重试，受整轮时限约束；已经开始输出后只限制相邻分块的间隔
+        （llm_chunk_timeout），中断则停止，不再重试。
+        中途出错、超时或被插话取消时，已经生成的部分作为本轮回复记入对话历史。
+        
+        Args:
+            user_input: 用户输入文本
+            emotion: 检测到的情绪
+            on_slow: 超过 filler_after_seconds 仍未收到首字时调用一次
             
+        Yields:
+            GPT 回复的增量文本
+        """
+        message = self._begin_turn(user_input)
+        deadline = time.perf_counter() + llm_deadline_seconds
+        watcher = self._watch_first_token(on_slow)
+        
+        parts = []
+        stream = None
+        try:
+            request_start = time.perf_counter()
+            backend, (stream, chunks, first) = await self._create(
+                deadline,
+                stream=True,
+                messages=self._build_messages(message),
+                temperature=0.7
+            )
+            if watcher is not None:
+                watcher.cancel()
+            tracing.record("llm.first_token", request_start, model=backend.name)
+            if first:
+                parts.append(first)
+                yield first
+                
+            # 整轮时限只管到首字；之后只要分块不断，长回复可以一直读完
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), llm_chunk_timeout)
+                except StopAsyncIteration:
+                    break
+                if not chunk.choices:
+                    continue
+                token = chunk.choices[0].delta.content
+                if token:
+                    parts.append(token)
+                    yield token
+            
+        except asyncio.TimeoutError:
+            if parts:
+                print(f"GPT 输出中断，超过 {llm_chunk_timeout} 秒没有新内容")
+            else:
+                print(f"GPT 在 {llm_deadline_seconds} 秒内没有回复")
+                yield error_reply
         except Exception as e:
             print(f"GPT 调用出错: {str(e)}")
-            return f"抱歉，我遇到了一点小问题: {str(e)}"
+            if not parts:
+                yield error_reply
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            if parts:
+                self._finish_turn(message, "".join(parts), emotion)
+            if stream is not None:
+                await stream.close()
+                
+    def chat(self, user_input, emotion="neutral", on_slow=None):
+        """与 GPT 交流，在后台事件循环中执行，可用 cancel() 取消
+        
+        Args:
+            user_input: 用户输入文本
+            emotion: 检测到的情绪
+            on_slow: 超过 filler_after_seconds 仍未收到回复时调用一次
+            
+        Returns:
+            GPT 回复文本，被取消时返回空字符串
+        """
+        future = asyncio.run_coroutine_threadsafe(self.achat(user_input, emotion, on_slow), get_llm_loop())
+        self.inflight = future
+        try:
+            return future.result()
+        except CancelledError:
+            return ""
+        finally:
+            self.inflight = None
+            
+    def chat_stream(self, user_input, emotion="neutral", on_slow=None):
+        """与 GPT 流式交流，边生成边返回，可用 cancel() 取消
+        
+        Args:
+            user_input: 用户输入文本
+            emotion: 检测到的情绪
+            on_slow: 超过 filler_after_seconds 仍未收到首字时调用一次
+            
+        Yields:
+            GPT 回复的增量文本
+        """
+        tokens = queue.Queue()
+        
+        async def pump():
+            try:
+                async for token in self.astream(user_input, emotion, on_slow):
+                    tokens.put(token)
+            finally:
+                tokens.put(None)
+                
+        future = asyncio.run_coroutine_threadsafe(pump(), get_llm_loop())
+        self.inflight = future
+        try:
+            while True:
+                token = tokens.get()
+                if token is None:
+                    break
+                yield token
+        finally:
+            # 调用方提前停止读取时取消请求
+            future.cancel()
+            self.inflight = None
+            
+    def cancel(self):
+        """取消进行中的对话请求"""
+        future = self.inflight
+        if future is not None:
+            future.cancel()
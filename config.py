@@ -8,16 +8,114 @@ from dotenv import load_dotenv
 load_dotenv()
 
 wake_words = ["Hi, Luna", "小Luna"]
+# 第一级唤醒检测使用的 Vosk 语法（词语需在 vosk 模型词表内，以空格分词）
+wake_grammar = ["小 露 娜", "嗨 露 娜", "露 娜"]
 sleep_keywords = ["睡觉吧Luna", "睡吧Luna", "goodnight Luna", "晚安Luna"]
 silence_timeout = 8  # 静默超时时间（秒）
 
+vad_frame_ms = 20  # VAD 帧长（毫秒），10~30
+vad_hangover_ms = 800  # 连续静音超过该时长判定一句话结束（毫秒）
+
+capture_block_ms = 50  # 常驻录音流每个回调块的时长（毫秒）
+capture_buffer_seconds = 30  # 录音环形缓冲区时长（秒），读取落后超过该时长的部分会丢失
+capture_preroll_seconds = 1.5  # 开始识别时回溯的预录时长（秒），覆盖唤醒回应播放期间说的话；其中低于回声门限的部分（小Luna自己的声音）被抹掉
+
+bargein_enabled = True  # 小Luna说话时继续听，主人开口即停止播报（插话）
+bargein_start_ms = 100  # 连续有声多久判定为插话（毫秒），越短越灵敏，停止延迟 ≈ 该值 + 录音块 + 播放块
+bargein_echo_coupling = 0.5  # 回声耦合系数初值（麦克风录到的扬声器声音能量 / 输出能量），运行中自动学习
+bargein_margin = 2.0  # 麦克风能量需超过回声估计的倍数
+bargein_min_energy = 0.01  # 插话能量绝对下限
+bargein_echo_window_ms = 300  # 取最近多长时间内的最大输出音量估计回声（毫秒）
+bargein_mask_window_ms = 120  # 预录去回声时取录音时刻之前多长时间内的输出音量（毫秒），比插话检测短，播放刚停时主人说的话不会被抹掉
+
 openai_api_key = os.getenv("OPENAI_API_KEY")
-gpt_model = "gpt-3.5-turbo"  # 或使用 "gpt-4"
+gpt_model = "gpt-3.5-turbo"  # 默认模型（对话摘要使用）
+llm_local_url = os.getenv("LLM_LOCAL_URL")  # 本地 OpenAI 兼容服务地址，如 http://127.0.0.1:8080/v1（llama.cpp/Ollama）
+llm_local_model = os.getenv("LLM_LOCAL_MODEL", "qwen2.5-3b-instruct")  # 本地服务的模型名
+# 对话使用的大模型后端，每轮按实测延迟选最快的健康后端，出错自动切换；expected_ms 为还没有测量数据时假定的首字延迟
+llm_backends = [
+    {"name": gpt_model, "model": gpt_model, "expected_ms": 1200},
+    {"name": "gpt-4", "model": "gpt-4", "expected_ms": 3000},
+] + ([{"name": "local", "model": llm_local_model, "base_url": llm_local_url, "api_key": "local",
+       "expected_ms": 2000}] if llm_local_url else [])
+llm_latency_window = 50  # 每个后端统计最近多少次请求的延迟和出错率
+llm_min_samples = 5  # 样本数达到多少后按实测 p95 排序
+llm_explore_rate = 0.05  # 偶尔把请求发给非最快的后端，保持其延迟统计是新的
+llm_trip_after = 2  # 连续出错多少次后暂停使用该后端
+llm_cooldown_seconds = 30  # 暂停使用的时长（秒），之后重新尝试
+context_token_budget = 3000  # 单次请求上下文的 token 上限
+reply_token_reserve = 500  # 为回复预留的 token 数
+memory_token_budget = 300  # 每轮注入的相关记忆 token 上限
+memory_top_k = 5  # 每轮最多注入的相关记忆条数
+memory_dir = "memory_data"  # 记忆日志与快照目录
+memory_compact_every = 500  # 日志累计多少条记录后压缩为快照
+enrichment_queue_size = 64  # 每轮结束后的后台整理任务（落盘、偏好提取、摘要）队列容量
+llm_deadline_seconds = 15  # 每轮 GPT 请求（含重试）收到首字（非流式为完整回复）的总时限（秒），超时播报 error_reply
+llm_chunk_timeout = 5  # 流式回复开始输出后相邻两个分块的最长间隔（秒），超过视为中断；长回复不受总时限限制
+llm_attempt_timeout = 6  # 单个后端一次尝试等待首字的上限（秒），超过则切换到下一个后端
+llm_max_retries = 2  # 所有后端都因超时、连接失败、限流、5xx 出错时，最多再重试几轮（只在收到首字之前重试）
+llm_backoff_base = 0.5  # 重试退避的基础等待（秒），每次翻倍并随机浮动
+llm_backoff_max = 4  # 单次重试等待上限（秒）
+filler_after_seconds = 1.2  # 超过该时长仍未收到首字时播放垫话并显示思考表情
+filler_phrases = ["嗯…让我想想~", "稍等一下哦~", "唔，我想一想~"]  # 垫话（启动时预合成，未缓存的不播放）
+summary_prompt = "请把下面这段对话压缩成简短的摘要，保留主人的重要信息、情绪和约定，用第三人称描述，不超过200字。"
+
+vosk_model_path = "vosk-model-small-cn-0.22"  # Vosk 中文模型目录
+
+asr_model = "auto"  # 语音识别引擎："auto" 按实测实时率自动选择，或固定为 "whisper-base"、"vosk" 等
+asr_candidates = ["whisper-small", "whisper-base", "whisper-tiny", "vosk"]  # 自动选择的候选，按准确度从高到低
+asr_target_rtf = 0.5  # 识别耗时 / 语音时长 的上限
+asr_calibration_clip = "calibration.wav"  # 测速录音（16 位单声道），不存在时使用合成音频
+asr_probe_cache = "asr_probe.json"  # 测速结果缓存，换机器或删除后重新测速
+asr_downgrade_after = 3  # 连续多少次识别超出预算后降到更快的引擎
+asr_worker_enabled = True  # Whisper 在独立进程中解码，不拖慢表情动画和对话流程
+asr_worker_threads = 3  # 识别进程的 torch 线程数
+asr_worker_cores = [1, 2, 3]  # 识别进程绑定的 CPU 核心（0 号留给录音、播放和渲染），空列表不绑定
+asr_worker_ring_seconds = 30  # 识别进程共享内存环形缓冲区时长（秒），超出部分只识别最后这么长
+asr_worker_timeout = 30  # 单次识别最长等待（秒），超时视为卡死并重启识别进程
+asr_worker_load_timeout = 120  # 识别进程加载模型的最长等待（秒）
 
 voice_model = "zh-CN-XiaoyiNeural"  # 默认使用晓伊语音
 
+stream_reply = True  # 流式模式：GPT 边生成边分句合成播放
+tts_concurrency = 3  # 流式模式下同时进行的语音合成请求数
+pipeline_segment_queue = 1  # 录好待识别的语音段队列长度，识别跟不上时录音阶段等待
+pipeline_clause_queue = 4  # 待合成的句子队列长度，满了就暂停读取 GPT 输出
+pipeline_audio_queue = 2  # 已提交合成、待播放的句子数上限（最多提前合成几句）
+pipeline_player_queue = 1  # 播放器里排队未播的句子数上限，达到时播放阶段等前一句开始播放，背压由此传到合成和 GPT
+pipeline_display_queue = 4  # 表情切换队列长度，满了丢弃最早的（只保留最新情绪）
+
+playback_samplerate = 24000  # 播放采样率，与 edge-tts 输出一致
+playback_blocksize = 1024  # 播放回调块大小（采样点），决定停止播放的最大延迟
+playback_volume = 0.8  # 初始音量（0~1），可用「大声点」「小声点」调整
+volume_step = 0.2  # 每次调整的音量幅度
+
+tts_cache_dir = "tts_cache"  # 语音合成缓存目录
+tts_cache_max_bytes = 50 * 1024 * 1024  # 语音缓存上限（字节）
+error_reply = "抱歉，我遇到了一点小问题，等一下再试试吧~"  # GPT 调用出错时的回复
+# 启动时预合成的固定提示语（唤醒/休眠回应之外）
+tts_prewarm_phrases = [error_reply]
+
+lcd_width = 320  # ILI9341 横屏分辨率
+lcd_height = 240
+lcd_asset_dir = "assets"  # 表情帧 BMP 素材目录
+lcd_frame_pack = "frames.pack"  # 预编译的 RGB565 表情帧打包文件（python frame_cache.py --compile 生成），存在时优先使用
+lcd_spi_bus = 0  # ILI9341 所在 SPI 总线 / 片选
+lcd_spi_device = 0
+lcd_spi_hz = 32000000  # SPI 时钟频率
+lcd_dc_pin = 24  # 数据/命令引脚（BCM 编号）
+lcd_reset_pin = 25  # 复位引脚（BCM 编号）
+display_fps = 20  # 渲染线程节拍频率（每秒），决定表情切换响应和淡入的平滑程度
+animation_frame_seconds = 0.3  # 表情动画每帧停留时长（秒）
+display_crossfade_ms = 200  # 切换表情时的淡入时长（毫秒），0 为直接切换
+
 TEST_MODE = False  # 默认关闭测试模式
 
+tracing_enabled = True  # 记录每轮对话各阶段耗时（关闭后几乎没有开销）
+trace_file = "traces.jsonl"  # 追踪记录导出文件，用 python tracing.py 统计
+trace_buffer_size = 4096  # 内存中最多缓存的 span 条数
+trace_flush_seconds = 60  # 定期导出间隔（秒）
+
 personality_prompt = """
 你是小Luna，一个坐在主人桌面上的可爱AI桌宠，温柔、情绪细腻、语气治愈。
 你会主动关心主人的情绪，也喜欢撒娇或用轻松方式互动。
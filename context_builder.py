@@ -0,0 +1,113 @@
+"""
+对话上下文组装模块
+按 token 预算组装发给 GPT 的消息列表：
+固定的人设提示词在最前面，其次是滚动摘要，最后是摘要之后的最近对话。
+较早的对话由后台任务压缩进摘要，两次压缩之间消息前缀保持不变，便于服务端缓存。
+"""
+import re
+from config import context_token_budget, reply_token_reserve
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
+
+CJK = re.compile(r"[\u3000-\u9fff\uff00-\uffef]")
+
+# 发送给 API 的字段，其余（如 timestamp）只在本地保存
+API_FIELDS = ("role", "content")
+# 每条消息的格式开销
+MESSAGE_OVERHEAD = 4
+
+def count_tokens(text):
+    """估算文本的 token 数
+
+    安装了 tiktoken 时精确计算，否则按中文每字 1 个、其他字符每 4 个 1 个估算。
+    """
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    cjk = len(CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def message_tokens(message):
+    """单条消息的 token 数"""
+    return MESSAGE_OVERHEAD + count_tokens(message.get("content", ""))
+
+def strip_message(message):
+    """去掉本地字段，只保留 API 需要的字段"""
+    return {key: message[key] for key in API_FIELDS if key in message}
+
+class ContextBuilder:
+    """按 token 预算组装上下文"""
+
+    def __init__(self, budget=context_token_budget, reply_reserve=reply_token_reserve):
+        """
+        Args:
+            budget: 单次请求的上下文 token 上限
+            reply_reserve: 为回复预留的 token 数
+        """
+        self.budget = budget
+        self.reply_reserve = reply_reserve
+
+    @property
+    def history_budget(self):
+        """扣除回复预留后，可用于提示词和历史的 token 数"""
+        return self.budget - self.reply_reserve
+
+    def build(self, system_prompt, summary, history, memory_context=""):
+        """组装消息列表
+
+        Args:
+            system_prompt: 人设提示词
+            summary: 更早对话的摘要，可为空
+            history: 摘要之后的对话消息（可包含本地字段），最后一条为本轮用户输入
+            memory_context: 本轮检索到的相关记忆，放在本轮用户输入之前，不影响前缀
+
+        Returns:
+            可直接发送给 API 的消息列表
+        """
+        head = [{"role": "system", "content": system_prompt}]
+        if summary:
+            head.append({"role": "system", "content": f"之前对话的摘要：\n{summary}"})
+        recall = [{"role": "system", "content": memory_context}] if memory_context else []
+
+        remaining = self.history_budget - sum(message_tokens(m) for m in head + recall)
+        turns = [m for m in history if m.get("role") != "system"]
+
+        # 摘要尚未追上时，从最旧的消息开始丢弃，保证不超预算
+        start = len(turns)
+        while start > 0 and remaining - message_tokens(turns[start - 1]) >= 0:
+            start -= 1
+            remaining -= message_tokens(turns[start])
+        if start == len(turns) and turns:
+            start = len(turns) - 1
+
+        window = [strip_message(m) for m in turns[start:]]
+        return head + window[:-1] + recall + window[-1:]
+
+    def fold_point(self, history, start):
+        """判断是否需要把较早的对话压缩进摘要
+
+        Args:
+            history: 全部对话消息
+            start: 尚未压缩的第一条消息下标
+
+        Returns:
+            应压缩到的下标（不含），不需要压缩时返回 None
+        """
+        pending = [message_tokens(m) for m in history[start:]]
+        if sum(pending) <= self.history_budget * 3 // 4:
+            return None
+
+        # 压缩后保留约一半预算的最近对话，并且从用户消息开始
+        keep = 0
+        end = len(history)
+        while end > start and keep + pending[end - start - 1] <= self.history_budget // 2:
+            end -= 1
+            keep += pending[end - start]
+        while end < len(history) and history[end].get("role") != "user":
+            end += 1
+        return end if end > start else None
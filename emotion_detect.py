@@ -2,11 +2,15 @@
 情绪检测模块
 基于关键词匹配识别情绪状态
 支持六种情绪类别：开心、伤心、生气、思考、困倦、害怕
+关键词表在导入时编译为 Aho-Corasick 自动机，一次扫描找出全部关键词
 """
+import re
+from collections import deque
 from typing import Dict, List, Tuple
+import tracing
 
 EMOTION_KEYWORDS = {
-    "happy": ["开心", "谢谢你", "真棒", "喜欢", "感谢", "棒", "好", "爱", "哈哈", "开心", "高兴", "快乐", "满意"],
+    "happy": ["开心", "谢谢你", "真棒", "喜欢", "感谢", "棒", "好", "爱", "哈哈", "高兴", "快乐", "满意"],
     "sad": ["难过", "孤单", "伤心", "委屈", "失望", "悲伤", "哭", "想哭", "伤感", "遗憾", "心痛"],
     "angry": ["讨厌", "生气", "烦", "滚", "不开心", "烦躁", "郁闷", "恼火", "愤怒", "不爽", "厌烦"],
     "thinking": ["为什么", "这是什么", "怎么做", "请解释", "解释一下", "怎么", "如何", "是什么", "什么意思", "思考", "想知道"],
@@ -14,34 +18,228 @@ EMOTION_KEYWORDS = {
     "scared": ["害怕", "担心", "不敢", "我怕", "恐惧", "惊吓", "紧张", "忧虑", "惊慌", "恐慌", "怕"],
 }
 
-def detect_emotion(text: str) -> str:
-    """从文本中检测情绪
-    
+# 含情绪关键词但本身不表达情绪的固定说法，按最长匹配优先把里面的关键词盖掉，如“不好意思”里的“好”
+NEUTRAL_PHRASES = ["不好意思", "好意思", "只好", "好像", "好不好", "好吗"]
+
+# 紧跟另一个关键词时只是程度副词的关键词，如“好疲惫”“好难过”里的“好”，不单独计分
+DEGREE_WORDS = {"好"}
+
+# 关键词前出现否定词（可带程度副词）时视为被否定，如“不高兴”“没有生气”“不太满意”
+NEGATION = re.compile(r"(不|没有?|别|并不|无)(是|太|很|怎么|那么|大|再)?$")
+NEGATION_WINDOW = 4
+# 否定表达的最后一个字，关键词前一个字不在其中时不必做正则检查
+NEGATION_TAIL = set("不没有别无是太很么大再")
+# 被否定的关键词计入的情绪，未列出的情绪被否定后不计分
+NEGATED_EMOTION = {"happy": "sad"}
+
+class KeywordAutomaton:
+    """Aho-Corasick 多模式匹配自动机
+
+    构建时把失败指针展开为完整的状态转移表，扫描时每个字符只需一次字典查找。
+    """
+
+    def __init__(self, keywords: Dict[str, List[str]]):
+        """
+        Args:
+            keywords: 情绪 -> 关键词列表
+        """
+        self.keywords = []  # (关键词, 情绪)
+        seen = set()
+        for emotion, words in keywords.items():
+            for word in words:
+                word = word.lower()
+                if (word, emotion) not in seen:
+                    seen.add((word, emotion))
+                    self.keywords.append((word, emotion))
+
+        goto = [{}]
+        outputs = [[]]
+        for index, (word, _) in enumerate(self.keywords):
+            state = 0
+            for ch in word:
+                if ch not in goto[state]:
+                    goto.append({})
+                    outputs.append([])
+                    goto[state][ch] = len(goto) - 1
+                state = goto[state][ch]
+            outputs[state].append(index)
+
+        fail = [0] * len(goto)
+        order = []
+        pending = deque(goto[0].values())
+        while pending:
+            state = pending.popleft()
+            order.append(state)
+            for ch, child in goto[state].items():
+                pending.append(child)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                target = goto[f].get(ch, 0)
+                fail[child] = target if target != child else 0
+                outputs[child] = outputs[child] + outputs[fail[child]]
+
+        self.delta = [dict() for _ in goto]
+        self.delta[0] = dict(goto[0])
+        for state in order:
+            self.delta[state] = {**self.delta[fail[state]], **goto[state]}
+        self.outputs = [tuple((len(self.keywords[i][0]), i) for i in out) for out in outputs]
+
+    def find_all(self, text: str) -> List[Tuple[int, int, int]]:
+        """单次扫描找出所有关键词出现位置
+
+        Returns:
+            [(起始位置, 结束位置, 关键词编号), ...]
+        """
+        delta = self.delta
+        outputs = self.outputs
+        state = 0
+        matches = []
+        for end, ch in enumerate(text, 1):
+            state = delta[state].get(ch, 0)
+            if outputs[state]:
+                for length, index in outputs[state]:
+                    matches.append((end - length, end, index))
+        return matches
+
+    def find_longest(self, text: str) -> List[Tuple[int, int, int]]:
+        """找出互不重叠的关键词，重叠时优先靠左、更长的关键词（如“不开心”优先于“开心”）"""
+        return self.longest(self.find_all(text))
+
+    @staticmethod
+    def longest(matches: List[Tuple[int, int, int]]) -> List[Tuple[int, int, int]]:
+        """从 find_all 的结果中选出互不重叠的关键词，规则同 find_longest"""
+        if len(matches) < 2:
+            return matches
+        matches.sort(key=lambda m: (m[0], m[0] - m[1]))
+        selected = []
+        last_end = 0
+        for match in matches:
+            if match[0] >= last_end:
+                selected.append(match)
+                last_end = match[1]
+        return selected
+
+EMOTION_AUTOMATON = KeywordAutomaton({**EMOTION_KEYWORDS, "neutral": NEUTRAL_PHRASES})
+# 关键词编号 -> (情绪, 是否为程度副词)
+KEYWORD_INFO = [(emotion, word in DEGREE_WORDS) for word, emotion in EMOTION_AUTOMATON.keywords]
+
+# 批量检测时拼接文本用的分隔符，不出现在任何关键词中，自动机扫到它会回到初始状态
+BATCH_SEPARATOR = "\n"
+
+def tally(text: str, matches: List[Tuple[int, int, int]], lower: int = 0) -> Dict[str, int]:
+    """按关键词命中计算各情绪得分
+
+    Args:
+        text: 已转为小写的文本
+        matches: 自动机在 text 上的命中
+        lower: 否定词检查不越过的位置（批量检测时为该条文本在拼接串中的起点）
+
+    Returns:
+        情绪 -> 命中次数，只含命中过的情绪
+    """
+    scores = {}
+    if not matches:
+        return scores
+    selected = EMOTION_AUTOMATON.longest(matches)
+    for i, (start, end, index) in enumerate(selected):
+        emotion, degree = KEYWORD_INFO[index]
+        if emotion == "neutral":
+            continue
+        if degree and i + 1 < len(selected) and selected[i + 1][0] == end:
+            continue
+        if (start > lower and text[start - 1] in NEGATION_TAIL
+                and NEGATION.search(text, max(lower, start - NEGATION_WINDOW), start)):
+            emotion = NEGATED_EMOTION.get(emotion)
+            if emotion is None:
+                continue
+        scores[emotion] = scores.get(emotion, 0) + 1
+    return scores
+
+def score_emotions(text: str) -> Dict[str, int]:
+    """计算各情绪得分
+
     Args:
         text: 输入文本
-        
+
     Returns:
-        情绪类型: "happy", "sad", "angry", "thinking", "sleep", "scared" 或默认为 "neutral"
+        情绪 -> 命中次数
     """
     text = text.lower()
-    
-    emotion_scores = {}
-    for emotion, keywords in EMOTION_KEYWORDS.items():
-        score = 0
-        for keyword in keywords:
-            if keyword in text:
-                score += 1
-        emotion_scores[emotion] = score
-    
+    scores = tally(text, EMOTION_AUTOMATON.find_all(text))
+    return {emotion: scores.get(emotion, 0) for emotion in EMOTION_KEYWORDS}
+
+def top_emotion(scores: Dict[str, int]) -> str:
+    """得分最高的情绪，没有命中时返回 "neutral"，同分时取 EMOTION_KEYWORDS 中先列出的情绪"""
     max_score = 0
     detected_emotion = "neutral"
-    for emotion, score in emotion_scores.items():
+    for emotion in EMOTION_KEYWORDS:
+        score = scores.get(emotion, 0)
         if score > max_score:
             max_score = score
             detected_emotion = emotion
-    
     return detected_emotion
 
+def detect_emotion(text: str) -> str:
+    """从文本中检测情绪
+    
+    Args:
+        text: 输入文本
+        
+    Returns:
+        情绪类型: "happy", "sad", "angry", "thinking", "sleep", "scared" 或默认为 "neutral"
+    """
+    with tracing.span("emotion"):
+        text = text.lower()
+        return top_emotion(tally(text, EMOTION_AUTOMATON.find_all(text)))
+
+def detect_emotions(texts: List[str]) -> List[str]:
+    """批量检测情绪
+
+    把全部文本用分隔符拼接后只扫描一遍自动机，再按各条文本的起止位置分配命中，
+    省去逐条调用的函数、追踪和小写转换开销。
+    
+    Args:
+        texts: 文本列表
+        
+    Returns:
+        与输入一一对应的情绪类型列表
+    """
+    if not texts:
+        return []
+    with tracing.span("emotion", batch=len(texts)):
+        # 先逐条转小写再拼接，个别字符转小写后长度会变，不能拼接后再转
+        texts = [text.lower() for text in texts]
+        joined = BATCH_SEPARATOR.join(texts)
+        # 各条文本在拼接串中的起点和终点
+        starts, ends = [], []
+        position = 0
+        for text in texts:
+            starts.append(position)
+            position += len(text)
+            ends.append(position)
+            position += len(BATCH_SEPARATOR)
+
+        buckets = [[] for _ in texts]
+        segment = 0
+        # find_all 按结束位置递增产出，命中不会跨过分隔符
+        for match in EMOTION_AUTOMATON.find_all(joined):
+            while match[1] > ends[segment]:
+                segment += 1
+            buckets[segment].append(match)
+        return [top_emotion(tally(joined, bucket, start)) for bucket, start in zip(buckets, starts)]
+
+# 情绪 -> 动画帧文件名
+ANIMATIONS = {
+    "happy": ["smile_1.bmp", "smile_2.bmp", "smile_3.bmp"],
+    "sad": ["sad_1.bmp", "sad_2.bmp", "sad_3.bmp"],
+    "angry": ["angry_1.bmp", "angry_2.bmp", "angry_3.bmp"],
+    "thinking": ["think_1.bmp", "think_2.bmp", "think_3.bmp"],
+    "sleep": ["sleep_1.bmp", "sleep_2.bmp", "sleep_3.bmp"],
+    "scared": ["scared_1.bmp", "scared_2.bmp", "scared_3.bmp"],
+    "neutral": ["neutral_1.bmp", "neutral_2.bmp", "neutral_3.bmp"]
+}
+
 def get_emotion_animation(emotion: str) -> List[str]:
     """获取对应情绪的动画文件列表
     
@@ -51,14 +249,8 @@ def get_emotion_animation(emotion: str) -> List[str]:
     Returns:
         动画文件名列表
     """
-    animations = {
-        "happy": ["smile_1.bmp", "smile_2.bmp", "smile_3.bmp"],
-        "sad": ["sad_1.bmp", "sad_2.bmp", "sad_3.bmp"],
-        "angry": ["angry_1.bmp", "angry_2.bmp", "angry_3.bmp"],
-        "thinking": ["think_1.bmp", "think_2.bmp", "think_3.bmp"],
-        "sleep": ["sleep_1.bmp", "sleep_2.bmp", "sleep_3.bmp"],
-        "scared": ["scared_1.bmp", "scared_2.bmp", "scared_3.bmp"],
-        "neutral": ["neutral_1.bmp", "neutral_2.bmp", "neutral_3.bmp"]
-    }
-    
-    return animations.get(emotion, animations["neutral"])
+    return ANIMATIONS.get(emotion, ANIMATIONS["neutral"])
+
+def all_animation_frames() -> List[str]:
+    """所有情绪动画用到的帧文件名（去重，保持顺序），用于启动时预加载"""
+    return list(dict.fromkeys(name for files in ANIMATIONS.values() for name in files))
@@ -0,0 +1,183 @@
+"""
+后台整理任务模块
+每轮对话结束后的记忆落盘、偏好提取、长期记忆索引和对话摘要等整理工作，
+放入有界队列由一个常驻工作线程依次执行，不占用回复和语音合成的时间。
+"""
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import enrichment_queue_size
+
+class EnrichmentWorker:
+    """单线程后台任务队列
+
+    提交时可指定 key：同一 key 的任务在队列中尚未执行时，新的提交直接合并，
+    适合“把当前状态写盘”“检查是否需要摘要”这类只关心最新状态的任务。
+    在事件循环里提交时用 block=False：队列满了由一个转交线程按顺序等空位，提交方不阻塞，任务也不丢。
+    """
+
+    def __init__(self, maxsize=enrichment_queue_size, name="enrichment"):
+        """
+        Args:
+            maxsize: 队列容量，队列满时提交方会等待
+            name: 工作线程名称
+        """
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.lock = threading.Lock()
+        self.pending_keys = set()
+        self.closed = False
+        self.handoff = None  # 转交线程（单线程，保持提交顺序），第一次需要时创建
+        self.handoff_pending = 0
+        self.name = name
+
+        self.submitted = 0
+        self.processed = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.blocked = 0
+        self.handed_off = 0
+        self.max_depth = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, func, *args, key=None, block=True):
+        """提交一个任务
+
+        Args:
+            func: 要执行的函数
+            *args: 函数参数
+            key: 合并键，同 key 的任务排队期间只保留一个
+            block: 队列满时是否在调用线程等待空位；为 False 时交给转交线程等待，立即返回
+
+        Returns:
+            是否新加入了队列（被合并或已关闭时为 False）
+        """
+        with self.lock:
+            if self.closed:
+                return False
+            if key is not None:
+                if key in self.pending_keys:
+                    self.coalesced += 1
+                    return False
+                self.pending_keys.add(key)
+            self.submitted += 1
+            # 已有任务在转交线程里等待时也走转交线程，不插到它们前面
+            hand_off = not block and (self.handoff_pending or self.queue.full())
+            if hand_off:
+                self.handoff_pending += 1
+                self.handed_off += 1
+
+        job = (func, args, key, time.perf_counter())
+        if hand_off:
+            if self.handoff is None:
+                self.handoff = ThreadPoolExecutor(1, thread_name_prefix=f"{self.name}-handoff")
+            self.handoff.submit(self._put_handed_off, job)
+            return True
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            self.blocked += 1
+            print(f"后台任务队列已满（{self.queue.maxsize}），等待空位")
+            self.queue.put(job)
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+        return True
+
+    def _put_handed_off(self, job):
+        """转交线程：等到队列有空位再放入"""
+        try:
+            self.queue.put(job)
+            self.max_depth = max(self.max_depth, self.queue.qsize())
+        finally:
+            with self.lock:
+                self.handoff_pending -= 1
+
+    def _run(self):
+        """工作线程：依次取出任务执行"""
+        while True:
+            job = self.queue.get()
+            if job is None:
+                self.queue.task_done()
+                break
+
+            func, args, key, enqueued_at = job
+            if key is not None:
+                # 开始执行后再有同 key 提交，需要重新排队以看到更新后的状态
+                with self.lock:
+                    self.pending_keys.discard(key)
+            self.last_lag = time.perf_counter() - enqueued_at
+            self.max_lag = max(self.max_lag, self.last_lag)
+            try:
+                func(*args)
+            except Exception as e:
+                self.errors += 1
+                print(f"后台任务 {getattr(func, '__name__', func)} 出错: {str(e)}")
+            finally:
+                self.processed += 1
+                self.queue.task_done()
+
+    def flush(self, timeout=None):
+        """等待已提交的任务全部执行完
+
+        Args:
+            timeout: 最长等待秒数，None 表示一直等
+
+        Returns:
+            是否在超时前执行完
+        """
+        if timeout is None:
+            while self.handoff_pending:
+                time.sleep(0.01)
+            self.queue.join()
+            return True
+
+        deadline = time.monotonic() + timeout
+        while self.handoff_pending or self.queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self, timeout=None):
+        """执行完剩余任务后停止工作线程"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        # 转交线程里的任务先入队，退出标记排在它们之后
+        while self.handoff_pending:
+            time.sleep(0.01)
+        if self.handoff is not None:
+            self.handoff.shutdown()
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+    @property
+    def depth(self):
+        """当前排队的任务数"""
+        return self.queue.qsize()
+
+    def stats(self):
+        """队列统计"""
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "submitted": self.submitted,
+            "processed": self.processed,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "blocked": self.blocked,
+            "handed_off": self.handed_off,
+            "last_lag_ms": self.last_lag * 1000,
+            "max_lag_ms": self.max_lag * 1000,
+        }
+
+    def report(self):
+        """格式化统计信息"""
+        s = self.stats()
+        return (f"后台任务: 排队 {s['depth']} (峰值 {s['max_depth']}), 完成 {s['processed']}, "
+                f"合并 {s['coalesced']}, 转交 {s['handed_off']}, 出错 {s['errors']}, "
+                f"排队延迟 {s['last_lag_ms']:.0f}ms (峰值 {s['max_lag_ms']:.0f}ms)")
@@ -0,0 +1,349 @@
+"""
+表情帧缓存与增量刷新模块
+启动时把所有表情帧一次性解码为 ILI9341 可直接写入的 RGB565（大端）数据，
+也可以预先编译成打包文件，启动时用内存映射直接读取，不再逐帧解码 BMP。
+切换帧时只计算并发送变化的矩形区域，SPI 传输量随画面变化大小而不是整屏。
+
+预编译打包文件：python frame_cache.py --compile
+"""
+import os
+import json
+import time
+import struct
+import argparse
+import numpy as np
+from config import lcd_width, lcd_height, lcd_asset_dir, lcd_frame_pack
+from config import lcd_spi_bus, lcd_spi_device, lcd_spi_hz, lcd_dc_pin, lcd_reset_pin
+
+PACK_MAGIC = b"LUNAFRM1"
+PACK_ALIGN = 64
+
+def read_bmp(path):
+    """读取 BMP 图片
+
+    优先使用 Pillow；未安装时用内置解析器读取未压缩的 24/32 位 BMP。
+
+    Returns:
+        (高, 宽, 3) 的 uint8 RGB 数组
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        Image = None
+    if Image is not None:
+        with Image.open(path) as image:
+            return np.asarray(image.convert("RGB"))
+
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:2] != b"BM":
+        raise ValueError(f"{path} 不是 BMP 文件")
+    offset = struct.unpack_from("<I", data, 10)[0]
+    width, height, _, bpp, compression = struct.unpack_from("<iiHHI", data, 18)
+    if bpp not in (24, 32) or compression not in (0, 3):
+        raise ValueError(f"{path}: 只支持未压缩的 24/32 位 BMP，请安装 Pillow")
+    channels = bpp // 8
+    stride = (abs(width) * channels + 3) & ~3
+    rows = np.frombuffer(data, dtype=np.uint8, count=stride * abs(height), offset=offset)
+    pixels = rows.reshape(abs(height), stride)[:, :abs(width) * channels].reshape(abs(height), abs(width), channels)
+    if height > 0:  # 正高度的 BMP 自下而上存储
+        pixels = pixels[::-1]
+    return np.ascontiguousarray(pixels[:, :, 2::-1])  # BGR(A) -> RGB
+
+def to_rgb565(rgb):
+    """RGB888 转为大端 RGB565（ILI9341 的像素格式）
+
+    Args:
+        rgb: (高, 宽, 3) 的 uint8 数组
+
+    Returns:
+        (高, 宽) 的 '>u2' 数组
+    """
+    rgb = rgb.astype(np.uint16)
+    packed = ((rgb[:, :, 0] >> 3) << 11) | ((rgb[:, :, 1] >> 2) << 5) | (rgb[:, :, 2] >> 3)
+    return packed.astype(">u2")
+
+def blend(a, b, t):
+    """两帧 RGB565 按比例混合（淡入淡出过渡用）
+
+    Args:
+        a: 起始帧
+        b: 目标帧
+        t: 目标帧所占比例，0~1
+
+    Returns:
+        混合后的 (高, 宽) '>u2' 数组
+    """
+    w = int(round(t * 256))
+    a = a.astype(np.uint32)
+    b = b.astype(np.uint32)
+    out = np.zeros(a.shape, dtype=np.uint32)
+    for shift, mask in ((11, 0x1F), (5, 0x3F), (0, 0x1F)):
+        ca = (a >> shift) & mask
+        cb = (b >> shift) & mask
+        out |= ((ca * (256 - w) + cb * w) >> 8) << shift
+    return out.astype(">u2")
+
+def fit_frame(rgb, width, height):
+    """把图片居中放到 width x height 的黑色画布上（超出部分裁掉）"""
+    canvas = np.zeros((height, width, 3), dtype=np.uint8)
+    h, w = min(rgb.shape[0], height), min(rgb.shape[1], width)
+    y, x = (height - h) // 2, (width - w) // 2
+    sy, sx = (rgb.shape[0] - h) // 2, (rgb.shape[1] - w) // 2
+    canvas[y:y + h, x:x + w] = rgb[sy:sy + h, sx:sx + w, :3]
+    return canvas
+
+class FrameCache:
+    """已解码的表情帧
+
+    frame(name) 返回 (高, 宽) 的大端 RGB565 数组；从打包文件加载时是内存映射上的只读视图。
+    """
+
+    def __init__(self, width=lcd_width, height=lcd_height):
+        self.width = width
+        self.height = height
+        self.frames = {}
+        self.missing = set()
+        self.blank = np.zeros((height, width), dtype=">u2")
+
+    def load(self, names, asset_dir=lcd_asset_dir):
+        """从素材目录解码帧
+
+        Args:
+            names: 帧文件名列表
+            asset_dir: 素材目录
+        """
+        failed = []
+        for name in names:
+            if name in self.frames:
+                continue
+            path = os.path.join(asset_dir, name)
+            try:
+                self.frames[name] = to_rgb565(fit_frame(read_bmp(path), self.width, self.height))
+            except (OSError, ValueError) as e:
+                failed.append(name)
+                last_error = e
+        if failed:
+            self.missing.update(failed)
+            print(f"{len(failed)} 个表情帧加载失败，将显示黑屏（{last_error}）")
+
+    @classmethod
+    def from_pack(cls, path=lcd_frame_pack):
+        """用内存映射打开预编译的打包文件，不复制帧数据"""
+        with open(path, "rb") as f:
+            if f.read(len(PACK_MAGIC)) != PACK_MAGIC:
+                raise ValueError(f"{path} 不是表情帧打包文件")
+            header_len = struct.unpack("<I", f.read(4))[0]
+            header = json.loads(f.read(header_len).decode("utf-8"))
+
+        cache = cls(header["width"], header["height"])
+        data = np.memmap(path, dtype=">u2", mode="r")
+        frame_pixels = cache.width * cache.height
+        for name, offset in header["frames"].items():
+            start = offset // 2
+            cache.frames[name] = data[start:start + frame_pixels].reshape(cache.height, cache.width)
+        return cache
+
+    def save_pack(self, path=lcd_frame_pack):
+        """把已加载的帧写成打包文件：魔数 + 头部长度 + JSON 头部，帧数据按 64 字节对齐"""
+        names = sorted(self.frames)
+        frame_bytes = self.width * self.height * 2
+        header = {"width": self.width, "height": self.height, "frames": {}}
+        # 头部里的偏移量会影响头部长度，先按足够长的占位算出数据起点
+        prefix = len(PACK_MAGIC) + 4 + len(json.dumps(
+            dict(header, frames={name: 10 ** 12 for name in names})).encode("utf-8"))
+        data_start = (prefix + PACK_ALIGN - 1) // PACK_ALIGN * PACK_ALIGN
+        for i, name in enumerate(names):
+            header["frames"][name] = data_start + i * frame_bytes
+        header_bytes = json.dumps(header).encode("utf-8")
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(PACK_MAGIC)
+            f.write(struct.pack("<I", len(header_bytes)))
+            f.write(header_bytes)
+            f.write(b"\0" * (data_start - f.tell()))
+            for name in names:
+                f.write(np.ascontiguousarray(self.frames[name], dtype=">u2").tobytes())
+        os.replace(tmp_path, path)
+
+    def frame(self, name):
+        """取一帧，未加载或加载失败时返回黑屏"""
+        return self.frames.get(name, self.blank)
+
+def dirty_rects(previous, current, merge_gap=8):
+    """计算两帧之间变化的矩形区域
+
+    先找出有变化的行并按行分段（间隔不超过 merge_gap 行的段合并，减少设置窗口的命令开销），
+    每段取变化列的最左到最右作为矩形。
+
+    Args:
+        previous: 上一帧，None 表示整屏刷新
+        current: 当前帧
+        merge_gap: 相距不超过该行数的变化段合并为一个矩形
+
+    Returns:
+        [(x0, y0, x1, y1), ...]，右、下边界不含
+    """
+    height, width = current.shape
+    if previous is None:
+        return [(0, 0, width, height)]
+
+    changed = previous != current
+    rows = np.flatnonzero(changed.any(axis=1))
+    if len(rows) == 0:
+        return []
+
+    breaks = np.flatnonzero(np.diff(rows) > merge_gap + 1)
+    starts = np.concatenate([[rows[0]], rows[breaks + 1]])
+    ends = np.concatenate([rows[breaks], [rows[-1]]]) + 1
+    rects = []
+    for y0, y1 in zip(starts, ends):
+        cols = np.flatnonzero(changed[y0:y1].any(axis=0))
+        rects.append((int(cols[0]), int(y0), int(cols[-1]) + 1, int(y1)))
+    return rects
+
+class VirtualFramebuffer:
+    """虚拟显示后端：在内存中模拟屏幕，统计每帧推送的字节数"""
+
+    def __init__(self, width=lcd_width, height=lcd_height):
+        self.width = width
+        self.height = height
+        self.screen = np.zeros((height, width), dtype=">u2")
+        self.window = (0, 0, width, height)
+        self.bytes_pushed = 0
+        self.windows_set = 0
+        self.frame_bytes = []
+
+    def set_window(self, x0, y0, x1, y1):
+        self.window = (x0, y0, x1, y1)
+        self.windows_set += 1
+
+    def write(self, data):
+        x0, y0, x1, y1 = self.window
+        pixels = np.frombuffer(data, dtype=">u2")
+        self.screen[y0:y1, x0:x1] = pixels.reshape(y1 - y0, x1 - x0)
+        self.bytes_pushed += len(data)
+
+    def end_frame(self, pushed):
+        self.frame_bytes.append(pushed)
+
+    def close(self):
+        pass
+
+class ILI9341:
+    """ILI9341 SPI 屏幕后端（spidev + RPi.GPIO）"""
+
+    CASET = 0x2A
+    PASET = 0x2B
+    RAMWR = 0x2C
+    MAX_TRANSFER = 4096  # spidev 默认单次传输上限
+
+    def __init__(self, width=lcd_width, height=lcd_height, bus=lcd_spi_bus, device=lcd_spi_device,
+                 dc_pin=lcd_dc_pin, reset_pin=lcd_reset_pin, speed_hz=lcd_spi_hz):
+        import spidev
+        import RPi.GPIO as GPIO
+
+        self.width = width
+        self.height = height
+        self.GPIO = GPIO
+        self.dc_pin = dc_pin
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+        GPIO.setup(dc_pin, GPIO.OUT)
+        if reset_pin is not None:
+            GPIO.setup(reset_pin, GPIO.OUT)
+            GPIO.output(reset_pin, 0)
+            time.sleep(0.01)
+            GPIO.output(reset_pin, 1)
+            time.sleep(0.12)
+        self.spi = spidev.SpiDev()
+        self.spi.open(bus, device)
+        self.spi.max_speed_hz = speed_hz
+        self.spi.mode = 0
+        self._init_panel()
+
+    def _command(self, cmd, data=b""):
+        self.GPIO.output(self.dc_pin, 0)
+        self.spi.writebytes([cmd])
+        if data:
+            self.GPIO.output(self.dc_pin, 1)
+            self.spi.writebytes(list(data))
+
+    def _init_panel(self):
+        self._command(0x01)  # 软件复位
+        time.sleep(0.12)
+        self._command(0x11)  # 退出睡眠
+        time.sleep(0.12)
+        self._command(0x3A, b"\x55")  # 16 位像素
+        self._command(0x36, b"\x28")  # 横屏，BGR 顺序
+        self._command(0x29)  # 打开显示
+
+    def set_window(self, x0, y0, x1, y1):
+        self._command(self.CASET, struct.pack(">HH", x0, x1 - 1))
+        self._command(self.PASET, struct.pack(">HH", y0, y1 - 1))
+        self._command(self.RAMWR)
+
+    def write(self, data):
+        self.GPIO.output(self.dc_pin, 1)
+        if hasattr(self.spi, "writebytes2"):
+            self.spi.writebytes2(data)
+            return
+        for i in range(0, len(data), self.MAX_TRANSFER):
+            self.spi.writebytes(list(data[i:i + self.MAX_TRANSFER]))
+
+    def end_frame(self, pushed):
+        pass
+
+    def close(self):
+        self.spi.close()
+
+class FramePresenter:
+    """把帧增量写到显示后端"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.previous = None
+        self.frames = 0
+        self.bytes_pushed = 0
+
+    def show(self, frame, full=False):
+        """显示一帧，只发送与上一帧不同的区域
+
+        Args:
+            frame: (高, 宽) 大端 RGB565 数组
+            full: 是否强制整屏刷新
+
+        Returns:
+            本帧推送的字节数
+        """
+        pushed = 0
+        for x0, y0, x1, y1 in dirty_rects(None if full else self.previous, frame):
+            self.backend.set_window(x0, y0, x1, y1)
+            region = np.ascontiguousarray(frame[y0:y1, x0:x1])
+            self.backend.write(region.tobytes())
+            pushed += region.nbytes
+        self.backend.end_frame(pushed)
+        self.previous = frame
+        self.frames += 1
+        self.bytes_pushed += pushed
+        return pushed
+
+def main():
+    """预编译入口"""
+    from emotion_detect import all_animation_frames
+
+    parser = argparse.ArgumentParser(description="表情帧打包工具")
+    parser.add_argument("--compile", action="store_true", help="把素材目录中的表情帧编译为打包文件")
+    parser.add_argument("--assets", default=lcd_asset_dir, help="素材目录")
+    parser.add_argument("--output", default=lcd_frame_pack, help="打包文件路径")
+    args = parser.parse_args()
+
+    if args.compile:
+        cache = FrameCache()
+        cache.load(all_animation_frames(), args.assets)
+        cache.save_pack(args.output)
+        print(f"已打包 {len(cache.frames)} 帧到 {args.output}，缺失 {len(cache.missing)} 帧")
+
+if __name__ == "__main__":
+    main()
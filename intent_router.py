@@ -0,0 +1,146 @@
+"""
+本地意图路由模块
+问时间、让小Luna再说一遍、调音量这类简单指令在本地直接回答，不经过 GPT。
+所有意图的匹配规则编译成一个正则，对规范化后的整句做一次匹配；没有命中的交给 GPT。
+固定回复会在启动时预合成，命中后直接从语音缓存播放。
+"""
+import re
+import time
+from datetime import datetime
+from config import wake_words
+import tracing
+
+# 去掉空白和标点后再匹配，识别结果里的标点、空格、大小写不影响命中
+PUNCTUATION = re.compile(r"[\s,.!?;:~'\"，。！？；：、…～“”‘’（）()【】\[\]-]+")
+
+# 句首可省略的称呼和客气话、句尾的语气词
+PREFIX = "(?:" + "|".join(sorted({re.escape(PUNCTUATION.sub("", w.lower())) for w in wake_words}
+                                  | {"luna", "露娜", "小露娜"}, key=len, reverse=True)) + "|请|帮我|麻烦你?|你)*"
+SUFFIX = "(?:[呀吧呢啊吗哦嘛啦哈]|好不好|可以吗|行吗|please)*"
+
+VOLUME_UP_TEXT = "好的，大声一点啦~"
+VOLUME_DOWN_TEXT = "好的，小声一点啦~"
+VOLUME_MAX_TEXT = "已经是最大声啦~"
+VOLUME_MIN_TEXT = "已经是最小声啦~"
+NOTHING_TO_REPEAT_TEXT = "我刚才还没说话呢~"
+# 启动时预合成的固定回复
+CANNED_REPLIES = [VOLUME_UP_TEXT, VOLUME_DOWN_TEXT, VOLUME_MAX_TEXT, VOLUME_MIN_TEXT, NOTHING_TO_REPEAT_TEXT]
+
+WEEKDAYS = "一二三四五六日"
+
+def normalize(text):
+    """规范化识别结果：小写，去掉空白和标点"""
+    return PUNCTUATION.sub("", text.lower())
+
+def tell_time(router, now=None):
+    now = now or datetime.now()
+    hour = now.hour
+    period = "凌晨" if hour < 6 else "上午" if hour < 12 else "中午" if hour < 13 else "下午" if hour < 18 else "晚上"
+    hour12 = hour if hour <= 12 else hour - 12
+    minute = f"{now.minute}分" if now.minute else "整"
+    return f"现在是{period}{hour12}点{minute}~"
+
+def tell_date(router, now=None):
+    now = now or datetime.now()
+    return f"今天是{now.month}月{now.day}日，星期{WEEKDAYS[now.weekday()]}~"
+
+def repeat_last(router):
+    return router.last_reply or NOTHING_TO_REPEAT_TEXT
+
+def volume_up(router):
+    from voice_output import change_volume
+    return VOLUME_UP_TEXT if change_volume(1) else VOLUME_MAX_TEXT
+
+def volume_down(router):
+    from voice_output import change_volume
+    return VOLUME_DOWN_TEXT if change_volume(-1) else VOLUME_MIN_TEXT
+
+# (意图名称, 匹配规则, 处理函数)；规则匹配规范化后的文本，处理函数返回回复文本
+INTENTS = [
+    ("time", r"(?:现在)?(?:是)?(?:几点了?|几点钟了?|什么时间了?)|(?:what)?timeisit(?:now)?", tell_time),
+    ("date", r"(?:今天|今儿)(?:是)?(?:几号|几月几号|几月几日|星期几|礼拜几|周几)|whatdayisit(?:today)?", tell_date),
+    ("repeat", r"(?:再说一[遍次]|重复一[遍下次]|你?刚才说(?:了)?什么|没听清(?:楚)?|再讲一[遍次])|(?:say(?:that|it)?)?again|repeat(?:that|it)?",
+     repeat_last),
+    ("volume_up", r"(?:大声|响)一?点|(?:声音|音量)(?:调|开)?大一?(?:点|些)?|louder|volumeup", volume_up),
+    ("volume_down", r"小声一?点|(?:声音|音量)(?:调|开)?小一?(?:点|些)?|quieter|volumedown", volume_down),
+]
+
+def register_intent(name, pattern, handler):
+    """注册本地意图，需要在创建 IntentRouter 之前调用
+
+    Args:
+        name: 意图名称（需是合法的 Python 标识符，用作正则分组名）
+        pattern: 匹配规范化文本的正则（不含首尾称呼和语气词）
+        handler: 处理函数 handler(router) -> 回复文本
+    """
+    INTENTS.append((name, pattern, handler))
+
+class IntentRouter:
+    """意图路由：命中本地意图时返回回复文本，否则返回 None 交给 GPT"""
+
+    def __init__(self, intents=None):
+        intents = INTENTS if intents is None else intents
+        self.handlers = {name: handler for name, _, handler in intents}
+        body = "|".join(f"(?P<{name}>{pattern})" for name, pattern, _ in intents)
+        self.matcher = re.compile(f"{PREFIX}(?:{body}){SUFFIX}")
+        self.last_reply = None
+        self.routed = 0
+        self.hits = {name: 0 for name in self.handlers}
+        self.handler_ms = 0.0
+
+    def match(self, text):
+        """匹配意图
+
+        Returns:
+            意图名称，没有命中返回 None
+        """
+        m = self.matcher.fullmatch(normalize(text))
+        return m.lastgroup if m else None
+
+    def handle(self, text):
+        """尝试在本地回答
+
+        Args:
+            text: 识别出的用户输入
+
+        Returns:
+            回复文本，没有命中本地意图时返回 None
+        """
+        self.routed += 1
+        start = time.perf_counter()
+        with tracing.span("intent") as span:
+            intent = self.match(text)
+            span.set(intent=intent)
+            if intent is None:
+                return None
+            reply = self.handlers[intent](self)
+
+        self.hits[intent] += 1
+        self.handler_ms += (time.perf_counter() - start) * 1000
+        print(f"本地意图: {intent}")
+        if intent != "repeat":
+            self.last_reply = reply
+        return reply
+
+    def remember(self, reply):
+        """记录 GPT 的回复，供「再说一遍」使用"""
+        if reply:
+            self.last_reply = reply
+
+    def stats(self):
+        """路由统计"""
+        hits = sum(self.hits.values())
+        return {
+            "routed": self.routed,
+            "hits": hits,
+            "hit_rate": hits / self.routed if self.routed else 0.0,
+            "avg_handler_ms": self.handler_ms / hits if hits else 0.0,
+            "by_intent": dict(self.hits),
+        }
+
+    def report(self):
+        """格式化统计信息"""
+        s = self.stats()
+        detail = ", ".join(f"{name} {count}" for name, count in s["by_intent"].items() if count)
+        return (f"本地意图: {s['hits']}/{s['routed']} 轮命中 ({s['hit_rate']:.0%})"
+                f"{'，' + detail if detail else ''}，平均处理 {s['avg_handler_ms']:.2f}ms")
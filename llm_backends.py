@@ -0,0 +1,153 @@
+"""
+大模型后端路由模块
+云端 GPT 各型号和本地 OpenAI 兼容服务（llama.cpp、Ollama、vLLM 等运行的 Qwen 之类）统一为后端，
+每个后端滚动统计最近的首字延迟 p50/p95 和出错率，每轮对话优先发给最快的健康后端；
+连续出错的后端暂时熔断，请求自动切换到下一个后端，冷却后再试。
+
+本地压测可用 benchmarks/llm_stub_server.py 模拟带延迟的 OpenAI 兼容服务。
+"""
+import time
+import random
+import threading
+from collections import deque
+from config import openai_api_key, llm_backends, llm_latency_window, llm_min_samples, llm_explore_rate
+from config import llm_trip_after, llm_cooldown_seconds
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+class Backend:
+    """一个 OpenAI 兼容的后端：云端模型或本地服务"""
+
+    def __init__(self, name, model, base_url=None, api_key=None, expected_ms=1500):
+        """
+        Args:
+            name: 后端名称
+            model: 请求中使用的模型名
+            base_url: API 地址，None 为 OpenAI 官方
+            api_key: API 密钥，None 时使用 OPENAI_API_KEY
+            expected_ms: 样本不足时假定的延迟（毫秒），决定初始顺序
+        """
+        self.name = name
+        self.model = model
+        self.base_url = base_url
+        self.api_key = api_key or openai_api_key or "none"
+        self.expected_ms = expected_ms
+        self.client = None
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=llm_latency_window)  # 最近成功请求的首字延迟（毫秒）
+        self.outcomes = deque(maxlen=llm_latency_window)  # 最近请求是否成功
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def get_client(self):
+        """异步客户端，首次使用时创建；重试由调用方控制"""
+        if self.client is None:
+            from openai import AsyncOpenAI
+            self.client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+        return self.client
+
+    def record_success(self, latency_ms):
+        with self.lock:
+            self.requests += 1
+            self.latencies.append(latency_ms)
+            self.outcomes.append(True)
+            self.consecutive_failures = 0
+            self.open_until = 0.0
+
+    def record_failure(self):
+        with self.lock:
+            self.requests += 1
+            self.failures += 1
+            self.outcomes.append(False)
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= llm_trip_after:
+                now = time.monotonic()
+                if now >= self.open_until:
+                    print(f"大模型后端 {self.name} 连续出错 {self.consecutive_failures} 次，暂停使用 {llm_cooldown_seconds} 秒")
+                self.open_until = now + llm_cooldown_seconds
+
+    @property
+    def healthy(self):
+        """是否可用（未处于熔断冷却期）"""
+        return time.monotonic() >= self.open_until
+
+    @property
+    def error_rate(self):
+        with self.lock:
+            return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def latency(self, p):
+        """最近成功请求首字延迟的百分位（毫秒），没有样本时为 None"""
+        with self.lock:
+            return percentile(self.latencies, p) if self.latencies else None
+
+    def score(self):
+        """排序依据：p95 延迟按出错率加权；样本不足时由预设延迟逐步过渡到实测均值"""
+        with self.lock:
+            samples = list(self.latencies)
+        n = len(samples)
+        if n >= llm_min_samples:
+            base = percentile(samples, 0.95)
+        else:
+            base = (self.expected_ms * (llm_min_samples - n) + sum(samples)) / llm_min_samples
+        return base * (1 + 2 * self.error_rate)
+
+    def stats(self):
+        """后端统计"""
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "error_rate": self.error_rate,
+            "p50_ms": self.latency(0.5),
+            "p95_ms": self.latency(0.95),
+            "healthy": self.healthy,
+        }
+
+class BackendRouter:
+    """按延迟和健康状况给后端排序"""
+
+    def __init__(self, backends=None):
+        """
+        Args:
+            backends: Backend 列表，默认按 config.llm_backends 创建
+        """
+        if backends is None:
+            backends = [Backend(**spec) for spec in llm_backends]
+        if not backends:
+            raise ValueError("没有配置大模型后端")
+        self.backends = backends
+
+    def candidates(self):
+        """本轮依次尝试的后端
+
+        健康的后端按得分从快到慢排在前面，熔断中的排在最后兜底；
+        以 llm_explore_rate 的概率把样本最少的另一个健康后端提到最前，让它的延迟统计保持更新。
+
+        Returns:
+            Backend 列表
+        """
+        healthy = sorted((b for b in self.backends if b.healthy), key=lambda b: b.score())
+        tripped = sorted((b for b in self.backends if not b.healthy), key=lambda b: b.open_until)
+        if len(healthy) > 1 and random.random() < llm_explore_rate:
+            explore = min(healthy[1:], key=lambda b: len(b.latencies))
+            healthy.remove(explore)
+            healthy.insert(0, explore)
+        return healthy + tripped
+
+    def stats(self):
+        return {b.name: b.stats() for b in self.backends}
+
+    def report(self):
+        """格式化各后端统计"""
+        lines = ["大模型后端:"]
+        for name, s in self.stats().items():
+            p50 = "-" if s["p50_ms"] is None else f"{s['p50_ms']:.0f}ms"
+            p95 = "-" if s["p95_ms"] is None else f"{s['p95_ms']:.0f}ms"
+            status = "" if s["healthy"] else "  (熔断中)"
+            lines.append(f"  {name:16s} 请求 {s['requests']}, 出错率 {s['error_rate']:.0%}, "
+                         f"首字 p50 {p50}, p95 {p95}{status}")
+        return "\n".join(lines)
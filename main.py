@@ -2,31 +2,40 @@
 Luna Bot 主程序
 实现唤醒/休眠逻辑、语音交互和情绪表情反馈
 """
-import os
-import time
+import asyncio
 import argparse
 import platform
-from config import sleep_keywords, silence_timeout, TEST_MODE
-from whisper_input import listen_for_wake_word, transcribe_audio, is_wake_word
-from voice_output import speak_text, say_awake, say_sleep
-from chat_gpt import ChatGPT
-from emotion_detect import detect_emotion
-from screen_display import LCDDisplay
+from config import bargein_enabled
+from startup import StartupOrchestrator
+from pipeline import VoicePipeline
+import tracing
 
-def is_sleep_keyword(text):
-    """检查是否包含休眠关键词
-    
-    Args:
-        text: 输入文本
-        
-    Returns:
-        是否包含休眠关键词
-    """
-    text = text.lower()
-    for keyword in sleep_keywords:
-        if keyword.lower() in text:
-            return True
-    return False
+# 以下启动任务在各自线程中导入重量级模块，互不等待
+
+def init_asr():
+    """预加载 Whisper 模型和唤醒词检测器，避免第一次唤醒时才加载"""
+    import whisper_input
+    if not whisper_input.TEST_MODE:
+        whisper_input.get_wake_cascade()
+
+def init_chat():
+    """创建 OpenAI 客户端，加载记忆和检索索引"""
+    from chat_gpt import ChatGPT
+    return ChatGPT()
+
+def init_display():
+    """初始化 LCD 屏幕"""
+    from screen_display import LCDDisplay
+    lcd = LCDDisplay()
+    lcd.initialize()
+    lcd.display_emotion("neutral")
+    return lcd
+
+def init_tts():
+    """预合成固定提示语和本地意图的固定回复"""
+    from voice_output import prewarm_tts
+    from intent_router import CANNED_REPLIES
+    prewarm_tts(extra=CANNED_REPLIES)
 
 def main():
     """主程序入口"""
@@ -41,61 +50,52 @@ def main():
         print("已启动测试模式，将模拟硬件操作")
     
     print("正在初始化小Luna...")
-    gpt = ChatGPT()
-    lcd = LCDDisplay()
-    lcd.initialize()
-    lcd.display_emotion("neutral")
+    startup = StartupOrchestrator()
+    startup.add("asr", init_asr)
+    startup.add("gpt", init_chat)
+    startup.add("lcd", init_display)
+    # 语音预热不阻塞就绪，唤醒回应未缓存时现场合成
+    startup.add("tts", init_tts, required=False)
+    startup.wait()
+    startup.shutdown()
+    gpt = startup.result("gpt")
+    lcd = startup.result("lcd")
+    
+    from intent_router import IntentRouter
+    router = IntentRouter()
+    pipeline = VoicePipeline(gpt, lcd, router)
+    
+    # 全双工：小Luna说话时继续听，主人开口就停下来
+    monitor = None
+    if bargein_enabled and not args.test and platform.system() == "Linux":
+        from barge_in import BargeInMonitor
+        from audio_capture import get_capture
+        from voice_output import get_player
+        monitor = BargeInMonitor(get_capture(), get_player(), pipeline.on_barge_in)
+        monitor.start()
+        pipeline.monitor = monitor
     
+    print(startup.report())
     print("小Luna已准备就绪！按 Ctrl+C 退出。")
     
     try:
-        while True:
-            print("\n===== 监听唤醒模式 =====")
-            if listen_for_wake_word():
-                say_awake()
-                lcd.display_emotion("happy")
-                
-                active = True
-                last_activity_time = time.time()
-                
-                while active:
-                    user_input = transcribe_audio()
-                    
-                    if not user_input:
-                        if time.time() - last_activity_time > silence_timeout:
-                            print(f"静默超过 {silence_timeout} 秒，自动休眠")
-                            say_sleep()
-                            lcd.display_emotion("sleeping")
-                            active = False
-                        continue
-                    
-                    last_activity_time = time.time()
-                    
-                    if is_sleep_keyword(user_input):
-                        print("检测到休眠关键词")
-                        say_sleep()
-                        lcd.display_emotion("sleeping")
-                        active = False
-                        continue
-                    
-                    reply = gpt.chat(user_input)
-                    
-                    user_emotion = detect_emotion(user_input)
-                    bot_emotion = detect_emotion(reply)
-                    
-                    if user_emotion != "neutral":
-                        lcd.display_emotion(user_emotion)
-                    else:
-                        lcd.display_emotion(bot_emotion)
-                    
-                    speak_text(reply)
-                    
-                    last_activity_time = time.time()
-                
+        asyncio.run(pipeline.run())
     except KeyboardInterrupt:
         print("\n用户手动退出。")
     finally:
-        lcd.stop_animation()
+        print(pipeline.report())
+        print(router.report())
+        if monitor is not None:
+            print(monitor.report())
+            monitor.close()
+        print(gpt.backends.report())
+        if lcd.presenter is not None:
+            print(lcd.report())
+        lcd.close()
+        gpt.close()
+        from asr_engine import close_engines
+        close_engines()
+        tracing.close()
         print("小Luna已关闭。")
 
 if __name__ == "__main__":
@@ -0,0 +1,145 @@
+"""
+长期记忆检索模块
+对历史对话和用户偏好建立字符 n-gram 倒排索引，用 BM25 打分，
+每轮只挑出与当前输入最相关、且不超过 token 预算的几条记忆。
+"""
+import re
+import math
+import threading
+from array import array
+import numpy as np
+from context_builder import count_tokens
+
+CJK_RUN = re.compile(r"[\u4e00-\u9fff]+")
+WORD = re.compile(r"[a-z0-9]+")
+
+def tokenize(text):
+    """把文本切成检索词：中文取单字和相邻两字，英文和数字按单词切分
+
+    Args:
+        text: 输入文本
+
+    Returns:
+        检索词列表（可重复）
+    """
+    text = text.lower()
+    terms = WORD.findall(text)
+    for run in CJK_RUN.findall(text):
+        terms.extend(run)
+        terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+class MemoryIndex:
+    """支持增量添加的 BM25 倒排索引
+
+    每个检索词的倒排表存成两个紧凑的 array（文档编号、词频），
+    查询时零拷贝转成 NumPy 数组批量打分。
+    """
+
+    def __init__(self, k1=1.5, b=0.75, max_df_ratio=0.2):
+        """
+        Args:
+            k1: BM25 词频饱和参数
+            b: BM25 文档长度归一化参数
+            max_df_ratio: 出现在超过该比例文档（且多于 100 篇）中的检索词在查询时跳过（相当于停用词）
+        """
+        self.k1 = k1
+        self.b = b
+        self.max_df_ratio = max_df_ratio
+        self.postings = {}  # 检索词 -> (文档编号 array, 词频 array)
+        self.doc_lengths = array("i")
+        self.docs = []
+        self.total_length = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, text, index_text=None):
+        """添加一条记忆
+
+        Args:
+            text: 检索命中后注入提示词的文本
+            index_text: 用于建立索引的文本，默认与 text 相同
+
+        Returns:
+            文档编号
+        """
+        terms = tokenize(index_text if index_text is not None else text)
+        counts = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        with self.lock:
+            doc_id = len(self.docs)
+            for term, tf in counts.items():
+                postings = self.postings.get(term)
+                if postings is None:
+                    postings = self.postings[term] = (array("i"), array("i"))
+                postings[0].append(doc_id)
+                postings[1].append(tf)
+
+            self.docs.append(text)
+            self.doc_lengths.append(len(terms))
+            self.total_length += len(terms)
+        return doc_id
+
+    def search(self, query, k=5):
+        """检索最相关的记忆
+
+        Args:
+            query: 查询文本
+            k: 返回条数
+
+        Returns:
+            [(分数, 文档编号), ...]，按分数从高到低
+        """
+        terms = set(tokenize(query))
+        with self.lock:
+            n = len(self.docs)
+            if n == 0:
+                return []
+
+            avg_length = self.total_length / n
+            max_df = max(100, int(n * self.max_df_ratio))
+            lengths = np.frombuffer(self.doc_lengths, dtype=np.int32)
+            scores = np.zeros(n, dtype=np.float32)
+            for term in terms:
+                postings = self.postings.get(term)
+                if postings is None or len(postings[0]) > max_df:
+                    continue
+                doc_ids = np.frombuffer(postings[0], dtype=np.int32)
+                tf = np.frombuffer(postings[1], dtype=np.int32).astype(np.float32)
+                df = len(doc_ids)
+                idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                norm = self.k1 * (1 - self.b + self.b * lengths[doc_ids] / avg_length)
+                # 同一检索词在一篇文档里只有一条倒排记录，可以直接按下标累加
+                scores[doc_ids] += idf * tf * (self.k1 + 1) / (tf + norm)
+            # 释放对 array 缓冲区的引用，否则之后 add() 无法扩容
+            lengths = doc_ids = None
+
+        k = min(k, n)
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(float(scores[doc_id]), int(doc_id)) for doc_id in top if scores[doc_id] > 0]
+
+    def select(self, query, token_budget, k=5):
+        """检索并按 token 预算截取
+
+        Args:
+            query: 查询文本
+            token_budget: 记忆部分的 token 上限
+            k: 最多条数
+
+        Returns:
+            记忆文本列表
+        """
+        selected = []
+        used = 0
+        for _, doc_id in self.search(query, k):
+            text = self.docs[doc_id]
+            cost = count_tokens(text)
+            if used + cost > token_budget:
+                continue
+            selected.append(text)
+            used += cost
+        return selected
@@ -0,0 +1,246 @@
+"""
+记忆存储模块
+以追加写日志（JSONL）保存对话、长期记忆和偏好，每轮只追加几行，
+日志达到一定条数后压缩为快照。快照通过临时文件 + 原子替换写入，断电不会损坏。
+快照和日志使用同一种记录格式，启动时逐行流式加载。
+"""
+import os
+import json
+import argparse
+import threading
+from config import memory_dir, memory_compact_every
+
+PREFERENCE_CATEGORIES = ("likes", "dislikes", "interests")
+
+class MemoryStore:
+    """追加写日志的记忆存储"""
+
+    def __init__(self, directory=memory_dir, compact_every=memory_compact_every):
+        """
+        Args:
+            directory: 存储目录
+            compact_every: 日志累计多少条记录后压缩为快照
+        """
+        self.directory = directory
+        self.compact_every = compact_every
+        self.snapshot_path = os.path.join(directory, "snapshot.jsonl")
+        self.journal_path = os.path.join(directory, "journal.jsonl")
+        self.lock = threading.RLock()
+
+        self.messages = []
+        self.conversations = []
+        # 用只有键的 dict 作有序集合，去重为 O(1)
+        self.preferences = {category: {} for category in PREFERENCE_CATEGORIES}
+        self.summary = {"text": "", "upto": 0}
+
+        self.seq = 0
+        self.journal_records = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+        self._truncate_torn_tail()
+        self.journal = open(self.journal_path, "a", encoding="utf-8")
+
+    def _apply(self, record):
+        """把一条记录应用到内存状态"""
+        kind = record.get("type")
+        if kind == "message":
+            self.messages.append(record["data"])
+        elif kind == "conversation":
+            self.conversations.append(record["data"])
+        elif kind == "preference":
+            self.preferences.setdefault(record["category"], {})[record["item"]] = None
+        elif kind == "summary":
+            self.summary = {"text": record["text"], "upto": record["upto"]}
+
+    @staticmethod
+    def _read_records(path):
+        """逐行读取记录，跳过写了一半的行"""
+        if not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+    def _load(self):
+        """加载快照，再重放快照之后的日志"""
+        snapshot_seq = 0
+        for record in self._read_records(self.snapshot_path):
+            if record.get("type") == "header":
+                snapshot_seq = record["seq"]
+            else:
+                self._apply(record)
+        self.seq = snapshot_seq
+
+        for record in self._read_records(self.journal_path):
+            # 压缩后、清空日志前断电时，日志里会残留快照已包含的记录
+            if record.get("seq", 0) <= snapshot_seq:
+                continue
+            self._apply(record)
+            self.seq = record["seq"]
+            self.journal_records += 1
+
+    def _truncate_torn_tail(self):
+        """截掉日志末尾写了一半的行，避免后续追加的记录与它粘在同一行"""
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, "rb+") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0:
+                return
+            f.seek(max(0, size - 4096))
+            tail = f.read()
+            if tail.endswith(b"\n"):
+                return
+            newline = tail.rfind(b"\n")
+            if newline == -1 and size > len(tail):
+                return  # 超长的单行记录，保守起见不截断
+            f.truncate(size - len(tail) + newline + 1)
+
+    def _append(self, record):
+        """追加一条日志记录"""
+        with self.lock:
+            self.seq += 1
+            record["seq"] = self.seq
+            self.journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.journal.flush()
+            self._apply(record)
+            self.journal_records += 1
+
+    def append_message(self, message):
+        """追加一条对话消息"""
+        self._append({"type": "message", "data": message})
+
+    def add_conversation(self, conversation):
+        """追加一条长期记忆对话"""
+        self._append({"type": "conversation", "data": conversation})
+
+    def add_preference(self, category, item):
+        """添加用户偏好
+
+        Returns:
+            是否为新偏好
+        """
+        with self.lock:
+            if item in self.preferences.get(category, {}):
+                return False
+            self._append({"type": "preference", "category": category, "item": item})
+            return True
+
+    def set_summary(self, text, upto):
+        """更新对话摘要"""
+        self._append({"type": "summary", "text": text, "upto": upto})
+
+    def sync(self):
+        """把日志刷到磁盘，日志过长时压缩"""
+        with self.lock:
+            os.fsync(self.journal.fileno())
+            if self.journal_records >= self.compact_every:
+                self.compact()
+
+    def _snapshot_records(self):
+        yield {"type": "header", "seq": self.seq}
+        for message in self.messages:
+            yield {"type": "message", "data": message}
+        for conversation in self.conversations:
+            yield {"type": "conversation", "data": conversation}
+        for category, items in self.preferences.items():
+            for item in items:
+                yield {"type": "preference", "category": category, "item": item}
+        yield {"type": "summary", "text": self.summary["text"], "upto": self.summary["upto"]}
+
+    def compact(self):
+        """把当前状态写成快照并清空日志"""
+        with self.lock:
+            tmp_path = self.snapshot_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for record in self._snapshot_records():
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+            self._fsync_dir()
+
+            self.journal.close()
+            self.journal = open(self.journal_path, "w", encoding="utf-8")
+            os.fsync(self.journal.fileno())
+            self.journal_records = 0
+
+    def _fsync_dir(self):
+        try:
+            fd = os.open(self.directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def close(self):
+        """刷盘并关闭日志"""
+        with self.lock:
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+            self.journal.close()
+
+    @property
+    def empty(self):
+        """是否还没有任何记录"""
+        return self.seq == 0 and not self.messages
+
+    def migrate_from_json(self, memory_file="memory.json", long_memory_file="memory_long.json"):
+        """从旧版 memory.json / memory_long.json 导入
+
+        Returns:
+            是否导入了数据
+        """
+        imported = False
+        with self.lock:
+            if os.path.exists(memory_file):
+                with open(memory_file, "r", encoding="utf-8") as f:
+                    self.messages.extend(json.load(f))
+                imported = True
+
+            if os.path.exists(long_memory_file):
+                with open(long_memory_file, "r", encoding="utf-8") as f:
+                    long_memory = json.load(f)
+                self.conversations.extend(long_memory.get("conversations", []))
+                for category, items in long_memory.get("preferences", {}).items():
+                    for item in items:
+                        self.preferences.setdefault(category, {})[item] = None
+                if "summary" in long_memory:
+                    self.summary = dict(long_memory["summary"])
+                imported = True
+
+            if imported:
+                self.seq += 1
+                self.compact()
+        return imported
+
+def main():
+    """迁移入口"""
+    parser = argparse.ArgumentParser(description="记忆存储工具")
+    parser.add_argument("--migrate", action="store_true", help="从 memory.json / memory_long.json 导入")
+    parser.add_argument("--compact", action="store_true", help="立即压缩日志")
+    args = parser.parse_args()
+
+    store = MemoryStore()
+    if args.migrate:
+        if not store.empty:
+            print(f"{store.directory} 中已有数据，跳过迁移")
+        elif store.migrate_from_json():
+            print(f"迁移完成: {len(store.messages)} 条消息, {len(store.conversations)} 条长期记忆")
+        else:
+            print("没有找到旧的记忆文件")
+    if args.compact:
+        store.compact()
+        print("日志已压缩")
+    store.close()
+
+if __name__ == "__main__":
+    main()
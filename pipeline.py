@@ -0,0 +1,546 @@
+"""
+对话流水线模块
+录音/VAD、语音识别、意图/GPT、语音合成、播放、表情显示各是一个 asyncio 任务，阶段之间用有界队列连接：
+下游跟不上时上游在放入队列处等待（背压），GPT 流也随之暂停读取；播放阶段向播放器送句子时也按
+pipeline_player_queue 等待实际播放，背压的源头是声卡的播放速度。主人插话时本轮的请求被取消，
+队列里属于旧轮次的句子和音频直接丢弃。唤醒/休眠和静默超时由状态机表达，各阶段只在对应状态下工作。
+
+回复的生成、合成和播放彼此重叠；录下一句话要等本轮播完回到听的状态，小Luna说话期间主人开口由插话检测处理，
+不会把她自己的声音当成下一句录进去。
+
+录音、识别、解码等阻塞调用在守护线程中执行（numpy/torch/miniaudio 计算时释放 GIL，可同时用上多个核心），
+GPT 和 edge-tts 请求仍在各自的常驻事件循环中进行。
+"""
+import time
+import asyncio
+import platform
+import threading
+import subprocess
+from contextlib import aclosing
+from collections import Counter, defaultdict
+from config import sleep_keywords, silence_timeout, stream_reply
+from config import pipeline_segment_queue, pipeline_clause_queue, pipeline_audio_queue, pipeline_display_queue
+from config import pipeline_player_queue
+from text_segmenter import SentenceSegmenter
+import tracing
+
+SLEEPING = "sleeping"
+LISTENING = "listening"
+TRANSCRIBING = "transcribing"
+THINKING = "thinking"
+SPEAKING = "speaking"
+
+# 状态 -> {事件: 新状态}，表中没有的事件在该状态下忽略
+TRANSITIONS = {
+    SLEEPING: {"wake": LISTENING},
+    LISTENING: {"speech": TRANSCRIBING, "timeout": SLEEPING},
+    TRANSCRIBING: {"transcript": THINKING, "no_input": LISTENING},
+    THINKING: {"reply": SPEAKING, "reply_done": LISTENING, "sleep": SLEEPING, "barge_in": LISTENING},
+    SPEAKING: {"reply_done": LISTENING, "barge_in": LISTENING},
+}
+
+def is_sleep_keyword(text):
+    """检查是否包含休眠关键词
+
+    Args:
+        text: 输入文本
+
+    Returns:
+        是否包含休眠关键词
+    """
+    text = text.lower()
+    for keyword in sleep_keywords:
+        if keyword.lower() in text:
+            return True
+    return False
+
+def run_blocking(func, *args):
+    """在守护线程中执行阻塞函数
+
+    不用线程池：等待唤醒词、终端输入之类的调用可能一直不返回，守护线程不会拖住退出。
+    被取消时线程照常执行完，结果丢弃。
+
+    Returns:
+        asyncio Future
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def deliver(setter, value):
+        if not future.done():
+            setter(value)
+
+    def runner():
+        try:
+            result = func(*args)
+        except Exception as e:
+            outcome = (future.set_exception, e)
+        else:
+            outcome = (future.set_result, result)
+        try:
+            loop.call_soon_threadsafe(deliver, *outcome)
+        except RuntimeError:
+            pass  # 事件循环已关闭
+
+    threading.Thread(target=runner, name=getattr(func, "__name__", "blocking"), daemon=True).start()
+    return future
+
+async def relay(agen, loop):
+    """逐项读取运行在另一个事件循环上的异步生成器
+
+    每次只取一项，调用方不取下一项时对方也不会继续读取，背压一直传到 GPT 流；
+    被取消时对方正在进行的读取一起取消。
+
+    Args:
+        agen: 异步生成器
+        loop: 它所在的事件循环
+    """
+    step = None
+    try:
+        while True:
+            step = asyncio.run_coroutine_threadsafe(agen.__anext__(), loop)
+            try:
+                item = await asyncio.wrap_future(step)
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        # 读取途中被取消时对方已经自行清理，否则通知它提前结束
+        if step is None or not step.cancelled():
+            asyncio.run_coroutine_threadsafe(agen.aclose(), loop)
+
+class ConversationState:
+    """对话状态机：休眠 -> 听 -> 识别 -> 思考 -> 说话 -> 听 ..."""
+
+    def __init__(self, state=SLEEPING):
+        self.state = state
+        self.entered = time.perf_counter()
+        self.changed = asyncio.Event()
+        self.listeners = []  # 回调 (旧状态, 事件, 新状态)
+        self.durations = defaultdict(float)  # 状态 -> 累计停留秒数
+        self.events = Counter()
+        self.ignored = Counter()
+
+    def fire(self, event):
+        """触发事件
+
+        Args:
+            event: 事件名称
+
+        Returns:
+            新状态，当前状态不接受该事件时为 None
+        """
+        new_state = TRANSITIONS[self.state].get(event)
+        if new_state is None:
+            self.ignored[event] += 1
+            return None
+        old_state = self.state
+        now = time.perf_counter()
+        self.durations[old_state] += now - self.entered
+        self.state = new_state
+        self.entered = now
+        self.events[event] += 1
+        # 唤醒所有等待者，之后的等待用新的 Event
+        self.changed.set()
+        self.changed = asyncio.Event()
+        for listener in self.listeners:
+            listener(old_state, event, new_state)
+        return new_state
+
+    async def wait_for(self, *states):
+        """等到进入给定状态之一"""
+        while self.state not in states:
+            await self.changed.wait()
+
+    def stats(self):
+        """各状态累计停留秒数（含当前状态）"""
+        durations = dict(self.durations)
+        durations[self.state] = durations.get(self.state, 0.0) + time.perf_counter() - self.entered
+        return {"state": self.state, "seconds": durations, "events": dict(self.events),
+                "ignored": dict(self.ignored)}
+
+class VoicePipeline:
+    """事件驱动的对话流水线"""
+
+    def __init__(self, gpt, lcd, router, monitor=None, engine=None):
+        """
+        Args:
+            gpt: ChatGPT 实例
+            lcd: LCDDisplay 实例
+            router: IntentRouter 实例
+            monitor: BargeInMonitor 实例，为 None 时不检测插话；回调应设为 on_barge_in
+            engine: 识别引擎名称，为空时自动选择
+        """
+        self.gpt = gpt
+        self.lcd = lcd
+        self.router = router
+        self.monitor = monitor
+        self.engine = engine
+        self.state = ConversationState()
+        self.state.listeners.append(self._on_transition)
+        self.queues = {
+            "segments": asyncio.Queue(pipeline_segment_queue),  # 录好的语音段（或测试模式下的文本）
+            "transcripts": asyncio.Queue(1),  # 识别出的文本
+            "clauses": asyncio.Queue(pipeline_clause_queue),  # (轮次, 句子)，句子为 None 表示本轮结束
+            "audio": asyncio.Queue(pipeline_audio_queue),  # (轮次, 句子, 合成任务)
+            "display": asyncio.Queue(pipeline_display_queue),  # 情绪名称
+        }
+        self.turn = 0  # 当前轮次编号，插话时加一，旧轮次的数据直接丢弃
+        self.reply_task = None
+        self.reply_started = None
+        self.barge_in = None
+        self.last_activity = time.time()
+        self.loop = None
+        self.tasks = []
+        self.turns = 0
+        self.interrupted = 0
+        self.display_dropped = 0
+        self.blocked = Counter()  # 队列名 -> 放入时因队列已满而等待的次数
+        self.blocked_seconds = defaultdict(float)
+        self.max_depth = Counter()
+
+    async def run(self):
+        """启动各阶段任务，直到被取消（Ctrl+C）或某个阶段出错"""
+        self.loop = asyncio.get_running_loop()
+        stages = {
+            "listen": self._listen,
+            "asr": self._recognize,
+            "think": self._think,
+            "synth": self._synthesize,
+            "playback": self._playback,
+            "display": self._display,
+        }
+        self.tasks = [asyncio.create_task(stage(), name=name) for name, stage in stages.items()]
+        try:
+            await asyncio.gather(*self.tasks)
+        finally:
+            for task in self.tasks:
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def _put(self, name, item):
+        """放入队列，队列满时等待并计入背压统计"""
+        queue = self.queues[name]
+        if queue.full():
+            self.blocked[name] += 1
+            started = time.perf_counter()
+            await queue.put(item)
+            self.blocked_seconds[name] += time.perf_counter() - started
+        else:
+            queue.put_nowait(item)
+        self.max_depth[name] = max(self.max_depth[name], queue.qsize())
+
+    def show(self, emotion):
+        """切换表情，不等待；队列满时丢弃最早的，只保留最新的情绪"""
+        queue = self.queues["display"]
+        if queue.full():
+            queue.get_nowait()
+            self.display_dropped += 1
+        queue.put_nowait(emotion)
+        self.max_depth["display"] = max(self.max_depth["display"], queue.qsize())
+
+    def _on_transition(self, old_state, event, new_state):
+        """小Luna开始思考时开启插话检测，回到听或休眠时关闭"""
+        if self.monitor is None:
+            return
+        if new_state == THINKING:
+            self.monitor.arm()
+        elif new_state in (LISTENING, SLEEPING) and old_state in (THINKING, SPEAKING):
+            self.monitor.disarm()
+
+    def on_barge_in(self, event):
+        """插话回调（在检测线程中调用），转到事件循环里取消本轮"""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._cancel_turn, event)
+
+    def _cancel_turn(self, event):
+        """主人插话：停止播报，取消本轮的 GPT 请求，丢弃还没播放的句子"""
+        if self.state.fire("barge_in") is None:
+            return
+        from voice_output import interrupt
+        interrupt()
+        self.turn += 1
+        self.interrupted += 1
+        self.barge_in = event
+        if self.reply_task is not None:
+            self.reply_task.cancel()
+        tracing.end_trace()
+        self.last_activity = time.time()
+
+    async def _go_to_sleep(self, event):
+        """播放休眠提示并进入休眠，后台整理任务在状态切换后再等"""
+        from voice_output import say_sleep
+        await run_blocking(say_sleep)
+        self.show("sleeping")
+        self.state.fire(event)
+        await run_blocking(self.gpt.flush)
+
+    async def _listen(self):
+        """录音/VAD 阶段：休眠时等唤醒词；醒着时在听的状态下截取一句话交给识别阶段"""
+        import whisper_input
+        from voice_output import say_awake
+        while True:
+            await self.state.wait_for(SLEEPING, LISTENING)
+            if self.state.state == SLEEPING:
+                print("\n===== 监听唤醒模式 =====")
+                if not await run_blocking(whisper_input.listen_for_wake_word, self.engine):
+                    continue
+                await run_blocking(say_awake)
+                self.show("happy")
+                self.last_activity = time.time()
+                self.state.fire("wake")
+                continue
+
+            if time.time() - self.last_activity > silence_timeout:
+                print(f"静默超过 {silence_timeout} 秒，自动休眠")
+                await self._go_to_sleep("timeout")
+                continue
+
+            barge_in, self.barge_in = self.barge_in, None
+            tracing.start_trace()
+            if whisper_input.TEST_MODE:
+                segment = await run_blocking(whisper_input.transcribe_audio)
+            else:
+                try:
+                    segment = await run_blocking(whisper_input.record_utterance, None, barge_in)
+                except Exception as e:
+                    print(f"语音识别出错: {e}")
+                    print("切换到测试模式...")
+                    whisper_input.TEST_MODE = True
+                    segment = None
+
+            if not segment:
+                tracing.end_trace(keep=False)
+                continue
+            self.state.fire("speech")
+            await self._put("segments", segment)
+
+    def _transcribe(self, segment):
+        """识别一段录音（在线程中执行）"""
+        from asr_engine import get_asr
+        from whisper_input import format_timings
+        text, timings = get_asr(self.engine).transcribe(*segment)
+        print(f"识别结果: {text} ({format_timings(timings)})")
+        return text
+
+    async def _recognize(self):
+        """识别阶段：录音阶段可以在识别进行时继续等下一句"""
+        queue = self.queues["segments"]
+        while True:
+            segment = await queue.get()
+            if isinstance(segment, str):
+                text = segment
+            else:
+                try:
+                    text = await run_blocking(self._transcribe, segment)
+                except Exception as e:
+                    print(f"语音识别出错: {e}")
+                    text = ""
+
+            if not text:
+                tracing.end_trace(keep=False)
+                self.state.fire("no_input")
+                continue
+            self.last_activity = time.time()
+            await self._put("transcripts", text)
+
+    async def _think(self):
+        """意图/GPT 阶段：本地意图直接回答，其余流式请求 GPT，按句送入合成队列"""
+        queue = self.queues["transcripts"]
+        while True:
+            text = await queue.get()
+            self.state.fire("transcript")
+            self.reply_started = time.perf_counter()
+
+            if is_sleep_keyword(text):
+                tracing.end_trace(keep=False)
+                print("检测到休眠关键词")
+                await self._go_to_sleep("sleep")
+                continue
+
+            turn = self.turn
+            self.reply_task = asyncio.create_task(self._reply(turn, text))
+            try:
+                await self.reply_task
+            except asyncio.CancelledError:
+                # 被插话取消的只是本轮回复；流水线本身被取消时继续向上抛
+                if asyncio.current_task().cancelling():
+                    raise
+            except Exception as e:
+                print(f"生成回复出错: {e}")
+                # 已经切出的句子照常播完，结束标记让播放阶段回到听的状态
+                await self._put("clauses", (turn, None))
+            finally:
+                self.reply_task = None
+
+    async def _reply(self, turn, text):
+        """生成一轮回复并按句放入合成队列，最后放入结束标记"""
+        from emotion_detect import detect_emotion
+        local_reply = self.router.handle(text)
+        if local_reply is not None:
+            tokens = self._tokens([local_reply])
+        else:
+            user_emotion = detect_emotion(text)
+            if user_emotion != "neutral":
+                self.show(user_emotion)
+            tokens = self._llm_tokens(text)
+
+        parts = []
+        segmenter = SentenceSegmenter()
+        async with aclosing(tokens):
+            async for token in tokens:
+                parts.append(token)
+                for clause in segmenter.feed(token):
+                    await self._put("clauses", (turn, clause))
+        for clause in segmenter.flush():
+            await self._put("clauses", (turn, clause))
+        await self._put("clauses", (turn, None))
+
+        reply = "".join(parts)
+        if local_reply is None:
+            if user_emotion == "neutral":
+                self.show(detect_emotion(reply))
+            self.router.remember(reply)
+
+    @staticmethod
+    async def _tokens(items):
+        for item in items:
+            yield item
+
+    async def _llm_tokens(self, text):
+        """GPT 回复的增量文本；请求在 GPT 的常驻事件循环中进行"""
+        from chat_gpt import get_llm_loop
+        loop = get_llm_loop()
+        if stream_reply:
+            async with aclosing(relay(self.gpt.astream(text, on_slow=self._on_slow), loop)) as tokens:
+                async for token in tokens:
+                    yield token
+        else:
+            future = asyncio.run_coroutine_threadsafe(self.gpt.achat(text, on_slow=self._on_slow), loop)
+            yield await asyncio.wrap_future(future)
+
+    def _on_slow(self):
+        """GPT 迟迟没有回复时先给出反馈（在 GPT 事件循环的线程池中调用）"""
+        from voice_output import play_filler
+        self.loop.call_soon_threadsafe(self.show, "thinking")
+        play_filler()
+
+    async def _render(self, clause):
+        """合成一句并解码为 PCM"""
+        from voice_output import submit_synthesis
+        from audio_player import decode_mp3
+        audio = await asyncio.wrap_future(submit_synthesis(clause))
+        return await run_blocking(decode_mp3, audio)
+
+    async def _synthesize(self):
+        """语音合成阶段：句子一到就提交合成，最多比播放提前 pipeline_audio_queue 句"""
+        import voice_output
+        queue = self.queues["clauses"]
+        render = platform.system() == "Linux" and not voice_output.TEST_MODE
+        while True:
+            turn, clause = await queue.get()
+            if turn != self.turn:
+                continue
+            job = asyncio.create_task(self._render(clause)) if render and clause is not None else None
+            await self._put("audio", (turn, clause, job))
+
+    async def _playback(self):
+        """播放阶段：按顺序把句子送入常驻播放器，本轮结束后等播完回到听的状态"""
+        import voice_output
+        queue = self.queues["audio"]
+        system = platform.system()
+        out = None
+        streaming = None  # 已开始流式播放的轮次
+        underruns = 0
+        while True:
+            turn, clause, job = await queue.get()
+            if turn != self.turn:
+                if job is not None:
+                    job.cancel()
+                continue
+
+            if clause is None:
+                if streaming == turn:
+                    out.end_stream()
+                    await run_blocking(out.wait)
+                    if out.started_at is not None and turn == self.turn:
+                        tracing.mark("first_audio", out.started_at)
+                        print(f"首音延迟: {(out.started_at - self.reply_started) * 1000:.0f}ms, "
+                              f"播放中断 {out.underruns - underruns} 次")
+                streaming = None
+                if turn == self.turn:
+                    self.turns += 1
+                    tracing.end_trace()
+                    self.last_activity = time.time()
+                    self.state.fire("reply_done")
+                continue
+
+            if self.state.state == THINKING:
+                self.state.fire("reply")
+            if voice_output.TEST_MODE:
+                tracing.mark("first_audio")
+                print(f"【测试模式】小Luna说: {clause}")
+            elif system == "Linux":
+                try:
+                    pcm = await job
+                except Exception as e:
+                    print(f"语音合成出错，跳过「{clause}」: {e}")
+                    continue
+                if turn != self.turn:
+                    continue
+                if streaming != turn:
+                    out = voice_output.get_player()
+                    underruns = out.underruns
+                    out.begin_stream()
+                    streaming = turn
+                elif len(out.chunks) >= pipeline_player_queue:
+                    # 播放器里已经排着句子，等它开始播放再送，否则播放器队列无界，前面的队列限不住合成和 GPT
+                    self.blocked["player"] += 1
+                    started = time.perf_counter()
+                    await run_blocking(out.wait_queued, pipeline_player_queue)
+                    self.blocked_seconds["player"] += time.perf_counter() - started
+                    if turn != self.turn:
+                        continue
+                print(f"小Luna说: {clause}")
+                out.play(pcm)
+            elif system == "Darwin":
+                print(f"小Luna说: {clause}")
+                tracing.mark("first_audio")
+                await run_blocking(subprocess.run, ["say", clause])
+            else:
+                print(f"暂不支持的系统，只显示文本: {clause}")
+
+    async def _display(self):
+        """表情阶段：LCD 渲染线程自己排队，这里只按顺序转交最新的情绪"""
+        queue = self.queues["display"]
+        while True:
+            self.lcd.display_emotion(await queue.get())
+
+    def stats(self):
+        """流水线统计"""
+        return {
+            "turns": self.turns,
+            "interrupted": self.interrupted,
+            "display_dropped": self.display_dropped,
+            "queues": {name: {"max_depth": self.max_depth[name], "size": queue.maxsize,
+                              "blocked": self.blocked[name], "blocked_seconds": self.blocked_seconds[name]}
+                       for name, queue in self.queues.items()},
+            "player": {"size": pipeline_player_queue, "blocked": self.blocked["player"],
+                       "blocked_seconds": self.blocked_seconds["player"]},
+            "states": self.state.stats(),
+        }
+
+    def report(self):
+        """格式化统计信息"""
+        s = self.stats()
+        lines = ["对话流水线:",
+                 f"  完成 {s['turns']} 轮，被插话打断 {s['interrupted']} 轮，丢弃表情切换 {s['display_dropped']} 次"]
+        for name, q in s["queues"].items():
+            lines.append(f"  队列 {name:12s} 最大深度 {q['max_depth']}/{q['size']}，"
+                         f"背压等待 {q['blocked']} 次共 {q['blocked_seconds']:.1f}s")
+        player = s["player"]
+        lines.append(f"  播放器排队上限 {player['size']}，等待播放 {player['blocked']} 次共 {player['blocked_seconds']:.1f}s")
+        seconds = s["states"]["seconds"]
+        lines.append("  状态停留: " + ", ".join(f"{state} {seconds[state]:.0f}s" for state in TRANSITIONS
+                                              if state in seconds))
+        return "\n".join(lines)
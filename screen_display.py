@@ -1,13 +1,18 @@
 """
 LCD 表情显示模块
 支持在 ILI9341 LCD 屏幕上显示不同情绪的表情动画
+表情帧在初始化时一次性解码为 RGB565（见 frame_cache.py），切换帧时只发送变化的区域。
+所有写屏都由一个常驻渲染线程按固定节拍完成，display_emotion 等调用只是把命令放入队列，立即返回。
 """
 import os
 import time
+import queue
 import threading
+from collections import deque
 from typing import List
 import platform
-from config import TEST_MODE
+from config import TEST_MODE, display_fps, animation_frame_seconds, display_crossfade_ms
+import tracing
 
 ASCII_EMOTIONS = {
     "happy": """
@@ -31,18 +36,36 @@ class LCDDisplay:
     """LCD 显示控制类"""
     def __init__(self):
         self.current_emotion = "neutral"
-        self.animation_thread = None
-        self.running = False
+        self.frames = None
+        self.presenter = None
+        self.commands = queue.Queue()
+        self.stop_event = threading.Event()
+        self.render_thread = None
+        # 渲染统计
+        self.ticks = 0
+        self.rendered = 0
+        self.dropped = 0  # 上一帧渲染超时而跳过的节拍数
+        self.late = 0  # 渲染完成时已超过本帧截止时间的帧数
+        self.jitter = deque(maxlen=256)  # 最近各节拍实际开始时间与计划时间之差（毫秒）
         
     def initialize(self):
-        """初始化 LCD 屏幕"""
+        """初始化 LCD 屏幕，预加载所有表情帧并启动渲染线程"""
+        from frame_cache import FramePresenter, VirtualFramebuffer, ILI9341
+
         if TEST_MODE:
             print("【测试模式】初始化虚拟 LCD 屏幕")
+            self._load_frames()
+            self.presenter = FramePresenter(VirtualFramebuffer())
+            self._start_render_thread()
             return True
             
         try:
             if platform.system() == "Linux":
                 print("初始化 LCD 屏幕 (ILI9341)")
+                backend = ILI9341()
+                self._load_frames()
+                self.presenter = FramePresenter(backend)
+                self._start_render_thread()
                 return True
             else:
                 print("非 Linux 系统，无法初始化实际 LCD 屏幕")
@@ -50,33 +73,66 @@ class LCDDisplay:
         except Exception as e:
             print(f"LCD 初始化失败: {e}")
             return False
+
+    def _load_frames(self):
+        """加载表情帧：有预编译打包文件时内存映射读取，否则解码素材目录中的 BMP"""
+        from frame_cache import FrameCache
+        from emotion_detect import all_animation_frames
+        from config import lcd_frame_pack
+
+        start = time.perf_counter()
+        if os.path.exists(lcd_frame_pack):
+            try:
+                self.frames = FrameCache.from_pack(lcd_frame_pack)
+            except (OSError, ValueError) as e:
+                print(f"表情帧打包文件读取失败，改为解码素材: {e}")
+        if self.frames is None:
+            self.frames = FrameCache()
+            self.frames.load(all_animation_frames())
+        print(f"已加载 {len(self.frames.frames)} 个表情帧，用时 {(time.perf_counter() - start) * 1000:.0f}ms")
+
+    def _start_render_thread(self):
+        self.render_thread = threading.Thread(target=self._render_loop, name="lcd-render", daemon=True)
+        self.render_thread.start()
     
     def display_emotion(self, emotion):
-        """显示情绪表情
+        """显示情绪表情：淡入该情绪的动画并循环播放，不等待写屏
         
         Args:
             emotion: 情绪类型
         """
+        from emotion_detect import get_emotion_animation
+
         self.current_emotion = emotion
         
-        if TEST_MODE:
-            print(f"【测试模式】显示表情: {emotion}")
-            print(ASCII_EMOTIONS.get(emotion, ASCII_EMOTIONS["neutral"]))
-            return
-            
-        if platform.system() != "Linux":
-            print(f"非 Linux 系统，无法显示实际表情，模拟显示: {emotion}")
-            return
-            
-        print(f"显示表情: {emotion}")
+        with tracing.span("display", emotion=emotion):
+            if TEST_MODE:
+                print(f"【测试模式】显示表情: {emotion}")
+                print(ASCII_EMOTIONS.get(emotion, ASCII_EMOTIONS["neutral"]))
+                
+            elif platform.system() != "Linux":
+                print(f"非 Linux 系统，无法显示实际表情，模拟显示: {emotion}")
+                return
+                
+            else:
+                print(f"显示表情: {emotion}")
+
+            if self.render_thread is not None:
+                animation = get_emotion_animation("sleep" if emotion == "sleeping" else emotion)
+                self.commands.put(("animation", animation, True, True))
     
-    def play_animation(self, animation_files: List[str], loop=True):
-        """播放动画序列
+    def play_animation(self, animation_files: List[str], loop=True, crossfade=False):
+        """播放动画序列，不等待写屏
         
         Args:
             animation_files: 动画文件列表
             loop: 是否循环播放
+            crossfade: 是否从当前画面淡入第一帧
         """
+        if self.render_thread is not None:
+            self.commands.put(("animation", list(animation_files), loop, crossfade))
+            return
+
         if TEST_MODE:
             print(f"【测试模式】播放动画: {animation_files}")
             return
@@ -88,56 +144,135 @@ class LCDDisplay:
         print(f"播放动画: {animation_files}")
         
     def start_animation_thread(self, emotion):
-        """在后台线程中播放情绪动画
+        """播放情绪动画（保留旧接口，由渲染线程播放）
         
         Args:
             emotion: 情绪类型
         """
         from emotion_detect import get_emotion_animation
         
-        self.stop_animation()
-        
-        animation_files = get_emotion_animation(emotion)
-        
-        self.running = True
-        self.animation_thread = threading.Thread(
-            target=self._animation_loop,
-            args=(animation_files,)
-        )
-        self.animation_thread.daemon = True
-        self.animation_thread.start()
-        
-    def _animation_loop(self, animation_files):
-        """动画循环
-        
-        Args:
-            animation_files: 动画文件列表
-        """
-        while self.running:
-            for file in animation_files:
-                if not self.running:
-                    break
-                self.display_frame(file)
-                time.sleep(0.3)  # 帧率控制
+        self.play_animation(get_emotion_animation(emotion))
                 
     def display_frame(self, frame_file):
-        """显示单帧
+        """显示单帧（停止当前动画）
         
         Args:
             frame_file: 帧文件名
         """
         if TEST_MODE:
             print(f"【测试模式】显示帧: {frame_file}")
-            return
-            
-        if platform.system() != "Linux":
+        elif platform.system() != "Linux":
             print(f"非 Linux 系统，无法显示实际帧，模拟显示: {frame_file}")
             return
-            
-        print(f"显示帧: {frame_file}")
+        else:
+            print(f"显示帧: {frame_file}")
+
+        if self.render_thread is not None:
+            self.commands.put(("animation", [frame_file], False, False))
         
     def stop_animation(self):
-        """停止当前动画"""
-        if self.animation_thread and self.animation_thread.is_alive():
-            self.running = False
-            self.animation_thread.join(1)
+        """停止当前动画，画面停留在最后一帧"""
+        if self.render_thread is not None:
+            self.commands.put(("stop",))
+
+    def _render_loop(self):
+        """渲染循环：每个节拍处理队列中的命令，推进淡入或动画，最多写屏一次
+
+        节拍按计划时间推进而不是在渲染后 sleep 固定时长，渲染耗时不会累积成帧率漂移；
+        渲染超过一个节拍时跳过错过的节拍（计入 dropped），不补画。
+        """
+        from frame_cache import blend
+
+        tick = 1 / display_fps
+        fade_ticks = max(1, round(display_crossfade_ms / 1000 / tick))
+        animation, loop, index = [], False, 0
+        next_frame_at = None
+        fade_from, fade_step = None, 0
+        next_tick = time.perf_counter()
+
+        while not self.stop_event.wait(max(0.0, next_tick - time.perf_counter())):
+            now = time.perf_counter()
+            lateness = now - next_tick
+            self.jitter.append(lateness * 1000)
+            self.ticks += 1
+            if lateness >= tick:
+                missed = int(lateness // tick)
+                self.dropped += missed
+                next_tick += missed * tick
+            deadline = next_tick + tick
+
+            # 只有最后一个动画命令生效，连续切换表情时中间的不会画出来
+            pending = False
+            while True:
+                try:
+                    command = self.commands.get_nowait()
+                except queue.Empty:
+                    break
+                if command[0] == "animation":
+                    _, animation, loop, crossfade = command
+                    index = 0
+                    next_frame_at = now + animation_frame_seconds
+                    fade_from = self.presenter.previous if crossfade else None
+                    fade_step = 0
+                    pending = True
+                elif command[0] == "stop":
+                    animation, fade_from = animation[index:index + 1], None
+                    next_frame_at = None
+
+            frame = None
+            if fade_from is not None:
+                fade_step += 1
+                target = self.frames.frame(animation[0])
+                frame = target if fade_step >= fade_ticks else blend(fade_from, target, fade_step / fade_ticks)
+                if fade_step >= fade_ticks:
+                    fade_from = None
+                    next_frame_at = now + animation_frame_seconds
+            elif pending:
+                frame = self.frames.frame(animation[0])
+            elif next_frame_at is not None and now >= next_frame_at and len(animation) > 1:
+                if index + 1 < len(animation) or loop:
+                    index = (index + 1) % len(animation)
+                    frame = self.frames.frame(animation[index])
+                    next_frame_at += animation_frame_seconds
+                else:
+                    next_frame_at = None
+
+            if frame is not None:
+                try:
+                    self.presenter.show(frame)
+                except Exception as e:
+                    print(f"写屏失败: {e}")
+                self.rendered += 1
+                if time.perf_counter() > deadline:
+                    self.late += 1
+            next_tick += tick
+
+    def stats(self):
+        """渲染统计"""
+        jitter = sorted(self.jitter)
+        return {
+            "ticks": self.ticks,
+            "rendered": self.rendered,
+            "dropped": self.dropped,
+            "late": self.late,
+            "queued": self.commands.qsize(),
+            "jitter_p95_ms": jitter[min(len(jitter) - 1, int(len(jitter) * 0.95))] if jitter else 0.0,
+            "jitter_max_ms": jitter[-1] if jitter else 0.0,
+            "bytes_pushed": self.presenter.bytes_pushed if self.presenter else 0,
+        }
+
+    def report(self):
+        """格式化渲染统计"""
+        s = self.stats()
+        return (f"屏幕渲染: {s['rendered']} 帧 / {s['ticks']} 个节拍, 跳过 {s['dropped']}, 超时 {s['late']}, "
+                f"节拍抖动 p95 {s['jitter_p95_ms']:.1f}ms (最大 {s['jitter_max_ms']:.1f}ms), "
+                f"发送 {s['bytes_pushed'] / 1024:.0f}KB")
+
+    def close(self):
+        """停止渲染线程并关闭屏幕"""
+        if self.render_thread is None:
+            return
+        self.stop_event.set()
+        self.render_thread.join()
+        self.render_thread = None
+        self.presenter.backend.close()
@@ -0,0 +1,85 @@
+"""
+启动编排模块
+把语音识别模型加载、GPT 客户端和记忆初始化、屏幕初始化、语音缓存预热等启动步骤并行执行，
+重量级模块（whisper/torch、openai、edge-tts）在各自的任务里才导入，并输出启动时间线。
+"""
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import tracing
+
+class StartupOrchestrator:
+    """并行执行启动任务并记录时间线"""
+
+    def __init__(self, max_workers=4):
+        """
+        Args:
+            max_workers: 最多同时执行的任务数
+        """
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="startup")
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+        self.tasks = {}  # 任务名 -> (Future, 是否必需)
+        self.timeline = {}  # 任务名 -> (开始, 结束, 错误信息)
+        self.ready_at = None
+
+    def add(self, name, func, *args, required=True):
+        """提交一个启动任务
+
+        Args:
+            name: 任务名称
+            func: 任务函数，返回值可通过 result() 取得
+            *args: 函数参数
+            required: 是否必须完成后才算启动就绪
+        """
+        self.tasks[name] = (self.executor.submit(self._run, name, func, args), required)
+
+    def _run(self, name, func, args):
+        started = time.perf_counter()
+        error = None
+        try:
+            return func(*args)
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            ended = time.perf_counter()
+            with self.lock:
+                self.timeline[name] = (started, ended, error)
+            tracing.record(f"startup.{name}", started, ended)
+
+    def result(self, name, timeout=None):
+        """等待任务完成并返回结果，任务出错时抛出原异常"""
+        return self.tasks[name][0].result(timeout)
+
+    def wait(self):
+        """等待所有必需任务完成
+
+        Returns:
+            从开始启动到就绪的秒数
+        """
+        for future, required in self.tasks.values():
+            if required:
+                future.exception()
+        self.ready_at = time.perf_counter()
+        return self.ready_at - self.start
+
+    def report(self):
+        """格式化启动时间线"""
+        with self.lock:
+            timeline = sorted(self.timeline.items(), key=lambda item: item[1][0])
+        lines = ["启动时间线:"]
+        for name, (started, ended, error) in timeline:
+            status = f"  出错: {error}" if error else ""
+            lines.append(f"  {name:8s} {(started - self.start) * 1000:7.0f}ms -> "
+                         f"{(ended - self.start) * 1000:7.0f}ms  ({(ended - started) * 1000:.0f}ms){status}")
+        pending = [name for name, (future, _) in self.tasks.items() if not future.done()]
+        if pending:
+            lines.append(f"  仍在后台进行: {', '.join(pending)}")
+        if self.ready_at is not None:
+            lines.append(f"  就绪用时 {(self.ready_at - self.start) * 1000:.0f}ms")
+        return "\n".join(lines)
+
+    def shutdown(self):
+        """不再接受新任务，后台任务继续执行完"""
+        self.executor.shutdown(wait=False)
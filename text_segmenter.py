@@ -0,0 +1,111 @@
+"""
+中英文分句模块
+把 GPT 流式输出的 token 切成适合逐句合成语音的短句
+"""
+import re
+
+# 中文句末标点任意位置都可断句
+CJK_TERMINALS = "。！？；…～\n"
+# 英文句末标点后面跟空白才断句，避免切断 3.14、e.g. 之类
+ASCII_TERMINALS = ".!?;~"
+# 分句时一并带走的后续标点和右引号/括号
+TRAILING = "。！？!?；;…～~”’」』）)】\"'"
+CLAUSE_BREAKS = "，,、：:"
+SPEAKABLE = re.compile(r"\w")
+
+class SentenceSegmenter:
+    """流式分句器
+
+    第一句在逗号处就可以切出，尽快送去合成；之后的句子尽量按整句切，
+    避免过碎的片段增加合成请求次数。
+    """
+
+    def __init__(self, first_clause_chars=6, clause_chars=24, max_chars=80):
+        """
+        Args:
+            first_clause_chars: 第一句在逗号处切分所需的最少字数
+            clause_chars: 后续句子在逗号处切分所需的最少字数
+            max_chars: 无标点时强制切分的长度
+        """
+        self.first_clause_chars = first_clause_chars
+        self.clause_chars = clause_chars
+        self.max_chars = max_chars
+        self.buffer = ""
+        self.emitted = 0
+
+    def _split_point(self):
+        """返回当前缓冲区可切分的位置，没有则返回 -1"""
+        text = self.buffer
+        min_clause = self.first_clause_chars if self.emitted == 0 else self.clause_chars
+        cut = -1
+        for i, ch in enumerate(text):
+            if ch in CJK_TERMINALS:
+                cut = i + 1
+            elif ch in ASCII_TERMINALS:
+                if i + 1 < len(text) and text[i + 1].isspace():
+                    cut = i + 1
+            elif ch in CLAUSE_BREAKS and i + 1 >= min_clause:
+                cut = i + 1
+            if cut != -1:
+                break
+
+        if cut == -1:
+            if len(text) >= self.max_chars:
+                space = text.rfind(" ", 0, self.max_chars)
+                return space + 1 if space > 0 else self.max_chars
+            return -1
+
+        while cut < len(text) and text[cut] in TRAILING:
+            cut += 1
+        return cut
+
+    def _take(self, cut):
+        clause = self.buffer[:cut].strip()
+        self.buffer = self.buffer[cut:]
+        if SPEAKABLE.search(clause):
+            self.emitted += 1
+            return clause
+        return None
+
+    def feed(self, token):
+        """送入一个 token
+
+        Args:
+            token: GPT 输出的增量文本
+
+        Returns:
+            新切出的完整句子列表
+        """
+        self.buffer += token
+        clauses = []
+        while True:
+            cut = self._split_point()
+            if cut <= 0:
+                break
+            clause = self._take(cut)
+            if clause:
+                clauses.append(clause)
+        return clauses
+
+    def flush(self):
+        """取出剩余文本
+
+        Returns:
+            剩余句子列表（可能为空）
+        """
+        clause = self._take(len(self.buffer))
+        return [clause] if clause else []
+
+def split_clauses(text):
+    """把一段完整文本按流式播报的规则切成句子
+
+    与流式播报对同一段文本切出的句子相同，预合成时按这些句子写缓存才能命中。
+
+    Args:
+        text: 完整文本
+
+    Returns:
+        句子列表
+    """
+    segmenter = SentenceSegmenter()
+    return segmenter.feed(text) + segmenter.flush()
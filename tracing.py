@@ -0,0 +1,281 @@
+"""
+端到端延迟追踪模块
+每轮对话分配一个 trace ID，唤醒、识别、GPT、情绪、表情、合成、播放等阶段各记一个 span。
+span 先存在内存环形缓冲区，由后台线程定期追加写入 JSONL 文件；关闭追踪时 span() 返回空操作对象，几乎没有开销。
+
+导出文件可直接统计，例如最近 7 天首音延迟的 p95 及各阶段耗时：
+    python tracing.py --days 7
+"""
+import os
+import json
+import time
+import uuid
+import argparse
+import threading
+from collections import deque
+from config import tracing_enabled, trace_file, trace_buffer_size, trace_flush_seconds
+
+enabled = tracing_enabled
+
+# perf_counter 与墙上时间的换算，导出时统一成 Unix 时间戳
+_clock_offset = time.time() - time.perf_counter()
+
+_lock = threading.Lock()
+_buffer = deque(maxlen=trace_buffer_size)
+_current = None
+_exporter = None
+_dropped = 0
+
+class _NoopSpan:
+    """关闭追踪时使用的空 span"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+_NOOP = _NoopSpan()
+
+class _Trace:
+    """一轮对话中收集到的 span 和标记"""
+
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.start = time.perf_counter()
+        self.spans = []
+        self.marks = {}
+
+class Span:
+    """计时区间，用 with 语句包住被测代码"""
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        _record(self.name, self.start, end, self.attrs)
+        return False
+
+    def set(self, **attrs):
+        """补充属性（如识别出的字数）"""
+        self.attrs.update(attrs)
+
+def span(name, **attrs):
+    """创建一个 span
+
+    Args:
+        name: 阶段名称，如 "asr.decode"、"llm"
+        **attrs: 附加属性
+
+    Returns:
+        上下文管理器
+    """
+    if not enabled:
+        return _NOOP
+    return Span(name, attrs)
+
+def record(name, start, end=None, **attrs):
+    """记录一个起止点不便用 with 包住的 span（如流式回复的首字延迟）
+
+    Args:
+        name: 阶段名称
+        start: perf_counter 开始时间
+        end: perf_counter 结束时间，默认为现在
+        **attrs: 附加属性
+    """
+    if not enabled:
+        return
+    _record(name, start, time.perf_counter() if end is None else end, attrs)
+
+def _record(name, start, end, attrs):
+    """记录一个已结束的 span，有进行中的对话时归入该对话"""
+    global _dropped
+    entry = {"span": name, "start": start, "ms": (end - start) * 1000}
+    if attrs:
+        entry["attrs"] = attrs
+    with _lock:
+        if _current is not None:
+            _current.spans.append(entry)
+            return
+        if len(_buffer) == _buffer.maxlen:
+            _dropped += 1
+        _buffer.append(entry)
+
+def mark(name, at=None):
+    """在当前对话中记录一个时间点（如首音开始播放），同名标记只保留第一次
+
+    Args:
+        name: 标记名称
+        at: perf_counter 时间，默认为现在
+    """
+    if not enabled:
+        return
+    at = time.perf_counter() if at is None else at
+    with _lock:
+        if _current is not None:
+            _current.marks.setdefault(name, at)
+
+def start_trace(name="turn"):
+    """开始一轮对话的追踪
+
+    Returns:
+        trace ID，关闭追踪时为 None
+    """
+    global _current
+    if not enabled:
+        return None
+    _ensure_exporter()
+    with _lock:
+        _current = _Trace(name)
+        return _current.id
+
+def end_trace(keep=True):
+    """结束当前对话的追踪，生成汇总记录放入缓冲区
+
+    汇总记录包含总耗时、首音延迟（从说完话到开始播放），以及首音之前各阶段的耗时。
+
+    Args:
+        keep: False 时丢弃本轮（例如没有检测到说话）
+    """
+    global _current, _dropped
+    with _lock:
+        trace, _current = _current, None
+    if trace is None or not keep:
+        return
+
+    end = time.perf_counter()
+    origin = trace.marks.get("speech_end", trace.start)
+    first_audio = trace.marks.get("first_audio")
+    stages = {}
+    for entry in trace.spans:
+        if first_audio is None or entry["start"] < first_audio:
+            stages[entry["span"]] = stages.get(entry["span"], 0) + entry["ms"]
+
+    summary = {"span": trace.name, "start": trace.start, "ms": (end - trace.start) * 1000,
+               "attrs": {"stages": stages}}
+    if first_audio is not None:
+        summary["attrs"]["ttfa_ms"] = (first_audio - origin) * 1000
+    for entry in trace.spans + [summary]:
+        entry["trace"] = trace.id
+
+    with _lock:
+        for entry in trace.spans + [summary]:
+            if len(_buffer) == _buffer.maxlen:
+                _dropped += 1
+            _buffer.append(entry)
+
+def flush(path=trace_file):
+    """把缓冲区中的记录追加写入 JSONL 文件
+
+    Returns:
+        写出的记录条数
+    """
+    with _lock:
+        records = list(_buffer)
+        _buffer.clear()
+    if not records:
+        return 0
+
+    with open(path, "a", encoding="utf-8") as f:
+        for entry in records:
+            entry = dict(entry, start=round(entry["start"] + _clock_offset, 6), ms=round(entry["ms"], 3))
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    return len(records)
+
+def _export_loop(stop):
+    while not stop.wait(trace_flush_seconds):
+        try:
+            flush()
+        except OSError as e:
+            print(f"导出追踪记录失败: {e}")
+
+def _ensure_exporter():
+    """首次开始追踪时启动定期导出线程"""
+    global _exporter
+    with _lock:
+        if _exporter is not None:
+            return
+        _exporter = threading.Event()
+    threading.Thread(target=_export_loop, args=(_exporter,), name="trace-export", daemon=True).start()
+
+def close():
+    """停止定期导出并写出剩余记录"""
+    global _exporter
+    with _lock:
+        stop, _exporter = _exporter, None
+    if stop is not None:
+        stop.set()
+    if enabled:
+        flush()
+    if _dropped:
+        print(f"追踪缓冲区溢出，丢弃了 {_dropped} 条记录")
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def report(path=trace_file, days=7):
+    """统计导出文件中最近若干天的首音延迟和各阶段耗时
+
+    Args:
+        path: JSONL 文件路径
+        days: 统计最近多少天
+
+    Returns:
+        报告文本
+    """
+    since = time.time() - days * 86400
+    ttfa = []
+    stages = {}
+    turns = 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if entry.get("span") != "turn" or entry["start"] < since:
+                continue
+            turns += 1
+            attrs = entry.get("attrs", {})
+            if "ttfa_ms" in attrs:
+                ttfa.append(attrs["ttfa_ms"])
+            for name, ms in attrs.get("stages", {}).items():
+                stages.setdefault(name, []).append(ms)
+
+    if not turns:
+        return f"最近 {days} 天没有追踪记录"
+    lines = [f"最近 {days} 天共 {turns} 轮对话"]
+    if ttfa:
+        lines.append(f"首音延迟: p50 {percentile(ttfa, 0.5):.0f}ms, p95 {percentile(ttfa, 0.95):.0f}ms ({len(ttfa)} 轮)")
+    lines.append("首音之前各阶段耗时:")
+    for name, values in sorted(stages.items(), key=lambda item: -percentile(item[1], 0.95)):
+        lines.append(f"  {name:16s} p50 {percentile(values, 0.5):8.1f}ms  p95 {percentile(values, 0.95):8.1f}ms  ({len(values)} 轮)")
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="延迟追踪统计")
+    parser.add_argument("--file", default=trace_file, help="追踪记录 JSONL 文件")
+    parser.add_argument("--days", type=float, default=7, help="统计最近多少天")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.file):
+        print(f"没有找到追踪记录 {args.file}")
+        return
+    print(report(args.file, args.days))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+语音合成缓存模块
+按 (文本, 语音, 语速, 风格) 内容寻址，把合成好的音频保存在本地磁盘，
+超过容量上限时按最近最少使用（LRU）淘汰。
+"""
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from config import tts_cache_dir, tts_cache_max_bytes
+
+class TTSCache:
+    """磁盘 LRU 音频缓存"""
+
+    def __init__(self, cache_dir=tts_cache_dir, max_bytes=tts_cache_max_bytes, suffix=".mp3"):
+        """
+        Args:
+            cache_dir: 缓存目录
+            max_bytes: 缓存总大小上限（字节）
+            suffix: 缓存文件扩展名
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> 文件大小，按最近访问排序
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._scan()
+
+    def _scan(self):
+        """启动时按修改时间恢复 LRU 顺序"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(self.suffix):
+                continue
+            stat = os.stat(os.path.join(self.cache_dir, name))
+            files.append((stat.st_mtime, name[:-len(self.suffix)], stat.st_size))
+        for _, key, size in sorted(files):
+            self.entries[key] = size
+            self.total_bytes += size
+
+    @staticmethod
+    def make_key(text, voice, rate="+0%", style=None):
+        """计算缓存键
+
+        Returns:
+            十六进制 SHA-256 摘要
+        """
+        raw = json.dumps([text, voice, rate, style], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + self.suffix)
+
+    def get(self, key):
+        """读取缓存
+
+        Returns:
+            音频数据，未命中返回 None
+        """
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+            os.utime(self._path(key))
+            return data
+        except OSError:
+            with self.lock:
+                self.total_bytes -= self.entries.pop(key, 0)
+            return None
+
+    def put(self, key, data):
+        """写入缓存，超出上限时淘汰最久未使用的条目"""
+        if not data or len(data) > self.max_bytes:
+            return
+
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            self.total_bytes -= self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+            self.total_bytes += len(data)
+            evicted = []
+            while self.total_bytes > self.max_bytes:
+                old_key, size = self.entries.popitem(last=False)
+                self.total_bytes -= size
+                evicted.append(old_key)
+
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    def stats(self):
+        """缓存统计"""
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,182 @@
+"""
+语音活动检测（VAD）模块
+按 10~30ms 分帧，用 NumPy 批量计算短时能量与过零率，
+结合自适应噪声底和拖尾平滑，输出精确到采样点的说话开始/结束事件。
+Whisper 与 Vosk 两条识别路径共用。
+"""
+from collections import namedtuple
+import numpy as np
+from config import vad_frame_ms, vad_hangover_ms
+
+# kind: "start" 或 "end"；sample: 事件发生的绝对采样点位置
+VadEvent = namedtuple("VadEvent", ["kind", "sample"])
+
+def frame_features(samples, frame_len):
+    """批量计算每帧的能量（RMS）与过零率
+
+    Args:
+        samples: 一维 float32 音频，长度为 frame_len 的整数倍
+        frame_len: 帧长（采样点）
+
+    Returns:
+        (能量数组, 过零率数组)
+    """
+    frames = samples.reshape(-1, frame_len)
+    energy = np.sqrt(np.mean(frames * frames, axis=1))
+    signs = np.signbit(frames)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (frame_len - 1)
+    return energy, zcr
+
+class VoiceActivityDetector:
+    """流式语音活动检测器
+
+    音频可以任意长度分块送入，内部保留不足一帧的余量；
+    事件位置按已处理的采样点计数，与录音回调时机无关。
+    """
+
+    def __init__(self, fs=16000, frame_ms=vad_frame_ms, hangover_ms=vad_hangover_ms,
+                 start_ms=60, snr=3.0, min_energy=0.005, max_zcr=0.45,
+                 noise_alpha=0.05, on_event=None):
+        """
+        Args:
+            fs: 采样率
+            frame_ms: 帧长（毫秒），建议 10~30
+            hangover_ms: 拖尾时长，连续静音超过该值才判定说话结束
+            start_ms: 连续有声超过该值才判定说话开始
+            snr: 能量相对噪声底的倍数门限
+            min_energy: 能量绝对下限，避免在极安静环境下误触发
+            max_zcr: 过零率上限，超过则视为噪声（能量足够高时除外）
+            noise_alpha: 噪声底平滑系数
+            on_event: 事件回调，接收 VadEvent
+        """
+        self.fs = fs
+        self.frame_len = max(2, int(fs * frame_ms / 1000))
+        self.hangover_frames = max(1, int(round(hangover_ms / frame_ms)))
+        self.start_frames = max(1, int(round(start_ms / frame_ms)))
+        self.snr = snr
+        self.min_energy = min_energy
+        self.max_zcr = max_zcr
+        self.noise_alpha = noise_alpha
+        self.on_event = on_event
+        self.reset()
+
+    def reset(self):
+        """清空状态"""
+        self.noise_floor = None
+        self.in_speech = False
+        self.voiced_run = 0
+        self.silent_run = 0
+        self.samples_seen = 0
+        self.speech_start = None
+        self._last_voiced = (np.zeros(0, dtype=np.float32), 0)
+        self._pending = np.zeros(0, dtype=np.float32)
+
+    @property
+    def threshold(self):
+        """当前能量门限"""
+        floor = self.noise_floor if self.noise_floor is not None else 0.0
+        return max(floor * self.snr, self.min_energy)
+
+    def _emit(self, events, kind, sample):
+        event = VadEvent(kind, int(sample))
+        events.append(event)
+        if self.on_event:
+            self.on_event(event)
+
+    def _onset(self, frame, frame_start):
+        """在起始帧内定位第一个超过门限的采样点"""
+        above = np.flatnonzero(np.abs(frame) > self.threshold)
+        return frame_start + (above[0] if len(above) else 0)
+
+    def _offset(self):
+        """在最后一个有声帧内定位最后一个超过门限的采样点之后的位置"""
+        frame, frame_start = self._last_voiced
+        above = np.flatnonzero(np.abs(frame) > self.threshold)
+        return frame_start + (above[-1] + 1 if len(above) else len(frame))
+
+    def process(self, samples):
+        """送入一段音频
+
+        Args:
+            samples: 一维 float32 音频（int16 会自动归一化）
+
+        Returns:
+            本段音频中产生的 VadEvent 列表
+        """
+        samples = np.asarray(samples).reshape(-1)
+        if samples.dtype == np.int16:
+            samples = samples.astype(np.float32) / 32768.0
+        else:
+            samples = samples.astype(np.float32, copy=False)
+        if len(self._pending):
+            samples = np.concatenate([self._pending, samples])
+
+        n_frames = len(samples) // self.frame_len
+        usable = n_frames * self.frame_len
+        self._pending = samples[usable:].copy()
+
+        events = []
+        if n_frames == 0:
+            return events
+
+        energy, zcr = frame_features(samples[:usable], self.frame_len)
+        if self.noise_floor is None:
+            self.noise_floor = float(np.min(energy))
+
+        base = self.samples_seen
+        for i in range(n_frames):
+            e = energy[i]
+            threshold = self.threshold
+            voiced = e > threshold and (zcr[i] < self.max_zcr or e > threshold * 2)
+            frame_start = base + i * self.frame_len
+
+            if voiced:
+                self.voiced_run += 1
+                self.silent_run = 0
+                # 语音期间噪声底缓慢跟随，避免环境噪声变大后一直判为有声
+                self.noise_floor += self.noise_alpha * 0.01 * (e - self.noise_floor)
+                self._last_voiced = (samples[i * self.frame_len:(i + 1) * self.frame_len], frame_start)
+                if not self.in_speech and self.voiced_run >= self.start_frames:
+                    first = i - self.start_frames + 1
+                    if first >= 0:
+                        offset = first * self.frame_len
+                        start = self._onset(samples[offset:offset + self.frame_len], base + offset)
+                    else:
+                        start = frame_start - (self.start_frames - 1) * self.frame_len
+                    self.in_speech = True
+                    self.speech_start = start
+                    self._emit(events, "start", start)
+            else:
+                self.voiced_run = 0
+                self.silent_run += 1
+                # 非语音帧上正常更新噪声底
+                self.noise_floor += self.noise_alpha * (e - self.noise_floor)
+                if self.in_speech and self.silent_run >= self.hangover_frames:
+                    self.in_speech = False
+                    self._emit(events, "end", self._offset())
+
+        self.samples_seen += usable
+        return events
+
+    def observe(self, samples, max_speech_samples=None):
+        """送入一段音频，只关心每段说话的长度
+
+        Args:
+            samples: 一维 float32 音频（int16 会自动归一化）
+            max_speech_samples: 连续说话超过该长度时就地切成一段，并从当前位置重新计长；None 不切分
+
+        Returns:
+            本段音频中结束（或被切分）的各段说话长度（采样点）列表
+        """
+        lengths = []
+        start = self.speech_start
+        for event in self.process(samples):
+            if event.kind == "start":
+                start = event.sample
+            else:
+                lengths.append(event.sample - start)
+
+        if max_speech_samples and self.in_speech and self.samples_seen - self.speech_start >= max_speech_samples:
+            lengths.append(self.samples_seen - self.speech_start)
+            self.speech_start = self.samples_seen
+        return lengths
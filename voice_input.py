@@ -1,33 +1,95 @@
-import queue
 import json
 import numpy as np
 import time
-from config import wake_words, TEST_MODE
+from config import vosk_model_path, capture_preroll_seconds, TEST_MODE
+from vad import VoiceActivityDetector
+from audio_capture import get_capture
+from whisper_input import is_wake_word
+import tracing
+
+FS = 16000
+model = None
 
 if not TEST_MODE:
     try:
-        import sounddevice as sd
         import vosk
-        # 初始化模型（需要提前下载 vosk 模型）
-        model = vosk.Model("vosk-model-small-cn-0.22")  # 中文模型
-        q = queue.Queue()
     except Exception as e:
         print(f"警告: 语音识别初始化失败: {e}")
         print("将在测试模式下运行")
         TEST_MODE = True
 
-def callback(indata, frames, time, status):
-    """回调函数：将音频数据放入队列"""
-    if status:
-        print(status)
-    q.put(bytes(indata))
+def load_model():
+    """加载 Vosk 模型（需要提前下载），首次使用时才加载
+    
+    Returns:
+        vosk.Model 实例
+    """
+    global model
+    if model is None:
+        model = vosk.Model(vosk_model_path)  # 中文模型
+    return model
+
+def to_pcm16(block):
+    """float32 音频转为 Vosk 需要的 16 位 PCM 字节"""
+    return (np.clip(block, -1.0, 1.0) * 32767).astype("<i2").tobytes()
 
-def is_wake_word(text):
-    """检查文本是否包含唤醒词"""
-    for word in wake_words:
-        if word.lower() in text.lower():
-            return True
-    return False
+def stream_transcribe(timeout=None, preroll=capture_preroll_seconds):
+    """流式识别一句话，边识别边产出中间结果
+    
+    Args:
+        timeout: 最长等待时间（秒），按真实截止时间计算，None 表示无限制
+        preroll: 从多少秒之前的录音开始识别，其中小Luna自己的声音被抹掉
+        
+    Yields:
+        (文本, 是否为最终结果)；中间结果只在内容变化时产出，最后一项一定是最终结果
+    """
+    from voice_output import echo_mask
+    deadline = None if timeout is None else time.monotonic() + timeout
+    capture = get_capture()
+    reader = capture.reader(preroll)
+    mask = echo_mask(capture)
+    rec = vosk.KaldiRecognizer(load_model(), FS)
+    vad = VoiceActivityDetector(FS)
+    speaking = False
+    partial = ""
+    final = None
+    samples = 0
+    
+    while final is None:
+        wait = 0.1 if deadline is None else deadline - time.monotonic()
+        if wait <= 0:
+            # 到截止时间仍未说完，用已识别的部分作为结果
+            final = json.loads(rec.FinalResult()).get("text", "")
+            break
+            
+        block = reader.read(min(wait, 0.1))
+        if block is None:
+            continue
+        mask.apply(block, reader.position - len(block))
+        samples += len(block)
+            
+        if rec.AcceptWaveform(to_pcm16(block)):
+            final = json.loads(rec.Result()).get("text", "")
+            break
+            
+        # VAD 判定说话结束后立即取最终结果，不必等 Kaldi 自己的端点检测
+        for event in vad.process(block):
+            if event.kind == "start":
+                speaking = True
+            elif event.kind == "end" and speaking:
+                tracing.mark("speech_end", time.perf_counter() - (samples - event.sample) / FS)
+                final = json.loads(rec.FinalResult()).get("text", "")
+        if final is not None:
+            break
+            
+        text = json.loads(rec.PartialResult()).get("partial", "")
+        if text and text != partial:
+            partial = text
+            yield partial, False
+            
+    if reader.dropped:
+        print(f"识别跟不上录音，丢失了 {reader.dropped / FS:.1f} 秒音频")
+    yield final, True
 
 def listen_for_wake_word():
     """监听唤醒词"""
@@ -43,18 +105,21 @@ def listen_for_wake_word():
     
     try:
         print("监听唤醒词中（'Hi, Luna' 或 '小Luna'）...")
-        with sd.RawInputStream(samplerate=16000, blocksize=8000, dtype='int16', 
-                            channels=1, callback=callback):
-            rec = vosk.KaldiRecognizer(model, 16000)
-            while True:
-                data = q.get()
-                if rec.AcceptWaveform(data):
-                    result = json.loads(rec.Result())
-                    text = result.get("text", "")
-                    if text:
-                        print(f"识别到: {text}")
-                        if is_wake_word(text):
-                            return True
+        reader = get_capture().reader()
+        rec = vosk.KaldiRecognizer(load_model(), FS)
+        while True:
+            block = reader.read(0.1)
+            if block is None:
+                continue
+            if rec.AcceptWaveform(to_pcm16(block)):
+                text = json.loads(rec.Result()).get("text", "")
+                if text:
+                    print(f"识别到: {text}")
+            else:
+                # 中间结果里出现唤醒词就立即唤醒，不等一句话结束
+                text = json.loads(rec.PartialResult()).get("partial", "")
+            if text and is_wake_word(text):
+                return True
     except Exception as e:
         print(f"语音监听出错: {e}")
         print("切换到测试模式...")
@@ -78,18 +143,11 @@ def transcribe_audio(timeout=None):
     
     try:    
         print("请开始说话...")
-        start_time = time.time()
-        with sd.RawInputStream(samplerate=16000, blocksize=8000, dtype='int16',
-                            channels=1, callback=callback):
-            rec = vosk.KaldiRecognizer(model, 16000)
-            while True:
-                if timeout and (time.time() - start_time) > timeout:
-                    return ""
-                    
-                data = q.get()
-                if rec.AcceptWaveform(data):
-                    result = json.loads(rec.Result())
-                    return result.get("text", "")
+        for text, final in stream_transcribe(timeout):
+            if final:
+                print(f"\r识别结果: {text}")
+                return text
+            print(f"\r识别中: {text}", end="", flush=True)
     except Exception as e:
         print(f"语音识别出错: {e}")
         print("切换到测试模式...")
@@ -1,21 +1,228 @@
-import os
 import time
+import queue
+import random
 import platform
 import asyncio
+import threading
+import subprocess
 from edge_tts import Communicate
-from config import voice_model, TEST_MODE
+from config import voice_model, tts_concurrency, tts_prewarm_phrases, TEST_MODE
+from config import playback_volume, volume_step, filler_phrases
+from text_segmenter import SentenceSegmenter, split_clauses
+from tts_cache import TTSCache
+from audio_player import AudioPlayer, decode_mp3
+import tracing
 
-async def edge_speak(text, voice=voice_model, rate="+0%"):
-    """使用 edge-tts 播放语音
+AWAKE_TEXT = "我在呢~"
+SLEEP_TEXT = "我先休息一下，有需要再叫我哦~"
+
+tts_cache = None
+player = None
+volume = playback_volume
+tts_loop = None
+tts_semaphore = None
+loop_lock = threading.Lock()
+interrupted = threading.Event()  # 本次播报被插话打断
+filler_process = None  # macOS 上正在播放垫话的 say 进程，停止播放时一并结束
+
+def get_tts_cache():
+    """获取语音合成缓存"""
+    global tts_cache
+    if tts_cache is None:
+        tts_cache = TTSCache()
+    return tts_cache
+
+def get_player():
+    """获取常驻播放器，首次调用时打开输出流"""
+    global player
+    if player is None:
+        player = AudioPlayer()
+        player.volume = volume
+        player.start()
+    return player
+
+def change_volume(steps):
+    """调整播放音量
+
+    Args:
+        steps: 调整的档数，正数调大，负数调小
+
+    Returns:
+        音量是否有变化（已到最大/最小时为 False）
+    """
+    global volume
+    new_volume = round(min(1.0, max(volume_step, volume + steps * volume_step)), 2)
+    if new_volume == volume:
+        return False
+    volume = new_volume
+    if player is not None:
+        player.volume = volume
+    print(f"音量调整为 {volume:.0%}")
+    return True
+
+def get_tts_loop():
+    """获取常驻事件循环，所有 edge-tts 请求都在这个循环里执行"""
+    global tts_loop, tts_semaphore
+    with loop_lock:
+        if tts_loop is None:
+            tts_loop = asyncio.new_event_loop()
+            tts_semaphore = asyncio.Semaphore(tts_concurrency)
+            threading.Thread(target=tts_loop.run_forever, name="tts-loop", daemon=True).start()
+    return tts_loop
+
+def submit_synthesis(text, voice=voice_model, rate="+0%", style=None):
+    """提交合成任务，不等待结果
+    
+    Returns:
+        concurrent.futures.Future，结果为 MP3 字节数据
+    """
+    loop = get_tts_loop()
+    return asyncio.run_coroutine_threadsafe(synthesize_async(text, voice, rate, style), loop)
+
+async def edge_synthesize(text, voice=voice_model, rate="+0%"):
+    """使用 edge-tts 合成语音，直接返回 MP3 数据
     
     Args:
-        text: 要播放的文本
+        text: 要合成的文本
         voice: 语音模型
         rate: 语速调整
+        
+    Returns:
+        MP3 字节数据
     """
     communicate = Communicate(text=text, voice=voice, rate=rate)
-    await communicate.save("luna_output.mp3")
-    os.system("mpg123 luna_output.mp3")
+    audio = bytearray()
+    async for chunk in communicate.stream():
+        if chunk["type"] == "audio":
+            audio.extend(chunk["data"])
+    return bytes(audio)
+
+async def synthesize_async(text, voice=voice_model, rate="+0%", style=None):
+    """合成语音，优先读取缓存，未命中时调用 edge-tts 并写入缓存
+    
+    Args:
+        text: 要合成的文本
+        voice: 语音模型
+        rate: 语速调整
+        style: 语气风格
+        
+    Returns:
+        MP3 字节数据
+    """
+    cache = get_tts_cache()
+    key = cache.make_key(text, voice, rate, style)
+    with tracing.span("tts.synthesize", chars=len(text)) as span:
+        audio = cache.get(key)
+        span.set(cached=audio is not None)
+        if audio is None:
+            async with tts_semaphore:
+                audio = await edge_synthesize(text, voice, rate)
+            cache.put(key, audio)
+    return audio
+
+def synthesize(text, voice=voice_model, rate="+0%", style=None):
+    """同步版本的 synthesize_async
+    
+    Returns:
+        MP3 字节数据
+    """
+    return submit_synthesis(text, voice, rate, style).result()
+
+def prewarm_tts(phrases=None, extra=()):
+    """预先合成固定短语，之后播放直接命中缓存
+    
+    Args:
+        phrases: 短语列表，默认为唤醒/休眠回应和 config 中的提示语
+        extra: 追加的短语（如本地意图的固定回复）
+    """
+    if phrases is None:
+        phrases = [AWAKE_TEXT, SLEEP_TEXT] + tts_prewarm_phrases + filler_phrases
+    # 整句播放（唤醒回应、垫话）和流式播报（固定回复、出错回复）都可能用到，
+    # 所以整句和分句后的每一句都预合成
+    texts = []
+    for phrase in list(phrases) + list(extra):
+        for text in [phrase] + split_clauses(phrase):
+            if text not in texts:
+                texts.append(text)
+    if TEST_MODE or platform.system() != "Linux":
+        return
+        
+    for text in texts:
+        try:
+            synthesize(text)
+        except Exception as e:
+            print(f"预合成「{text}」失败: {e}")
+    print(f"语音缓存预热完成: {get_tts_cache().stats()}")
+
+def play_audio(data):
+    """在常驻播放器上播放 MP3 数据并等待播放结束"""
+    pcm = decode_mp3(data)
+    out = get_player()
+    out.play(pcm)
+    tracing.mark("first_audio")
+    with tracing.span("playback", seconds=len(pcm) / out.samplerate):
+        out.wait()
+
+def play_filler(text=None):
+    """不等待地播放一句垫话，掩盖等待 GPT 的沉默
+    
+    只播放已缓存的垫话，未缓存时在后台合成留待下次，避免合成比回复还慢时垫话插到回复中间。
+    
+    Args:
+        text: 垫话文本，默认从 config.filler_phrases 中随机选
+        
+    Returns:
+        是否播放了
+    """
+    text = text or random.choice(filler_phrases)
+    if TEST_MODE:
+        tracing.mark("first_audio")
+        print(f"【测试模式】小Luna说: {text}")
+        return True
+        
+    system = platform.system()
+    if system == "Linux":
+        audio = get_tts_cache().get(TTSCache.make_key(text, voice_model))
+        if audio is None:
+            submit_synthesis(text)
+            return False
+        get_player().play(decode_mp3(audio))
+        tracing.mark("first_audio")
+        print(f"小Luna说: {text}")
+        return True
+    if system == "Darwin":
+        global filler_process
+        tracing.mark("first_audio")
+        filler_process = subprocess.Popen(["say", text])
+        return True
+    return False
+
+def echo_mask(capture):
+    """创建预录去回声器：按小Luna自己的播放音量抹掉录到的唤醒回应等声音，主人同时说的话保留
+
+    Args:
+        capture: AudioCapture 实例
+
+    Returns:
+        EchoMask 实例
+    """
+    from barge_in import EchoMask
+    return EchoMask(capture, player)
+
+def stop_speaking():
+    """立即停止当前播放"""
+    global filler_process
+    if player is not None:
+        player.stop()
+    if filler_process is not None:
+        if filler_process.poll() is None:
+            filler_process.terminate()
+        filler_process = None
+
+def interrupt():
+    """打断当前播报：停止播放，丢弃还没合成或还没播放的句子"""
+    interrupted.set()
+    stop_speaking()
 
 def speak_text(text):
     """跨平台文本转语音
@@ -23,24 +230,131 @@ def speak_text(text):
     Args:
         text: 要播放的文本
     """
+    interrupted.clear()
     if TEST_MODE:
+        tracing.mark("first_audio")
         print(f"【测试模式】小Luna说: {text}")
         return
         
     print(f"小Luna说: {text}")
     system = platform.system()
-
+    
     if system == "Linux":
-        asyncio.run(edge_speak(text))
+        audio = synthesize(text)
+        if not interrupted.is_set():
+            play_audio(audio)
     elif system == "Darwin":  # macOS
-        os.system(f'say "{text}"')  # Mac 用 say 播放
+        tracing.mark("first_audio")
+        subprocess.run(["say", text])  # Mac 用 say 播放，参数不经过 shell
     else:
         print("暂不支持的系统，只显示文本。")
+
+def _playback_worker(clauses, system):
+    """按顺序把已合成的句子送入播放器
+    
+    Args:
+        clauses: (句子, 合成任务) 队列，None 表示结束
+        system: 操作系统名称
+    """
+    while True:
+        item = clauses.get()
+        if item is None:
+            break
+        clause, future = item
+        if interrupted.is_set():
+            if future:
+                future.cancel()
+            continue
+        try:
+            audio = future.result() if future else None
+        except Exception as e:
+            print(f"语音合成出错，跳过「{clause}」: {e}")
+            continue
+            
+        if system == "Linux":
+            get_player().play(decode_mp3(audio))
+        elif system == "Darwin":
+            tracing.mark("first_audio")
+            subprocess.run(["say", clause])
+
+def speak_stream(tokens, voice=voice_model, rate="+0%"):
+    """流式播报：边接收 GPT 输出边分句合成，按顺序播放
+    
+    供不经过对话流水线的调用方（测试脚本等）使用；main.py 的对话由 VoicePipeline 分阶段完成。
+    
+    Args:
+        tokens: GPT 输出的增量文本迭代器
+        voice: 语音模型
+        rate: 语速调整
+        
+    Returns:
+        完整的回复文本，被插话打断时为已经收到的部分
+    """
+    start_time = time.perf_counter()
+    parts = []
+    interrupted.clear()
+    
+    if TEST_MODE:
+        for token in tokens:
+            parts.append(token)
+        text = "".join(parts)
+        tracing.mark("first_audio")
+        print(f"【测试模式】小Luna说: {text}")
+        return text
+        
+    system = platform.system()
+    if system not in ("Linux", "Darwin"):
+        text = "".join(tokens)
+        print(f"暂不支持的系统，只显示文本: {text}")
+        return text
         
+    if system == "Linux":
+        out = get_player()
+        underruns = out.underruns
+        out.begin_stream()
+        
+    clauses = queue.Queue()
+    worker = threading.Thread(target=_playback_worker, args=(clauses, system), daemon=True)
+    worker.start()
+    
+    def submit(clause):
+        print(f"小Luna说: {clause}")
+        future = submit_synthesis(clause, voice, rate) if system == "Linux" else None
+        clauses.put((clause, future))
+        
+    segmenter = SentenceSegmenter()
+    try:
+        for token in tokens:
+            if interrupted.is_set():
+                break
+            parts.append(token)
+            for clause in segmenter.feed(token):
+                submit(clause)
+        if interrupted.is_set():
+            # 被打断时停止读取 GPT 输出，流式请求随之取消
+            if hasattr(tokens, "close"):
+                tokens.close()
+        else:
+            for clause in segmenter.flush():
+                submit(clause)
+    finally:
+        clauses.put(None)
+        worker.join()
+        
+    if system == "Linux":
+        out.end_stream()
+        out.wait()
+        if out.started_at is not None:
+            tracing.mark("first_audio", out.started_at)
+            print(f"首音延迟: {(out.started_at - start_time) * 1000:.0f}ms, "
+                  f"播放中断 {out.underruns - underruns} 次")
+            
+    return "".join(parts)
+
 def say_awake():
     """播放唤醒回应"""
-    speak_text("我在呢~")
-    
+    speak_text(AWAKE_TEXT)
+
 def say_sleep():
     """播放休眠提示"""
-    speak_text("我先休息一下，有需要再叫我哦~")
+    speak_text(SLEEP_TEXT)
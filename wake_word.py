@@ -0,0 +1,229 @@
+"""
+唤醒词级联检测模块
+第一级：常驻低开销检测（Vosk 唤醒词语法 或 VAD 能量门限），在连续音频流上运行
+第二级：仅对第一级给出的候选片段调用 Whisper 确认
+"""
+import json
+import time
+import queue
+import numpy as np
+from config import wake_grammar, vosk_model_path
+from vad import VoiceActivityDetector
+
+class VoskSpotter:
+    """基于 Vosk 语法约束的唤醒词检测器
+
+    KaldiRecognizer 只在唤醒词语法内解码，开销远低于完整识别；
+    识别器在连续流上工作，唤醒词跨越录音块边界也不会漏检。
+    """
+    name = "vosk"
+
+    def __init__(self, fs=16000, grammar=wake_grammar, model_path=vosk_model_path):
+        import vosk
+        self.fs = fs
+        self.phrases = [p.replace(" ", "") for p in grammar]
+        self.model = vosk.Model(model_path)
+        self.rec = vosk.KaldiRecognizer(self.model, fs, json.dumps(grammar + ["[unk]"], ensure_ascii=False))
+
+    def _matches(self, text):
+        text = text.replace(" ", "")
+        return any(phrase and phrase in text for phrase in self.phrases)
+
+    def accept(self, block):
+        """送入一块音频
+
+        Args:
+            block: 一维 float32 音频块
+
+        Returns:
+            是否出现唤醒候选
+        """
+        pcm = (np.clip(block, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+        if self.rec.AcceptWaveform(pcm):
+            text = json.loads(self.rec.Result()).get("text", "")
+        else:
+            text = json.loads(self.rec.PartialResult()).get("partial", "")
+
+        if self._matches(text):
+            self.rec.Reset()
+            return True
+        return False
+
+    def reset(self):
+        self.rec.Reset()
+
+class EnergySpotter:
+    """基于 VAD 的候选检测器
+
+    Vosk 不可用时的退化方案：一段长度合适的有声片段结束时给出候选。
+    """
+    name = "energy"
+
+    def __init__(self, fs=16000, min_speech=0.3, max_speech=3.0):
+        self.fs = fs
+        self.min_samples = int(min_speech * fs)
+        self.max_samples = int(max_speech * fs)
+        self.vad = VoiceActivityDetector(fs, hangover_ms=300)
+
+    def accept(self, block):
+        """送入一块音频，返回是否出现唤醒候选"""
+        # 长时间连续说话时按窗口长度切段，周期性给出候选
+        lengths = self.vad.observe(block, self.max_samples)
+        return any(length >= self.min_samples for length in lengths)
+
+    def reset(self):
+        self.vad.reset()
+
+class WakeWordCascade:
+    """两级唤醒词检测
+
+    录音回调持续把音频块放入队列，Whisper 确认期间的音频不会丢失；
+    确认使用最近 window_seconds 秒的滚动窗口，窗口之间相互重叠。
+    """
+
+    def __init__(self, confirm, fs=16000, window_seconds=2.5, block_seconds=0.1, spotter=None):
+        """
+        Args:
+            confirm: 第二级确认函数，接收一维 float32 音频，返回是否为唤醒词
+            fs: 采样率
+            window_seconds: 确认窗口长度（秒）
+            block_seconds: 录音块长度（秒）
+            spotter: 第一级检测器，None 时优先 Vosk，失败则退化为能量门限
+        """
+        self.confirm = confirm
+        self.fs = fs
+        self.blocksize = int(block_seconds * fs)
+        self.window = np.zeros(int(window_seconds * fs), dtype=np.float32)
+        self.spotter = spotter or self._default_spotter(fs)
+        self.stats = {
+            "blocks": 0,
+            "candidates": 0,
+            "accepts": 0,
+            "stage1_false_accepts": 0,
+            "false_accepts": 0,
+            "false_rejects": 0,
+            "confirm_ms": 0.0,
+        }
+
+    @staticmethod
+    def _default_spotter(fs):
+        try:
+            return VoskSpotter(fs)
+        except Exception as e:
+            print(f"Vosk 唤醒检测不可用，改用能量门限: {e}")
+            return EnergySpotter(fs)
+
+    def _push(self, block):
+        """把音频块写入滚动窗口"""
+        n = len(block)
+        if n >= len(self.window):
+            self.window[:] = block[-len(self.window):]
+        else:
+            self.window[:-n] = self.window[n:]
+            self.window[-n:] = block
+
+    def process(self, block):
+        """处理一块音频
+
+        Args:
+            block: 一维 float32 音频块
+
+        Returns:
+            是否确认唤醒
+        """
+        self.stats["blocks"] += 1
+        self._push(block)
+
+        if not self.spotter.accept(block):
+            return False
+
+        self.stats["candidates"] += 1
+        start = time.perf_counter()
+        confirmed = self.confirm(self.window.copy())
+        self.stats["confirm_ms"] += (time.perf_counter() - start) * 1000
+
+        if confirmed:
+            self.stats["accepts"] += 1
+            return True
+
+        # 第一级误报：候选被 Whisper 否决
+        self.stats["stage1_false_accepts"] += 1
+        return False
+
+    def reset(self):
+        """清空滚动窗口和第一级状态"""
+        self.window[:] = 0
+        self.spotter.reset()
+
+    def listen(self, reader=None):
+        """持续监听，直到确认唤醒
+
+        Args:
+            reader: 常驻录音服务的读取器（audio_capture.CaptureReader），
+                为空时自行打开一个录音流
+
+        Returns:
+            True
+        """
+        self.reset()
+        if reader is not None:
+            while True:
+                block = reader.read(timeout=1, max_samples=self.blocksize)
+                if block is None:
+                    raise RuntimeError("麦克风超过 1 秒没有数据")
+                if self.process(block):
+                    return True
+
+        import sounddevice as sd
+
+        blocks = queue.Queue()
+
+        def callback(indata, frames, time_info, status):
+            if status:
+                print(status)
+            blocks.put(indata[:, 0].copy())
+
+        with sd.InputStream(samplerate=self.fs, blocksize=self.blocksize, dtype="float32",
+                            channels=1, callback=callback):
+            while True:
+                if self.process(blocks.get()):
+                    return True
+
+    def evaluate(self, clips):
+        """在标注片段上评估级联效果
+
+        Args:
+            clips: (音频, 是否包含唤醒词) 列表
+
+        Returns:
+            评估结果字典：片段数、误唤醒数 false_accepts、漏唤醒数 false_rejects、确认耗时
+        """
+        outcome = {"clips": 0, "false_accepts": 0, "false_rejects": 0, "confirm_ms": 0.0}
+        for audio, is_wake in clips:
+            self.reset()
+            confirm_ms = self.stats["confirm_ms"]
+            woke = False
+            audio = np.asarray(audio, dtype=np.float32).reshape(-1)
+            padded = np.concatenate([audio, np.zeros(self.blocksize * 5, dtype=np.float32)])
+            for i in range(0, len(padded), self.blocksize):
+                if self.process(padded[i:i + self.blocksize]):
+                    woke = True
+                    break
+
+            outcome["clips"] += 1
+            outcome["confirm_ms"] += self.stats["confirm_ms"] - confirm_ms
+            if woke and not is_wake:
+                outcome["false_accepts"] += 1
+                self.stats["false_accepts"] += 1
+            elif is_wake and not woke:
+                outcome["false_rejects"] += 1
+                self.stats["false_rejects"] += 1
+        return outcome
+
+    def report(self):
+        """格式化统计信息"""
+        s = self.stats
+        return (f"第一级({self.spotter.name}) 候选 {s['candidates']} 次, 确认 {s['accepts']} 次, "
+                f"第一级误报 {s['stage1_false_accepts']} 次, "
+                f"评估误唤醒 {s['false_accepts']} 次, 评估漏唤醒 {s['false_rejects']} 次, "
+                f"确认耗时共 {s['confirm_ms']:.0f}ms")
@@ -4,21 +4,20 @@ Whisper 语音识别模块
 支持中英文混合语音识别
 """
 import os
+import re
 import time
-import queue
-import tempfile
 import argparse
+import threading
 import numpy as np
-import sounddevice as sd
-from config import wake_words, TEST_MODE, openai_api_key
+from config import wake_words, wake_grammar, TEST_MODE, openai_api_key, capture_preroll_seconds
+from vad import VoiceActivityDetector
+from asr_engine import get_asr
+from audio_capture import get_capture
+import tracing
 
-try:
-    import whisper
-except ImportError:
-    print("请先安装 whisper: pip install openai-whisper")
-    print("如果安装失败，可能需要先安装 ffmpeg")
-
-model = None
+models = {}  # 模型名称 -> 已加载的模型，自动选档时可能同时存在多档
+model_lock = threading.Lock()
+wake_cascade = None
 
 def load_model(model_name="base"):
     """加载 Whisper 模型
@@ -29,12 +28,110 @@ def load_model(model_name="base"):
     Returns:
         加载的模型
     """
-    global model
-    if model is None:
-        print(f"正在加载 Whisper {model_name} 模型...")
-        model = whisper.load_model(model_name)
-        print("模型加载完成")
-    return model
+    # 启动时可能在后台线程预加载，加锁避免重复加载
+    with model_lock:
+        if model_name not in models:
+            # whisper 会连带导入 torch，耗时较长，到真正需要时才导入
+            try:
+                import whisper
+            except ImportError:
+                print("请先安装 whisper: pip install openai-whisper")
+                print("如果安装失败，可能需要先安装 ffmpeg")
+                raise
+            print(f"正在加载 Whisper {model_name} 模型...")
+            models[model_name] = whisper.load_model(model_name)
+            print("模型加载完成")
+    return models[model_name]
+
+def unload_model(model_name):
+    """释放不再使用的模型"""
+    with model_lock:
+        models.pop(model_name, None)
+
+def trim_silence(audio, fs=16000, threshold=0.01, frame_ms=20, pad_ms=200):
+    """裁剪首尾静音
+
+    按帧计算平均幅度，保留第一帧到最后一帧有声部分，两端各留 pad_ms 余量。
+    返回原数组的切片视图，不复制数据。
+
+    Args:
+        audio: 一维 float32 音频
+        fs: 采样率
+        threshold: 静音阈值（平均幅度）
+        frame_ms: 帧长（毫秒）
+        pad_ms: 两端保留的余量（毫秒）
+
+    Returns:
+        裁剪后的音频，全部为静音时返回空数组
+    """
+    frame_len = max(1, int(fs * frame_ms / 1000))
+    n_frames = len(audio) // frame_len
+    if n_frames == 0:
+        return audio[:0]
+
+    frames = np.abs(audio[:n_frames * frame_len]).reshape(n_frames, frame_len)
+    voiced = np.flatnonzero(frames.mean(axis=1) > threshold)
+    if len(voiced) == 0:
+        return audio[:0]
+
+    pad = int(fs * pad_ms / 1000)
+    start = max(0, voiced[0] * frame_len - pad)
+    end = min(len(audio), (voiced[-1] + 1) * frame_len + pad)
+    return audio[start:end]
+
+def transcribe_buffer(audio, fs=16000, model_name="base", language="zh"):
+    """直接识别内存中的录音数据
+
+    不写临时 WAV 文件，也不经过 ffmpeg 解码，numpy 数组直接送入 Whisper。
+
+    Args:
+        audio: sd.rec 得到的 float32 录音（一维或 (n, 1)）
+        fs: 采样率
+        model_name: Whisper 模型名称
+        language: 识别语言
+
+    Returns:
+        (识别文本, 各阶段耗时字典，单位毫秒)
+    """
+    timings = {}
+
+    t0 = time.perf_counter()
+    audio = np.asarray(audio, dtype=np.float32).reshape(-1)
+    if fs != 16000:
+        # Whisper 只接受 16kHz，线性插值重采样
+        positions = np.arange(0, len(audio), fs / 16000)
+        audio = np.interp(positions, np.arange(len(audio)), audio).astype(np.float32)
+        fs = 16000
+    timings["prepare"] = (time.perf_counter() - t0) * 1000
+
+    t0 = time.perf_counter()
+    audio = trim_silence(audio, fs)
+    timings["trim"] = (time.perf_counter() - t0) * 1000
+
+    if len(audio) == 0:
+        timings["decode"] = 0.0
+        return "", timings
+
+    t0 = time.perf_counter()
+    with tracing.span("asr.decode", model=model_name, audio_ms=len(audio) * 1000 // fs):
+        model = load_model(model_name)
+        result = model.transcribe(np.ascontiguousarray(audio), language=language)
+    timings["decode"] = (time.perf_counter() - t0) * 1000
+
+    return result["text"].strip(), timings
+
+def format_timings(timings):
+    """格式化阶段耗时，用于日志输出"""
+    return ", ".join(f"{stage} {ms:.1f}ms" for stage, ms in timings.items())
+
+# 比较前去掉空白和标点：Vosk 按字以空格分隔输出（「小 露 娜」），Whisper 常带标点（「Hi, Luna!」）
+WAKE_NOISE = re.compile(r"[\s,，、.。!！?？~～]")
+
+def normalize_wake_text(text):
+    return WAKE_NOISE.sub("", text.lower())
+
+# 唤醒词本身加上 Vosk 唤醒词语法中的中文读法，二级确认无论选中哪种识别引擎都能匹配
+WAKE_PHRASES = [normalize_wake_text(word) for word in wake_words + wake_grammar]
 
 def is_wake_word(text):
     """检查文本是否包含唤醒词
@@ -45,16 +142,41 @@ def is_wake_word(text):
     Returns:
         是否包含唤醒词
     """
-    for word in wake_words:
-        if word.lower() in text.lower():
+    text = normalize_wake_text(text)
+    for phrase in WAKE_PHRASES:
+        if phrase and phrase in text:
             return True
     return False
 
-def listen_for_wake_word(model_name="base"):
+def get_wake_cascade(engine=None):
+    """获取唤醒词级联检测器，第二级使用完整识别确认
+    
+    Args:
+        engine: 识别引擎名称（如 "whisper-base"、"vosk"），为空时自动选择
+        
+    Returns:
+        WakeWordCascade 实例
+    """
+    global wake_cascade
+    if wake_cascade is None:
+        from wake_word import WakeWordCascade
+        
+        asr = get_asr(engine)
+        
+        def confirm(audio):
+            text, timings = asr.transcribe(audio, 16000)
+            if text:
+                print(f"\n识别到: {text} ({format_timings(timings)})")
+            return is_wake_word(text)
+        
+        wake_cascade = WakeWordCascade(confirm)
+    return wake_cascade
+
+def listen_for_wake_word(engine=None):
     """监听唤醒词
     
     Args:
-        model_name: Whisper 模型名称
+        engine: 识别引擎名称，为空时自动选择
         
     Returns:
         是否检测到唤醒词
@@ -72,30 +194,10 @@ def listen_for_wake_word(model_name="base"):
     try:
         print("监听唤醒词中（'Hi, Luna' 或 '小Luna'）...")
         
-        model = load_model(model_name)
-        
-        fs = 16000  # 采样率
-        duration = 3  # 每次录音时长（秒）
-        
-        while True:
-            print(".", end="", flush=True)
-            recording = sd.rec(int(duration * fs), samplerate=fs, channels=1)
-            sd.wait()
-            
-            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
-                temp_filename = temp_file.name
-                import scipy.io.wavfile as wav
-                wav.write(temp_filename, fs, recording)
-            
-            result = model.transcribe(temp_filename, language="zh")
-            text = result["text"].strip()
-            
-            os.unlink(temp_filename)
-            
-            if text:
-                print(f"\n识别到: {text}")
-                if is_wake_word(text):
-                    return True
+        cascade = get_wake_cascade(engine)
+        cascade.listen(get_capture().reader())
+        print(cascade.report())
+        return True
                     
     except Exception as e:
         print(f"\n语音监听出错: {e}")
@@ -103,12 +205,91 @@ def listen_for_wake_word(model_name="base"):
         TEST_MODE = True
         return listen_for_wake_word()
 
-def transcribe_audio(timeout=None, model_name="base"):
+def record_utterance(timeout=None, barge_in=None):
+    """从常驻录音中截取一句话（VAD 判断开始和结束），不做识别
+    
+    Args:
+        timeout: 最大录音时间（秒），None 表示无限制
+        barge_in: 插话事件（BargeInEvent），给出时从插话开始处读取录音
+        
+    Returns:
+        (录音, 采样率)，没有检测到说话或超时返回 None
+    """
+    print("请开始说话...")
+    
+    capture = get_capture()
+    fs = capture.fs  # 采样率
+    max_duration = 10  # 最大录音时长（秒）
+    no_speech_duration = 1.5  # 一直没开始说话时的最长等待（秒）
+    pad = int(0.3 * fs)  # 语音段前后保留的余量
+    
+    mask = None
+    if barge_in is not None:
+        # 插话的开头是在小Luna说话时录下的，直接从插话开始处读，噪声底沿用说话前的测量
+        reader = capture.reader(start=barge_in.sample - pad)
+        vad = VoiceActivityDetector(fs)
+        vad.noise_floor = barge_in.noise_floor
+    else:
+        # 从常驻录音的缓冲区读取，带上预录音频（唤醒回应播放期间说的话也在内）
+        from voice_output import echo_mask
+        reader = capture.reader(capture_preroll_seconds)
+        vad = VoiceActivityDetector(fs)
+        mask = echo_mask(capture)
+    preroll = reader.preroll_samples
+    chunks = []
+    captured = 0
+    speech_start = None
+    speech_end = None
+    
+    print("正在录音...", end="", flush=True)
+    while speech_end is None:
+        block = reader.read(timeout=1)
+        if block is None:
+            raise RuntimeError("麦克风超过 1 秒没有数据")
+        if mask is not None:
+            # 小Luna自己的声音不能触发 VAD，也不送去识别
+            mask.apply(block, reader.position - len(block))
+        chunks.append(block)
+        captured += len(block)
+        
+        for event in vad.process(block):
+            if event.kind == "start" and speech_start is None:
+                speech_start = event.sample
+                print(".", end="", flush=True)
+            elif event.kind == "end" and speech_start is not None:
+                speech_end = event.sample
+                # 说话实际结束于 VAD 静音判定之前，首音延迟从这里算起
+                tracing.mark("speech_end", time.perf_counter() - (captured - speech_end) / fs)
+        
+        # 时长限制从调用时刻算起，不含预录部分
+        live = captured - preroll
+        if timeout and live > timeout * fs:
+            print("\n录音超时")
+            return None
+            
+        if live >= max_duration * fs:
+            break
+            
+        if speech_start is None and live > no_speech_duration * fs:
+            break
+        
+    print("\n录音结束，正在识别...")
+    
+    if speech_start is None:
+        print("识别结果: (未检测到说话)")
+        return None
+    
+    recording = np.concatenate(chunks)
+    end = len(recording) if speech_end is None else speech_end + pad
+    return recording[max(0, speech_start - pad):end], fs
+
+def transcribe_audio(timeout=None, engine=None, barge_in=None):
     """录音并转换为文字
     
     Args:
         timeout: 最大录音时间（秒），None 表示无限制
-        model_name: Whisper 模型名称
+        engine: 识别引擎名称，为空时自动选择
+        barge_in: 插话事件（BargeInEvent），给出时从插话开始处读取录音
         
     Returns:
         str: 识别出的文本
@@ -120,63 +301,14 @@ def transcribe_audio(timeout=None, model_name="base"):
         return input("> ")
     
     try:
-        print("请开始说话...")
-        
-        model = load_model(model_name)
-        
-        fs = 16000  # 采样率
-        max_duration = 10  # 最大录音时长（秒）
-        
-        start_time = time.time()
-        recording = sd.rec(int(max_duration * fs), samplerate=fs, channels=1)
-        
-        print("正在录音...", end="", flush=True)
-        silence_threshold = 0.01
-        silence_duration = 0
-        last_audio_time = time.time()
-        
-        while True:
-            current_time = time.time()
-            elapsed = current_time - start_time
-            
-            if timeout and elapsed > timeout:
-                sd.stop()
-                print("\n录音超时")
-                return ""
-                
-            if elapsed >= max_duration:
-                break
-                
-            current_position = int(elapsed * fs)
-            if current_position < len(recording):
-                current_volume = np.abs(recording[current_position-100:current_position]).mean() if current_position > 100 else 0
-                
-                if current_volume > silence_threshold:
-                    silence_duration = 0
-                    last_audio_time = current_time
-                    print(".", end="", flush=True)
-                else:
-                    silence_duration = current_time - last_audio_time
-                    
-                if silence_duration > 1.5 and elapsed > 1:  # 确保至少录了1秒
-                    break
-                    
-            time.sleep(0.1)
-            
-        sd.stop()
-        print("\n录音结束，正在识别...")
-        
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
-            temp_filename = temp_file.name
-            import scipy.io.wavfile as wav
-            wav.write(temp_filename, fs, recording)
-        
-        result = model.transcribe(temp_filename, language="zh")
-        text = result["text"].strip()
+        asr = get_asr(engine)
+        recorded = record_utterance(timeout, barge_in)
+        if recorded is None:
+            return ""
         
-        os.unlink(temp_filename)
+        text, timings = asr.transcribe(*recorded)
         
-        print(f"识别结果: {text}")
+        print(f"识别结果: {text} ({format_timings(timings)})")
         return text
         
     except Exception as e:
@@ -189,7 +321,7 @@ def main():
     """测试入口"""
     parser = argparse.ArgumentParser(description="Whisper 语音识别测试")
     parser.add_argument("--test", action="store_true", help="启用测试模式")
-    parser.add_argument("--model", default="base", help="Whisper 模型名称 (tiny, base, small, medium, large)")
+    parser.add_argument("--engine", default=None, help="识别引擎 (whisper-tiny, whisper-base, whisper-small, vosk)，默认自动选择")
     args = parser.parse_args()
     
     if args.test:
@@ -200,7 +332,7 @@ def main():
     try:
         while True:
             print("\n===== Whisper 语音识别测试 =====")
-            text = transcribe_audio(model_name=args.model)
+            text = transcribe_audio(engine=args.engine)
             print(f"识别结果: {text}")
             
             if text.lower() in ["退出", "exit", "quit"]: